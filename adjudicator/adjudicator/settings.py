@@ -1,6 +1,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import tempfile
 import geoip2.database
 import dj_database_url  # Add this import at the top
 
@@ -29,15 +30,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'debate.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'debate.middleware.EUBlockerMiddleware',
+    'debate.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debate.middleware.EUBlockerMiddleware',
 ]
 
 ROOT_URLCONF = 'adjudicator.urls'
@@ -62,6 +65,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'adjudicator.wsgi.application'
+ASGI_APPLICATION = 'adjudicator.asgi.application'
 
 if os.getenv('DATABASE_URL', '').startswith('postgres://'):
     DATABASES = {
@@ -76,6 +80,15 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Take the write lock when a transaction starts, so concurrent
+            # read-then-write transactions (votes) wait for each other instead
+            # of failing, and allow them to wait longer than the default 5s
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # The default in-memory test database fails concurrent writers
+            # with "table is locked" instead of waiting, which the thread
+            # contention tests need. The pid keeps concurrent test runs on
+            # one machine from sharing it.
+            'TEST': {'NAME': os.path.join(tempfile.gettempdir(), f'adjudicator_test_{os.getpid()}.sqlite3')},
         }
     }
 
@@ -114,4 +127,235 @@ STATICFILES_DIRS = [
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Add this for static files
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# Logging
+# LLM call records are written as JSON lines to a daily-rotating file through
+# a queue, so request threads never wait on disk I/O.
+# Forked processes (Celery prefork children) each write their own
+# llm_calls.<pid>.log instead of sharing the parent's file.
+LOG_DIR = os.path.join(BASE_DIR, 'logs')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'debate.log_handlers.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'level': 'WARNING',
+        },
+        'llm_calls_file': {
+            'class': 'debate.log_handlers.QueuedTimedRotatingFileHandler',
+            'filename': os.path.join(LOG_DIR, 'llm_calls.log'),
+            'when': 'midnight',
+            'backupCount': 14,
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'llm_calls': {
+            'handlers': ['llm_calls_file', 'console'],
+            'level': os.getenv('LLM_LOG_LEVEL', 'DEBUG'),
+            'propagate': False,
+        },
+    },
+}
+
+
+# LLM response cache
+# BACKEND is one of 'locmem' (in-process LRU), 'django' (the CACHES alias
+# below), 'redis' (LOCATION is a redis:// URL) or 'none'.
+LLM_CACHE = {
+    'BACKEND': os.getenv('LLM_CACHE_BACKEND', 'locmem'),
+    'TTL': int(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+    'MAX_ENTRIES': int(os.getenv('LLM_CACHE_MAX_ENTRIES', '512')),
+    'ALIAS': 'default',
+    'LOCATION': os.getenv('REDIS_URL', ''),
+}
+
+
+# LLM provider. 'live' calls OpenRouter/Gemini; 'replay' serves responses
+# recorded in llm_interactions_* and debates_* exports (see
+# debate/services/replay.py), so the pipeline runs offline, e.g. for
+# bench_pipeline. Each replayed call waits LATENCY seconds, plus or minus up
+# to JITTER, streamed in CHUNK_CHARS pieces. Replayed responses bypass the
+# LLM cache and the provider rate limits.
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'live')
+LLM_REPLAY = {
+    # None means every matching export in the working directory
+    'INTERACTION_FILES': None,
+    'DEBATE_FILES': None,
+    'LATENCY': float(os.getenv('LLM_REPLAY_LATENCY', '0')),
+    'JITTER': float(os.getenv('LLM_REPLAY_JITTER', '0')),
+    'CHUNK_CHARS': int(os.getenv('LLM_REPLAY_CHUNK_CHARS', '200')),
+}
+
+# Retrying failed LLM calls (see debate/services/retry.py). Provider errors
+# wait BASE_DELAY seconds, multiplied by MULTIPLIER per attempt up to
+# MAX_DELAY, each wait shortened at random by up to a JITTER fraction. A
+# Retry-After from the provider is honoured up to MAX_RETRY_AFTER seconds;
+# longer ones fail the call. All calls of one analysis share a budget of
+# BUDGET_RETRIES retries and BUDGET_SECONDS of waiting. With REPAIR, a
+# response missing some of its tags is fixed by asking for just those.
+LLM_RETRY = {
+    'BASE_DELAY': float(os.getenv('LLM_RETRY_BASE_DELAY', '1')),
+    'MAX_DELAY': float(os.getenv('LLM_RETRY_MAX_DELAY', '30')),
+    'MULTIPLIER': float(os.getenv('LLM_RETRY_MULTIPLIER', '2')),
+    'JITTER': float(os.getenv('LLM_RETRY_JITTER', '0.5')),
+    'MAX_RETRY_AFTER': float(os.getenv('LLM_RETRY_MAX_RETRY_AFTER', '60')),
+    'BUDGET_RETRIES': int(os.getenv('LLM_RETRY_BUDGET_RETRIES', '6')),
+    'BUDGET_SECONDS': float(os.getenv('LLM_RETRY_BUDGET_SECONDS', '120')),
+    'REPAIR': os.getenv('LLM_RETRY_REPAIR', 'True') == 'True',
+}
+
+
+# Django cache, used for rendered page fragments (and the LLM cache's 'django' backend)
+# CACHE_BACKEND is one of 'locmem', 'file' or 'redis'. locmem is per process,
+# so vote invalidation only reaches the worker that handled the vote; use
+# redis when running more than one worker.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '2000'))},
+        }
+    }
+
+# Seconds a rendered result page fragment is kept (vote fragments are also
+# dropped as soon as a vote is cast)
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', str(24 * 3600)))
+# Seconds the hall of fame listing may lag behind votes
+HALL_OF_FAME_CACHE_TTL = int(os.getenv('HALL_OF_FAME_CACHE_TTL', '60'))
+
+
+# Analysis job queue
+# Analyses run on Celery workers when a broker is configured. Without one
+# (local development) they fall back to a background thread in the web
+# process, which does not survive restarts.
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', os.getenv('REDIS_URL', ''))
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_IGNORE_RESULT = True
+ANALYSIS_QUEUE = os.getenv(
+    'ANALYSIS_QUEUE',
+    'celery' if CELERY_BROKER_URL or CELERY_TASK_ALWAYS_EAGER else 'thread'
+)
+# A pending or running job with no progress for this many seconds is taken
+# to be lost (worker killed, broker down, thread crashed), and its progress
+# stream ends with an error instead of waiting forever
+ANALYSIS_STALE_SECONDS = int(os.getenv('ANALYSIS_STALE_SECONDS', '600'))
+
+
+# Maximum database queries per request, by URL name (see QueryBudgetMiddleware).
+# Set QUERY_BUDGET_STRICT=True (e.g. in tests) to raise instead of logging.
+QUERY_BUDGET = {
+    'DEFAULT': None,
+    'VIEWS': {
+        'home': 5,
+        'result': 8,
+        'hall_of_fame': 3,
+        'update_approval': 8,
+    },
+    'STRICT': os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True',
+}
+
+
+# Vote ingestion
+# 'direct' applies each vote to the debate's counters in its own transaction.
+# 'buffered' only writes the voter's ApprovalRecord and marks the debate as
+# dirty; counters are recomputed from the records in batches. The buffer is
+# 'memory' (per process, flushed by a timer thread every FLUSH_INTERVAL
+# seconds) or 'redis' (shared, flushed by the flush_votes command or the
+# Celery beat schedule below). The schedule only runs with a beat process,
+# the Procfile's `beat`, of which exactly one must be running; workers do
+# not flush by themselves.
+VOTE_MODE = os.getenv('VOTE_MODE', 'direct')
+VOTE_BUFFER = {
+    'BACKEND': os.getenv('VOTE_BUFFER_BACKEND', 'memory'),
+    'LOCATION': os.getenv('REDIS_URL', ''),
+    'FLUSH_INTERVAL': float(os.getenv('VOTE_FLUSH_INTERVAL', '5')),
+}
+CELERY_BEAT_SCHEDULE = {
+    'flush-votes': {
+        'task': 'debate.tasks.flush_votes',
+        'schedule': VOTE_BUFFER['FLUSH_INTERVAL'],
+    },
+} if VOTE_MODE == 'buffered' and VOTE_BUFFER['BACKEND'] == 'redis' else {}
+
+
+# Rate limits, as token buckets refilled at RATE tokens per second up to BURST.
+# ANALYSIS_PER_IP and ANALYSIS_GLOBAL turn away analysis requests with a 429
+# and Retry-After; PROVIDERS paces outbound LLM calls, which wait for a token
+# instead of failing. A RATE of 0 disables a limit. BACKEND is 'memory' (per
+# process) or 'redis' (shared by all workers).
+RATE_LIMIT = {
+    'BACKEND': os.getenv('RATE_LIMIT_BACKEND', 'memory'),
+    'LOCATION': os.getenv('REDIS_URL', ''),
+    'ANALYSIS_PER_IP': {
+        'RATE': float(os.getenv('RATE_LIMIT_IP_PER_MINUTE', '4')) / 60,
+        'BURST': int(os.getenv('RATE_LIMIT_IP_BURST', '3')),
+    },
+    'ANALYSIS_GLOBAL': {
+        'RATE': float(os.getenv('RATE_LIMIT_GLOBAL_PER_MINUTE', '60')) / 60,
+        'BURST': int(os.getenv('RATE_LIMIT_GLOBAL_BURST', '20')),
+    },
+    'PROVIDERS': {
+        'gemini': {
+            'RATE': float(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '60')) / 60,
+            'BURST': int(os.getenv('GEMINI_BURST', '10')),
+        },
+        'openrouter': {
+            'RATE': float(os.getenv('OPENROUTER_REQUESTS_PER_MINUTE', '120')) / 60,
+            'BURST': int(os.getenv('OPENROUTER_BURST', '20')),
+        },
+    },
+}
+
+
+# EU blocking (see EUBlockerMiddleware). Without the GeoLite2 database file
+# no requests are blocked. PRECOMPILE reads the EU ranges out of the database
+# at startup so lookups are a binary search instead of a database read.
+# Decisions for the last CACHE_SIZE addresses are cached.
+GEOIP = {
+    'DB_PATH': os.getenv('GEOIP_DB_PATH', os.path.join(BASE_DIR, 'GeoLite2-Country.mmdb')),
+    'PRECOMPILE': os.getenv('GEOIP_PRECOMPILE', 'False') == 'True',
+    'CACHE_SIZE': int(os.getenv('GEOIP_CACHE_SIZE', '4096')),
+    # Never checked: static files, the progress stream of an analysis that
+    # was already let through when it was submitted, and metrics scrapes
+    'EXEMPT_PATHS': [STATIC_URL, '/favicon.ico'],
+    'EXEMPT_GET_PATHS': ['/analyze-stream/', '/metrics'],
+}
+
+
+# Metrics served at /metrics in the Prometheus text format. Each process
+# keeps its own counts; with DIR set they are also written there (at most
+# every FLUSH_INTERVAL seconds) and /metrics adds up every process's file,
+# so set it to a directory shared by the web and Celery workers of a host,
+# and empty it on deploy. TOKEN, if set, must be sent as a bearer token.
+METRICS = {
+    'DIR': os.getenv('METRICS_DIR', ''),
+    'FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', '10')),
+    'TOKEN': os.getenv('METRICS_TOKEN', ''),
+}
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DebateConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'debate'
+
+    def ready(self):
+        # Load and pre-render the prompt templates once per process
+        from .services.prompts import get_registry
+        get_registry()
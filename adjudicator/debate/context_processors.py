@@ -1,21 +1,18 @@
-print("Loading context processors module!")  # This will print when the module is imported
+from django.utils.functional import SimpleLazyObject
 
 def debate_context(request):
-    """Make debate context available to all templates"""
-    print("Context processor called!")  # This should print for every request
-    context = {}
-    if hasattr(request, 'resolver_match') and request.resolver_match:
-        print(f"URL name: {request.resolver_match.url_name}")
-        if request.resolver_match.url_name == 'result':
-            debate_id = request.resolver_match.kwargs.get('debate_id')
-            print(f"Debate ID: {debate_id}")
-            from .models import Debate
-            try:
-                debate = Debate.objects.get(id=debate_id)
-                print(f"Found debate, original text length: {len(debate.original_text)}")
-                context['original_text'] = debate.original_text
-            except Debate.DoesNotExist:
-                print("Debate not found")
-                pass
-    print(f"Context returned: {context}")
-    return context 
\ No newline at end of file
+    """
+    Make the debate being viewed available to all templates
+    
+    Views that show a debate attach it to the request as request.debate, so
+    this shares their instance instead of querying for it again. Values are
+    lazy and are only read if a template uses them and the view did not
+    already pass them.
+    """
+    debate = getattr(request, 'debate', None)
+    if debate is None:
+        return {}
+    return {
+        'debate': debate,
+        'original_text': SimpleLazyObject(lambda: debate.original_text)
+    }
@@ -0,0 +1,78 @@
+import os
+import json
+import queue
+import atexit
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as a single JSON object, including any `extra` fields"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class QueuedTimedRotatingFileHandler(QueueHandler):
+    """
+    Daily-rotating file handler that never blocks the calling thread.
+
+    Records are formatted on the caller's side and pushed onto an in-memory
+    queue; a QueueListener thread owns the underlying file and does all disk
+    I/O. Intended to be configured once through Django's LOGGING setting.
+
+    The listener thread does not survive a fork, so a forked process (e.g. a
+    Celery prefork child) starts its own on its first record and writes to
+    <name>.<pid>.log next to the configured file. Every file then has a
+    single writer, which also rotates it.
+    """
+
+    def __init__(self, filename, when='midnight', backupCount=14, encoding='utf-8'):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        super().__init__(queue.SimpleQueue())
+        self.filename = filename
+        self.rotation = {'when': when, 'backupCount': backupCount, 'encoding': encoding}
+        self.pid = None
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        filename = self.filename
+        if self.pid is not None:
+            root, ext = os.path.splitext(filename)
+            filename = f'{root}.{os.getpid()}{ext}'
+        self.pid = os.getpid()
+        # Records queued in the parent before the fork are its to write
+        self.queue = queue.SimpleQueue()
+        self.file_handler = TimedRotatingFileHandler(filename, delay=True, **self.rotation)
+        self.listener = QueueListener(self.queue, self.file_handler)
+        self.listener.start()
+
+    def emit(self, record):
+        # Handler.handle holds self.lock, which logging re-creates after a fork
+        if self.listener is not None and self.pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def close(self):
+        if self.listener is not None:
+            if self.pid == os.getpid():
+                self.listener.stop()
+                self.file_handler.close()
+            self.listener = None
+        super().close()
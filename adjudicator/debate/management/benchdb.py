@@ -0,0 +1,69 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases
+from debate.management.exports import find_exports, iter_records
+from debate.models import Debate
+
+
+@contextmanager
+def bench_database(verbosity=0, on_disk=False):
+    """
+    Run the enclosed block against a throwaway test database
+    
+    SQLite test databases are shared-cache in-memory databases, which fail
+    concurrent writers with "table is locked" instead of waiting. Pass
+    on_disk=True to use a temporary file instead when threads write.
+    """
+    connection = connections['default']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if on_disk and connection.vendor == 'sqlite':
+            test_settings['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        old_config = setup_databases(verbosity=verbosity, interactive=False, aliases={'default'})
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity=verbosity)
+            test_settings['NAME'] = old_name
+
+
+def seed_debates(files=None, copies=1):
+    """
+    Fill the database with debates from debates_* exports
+
+    Exports do not carry the formatted outputs, so the raw evaluation and
+    judgment are used in their place. Every other debate gets a positive
+    score so the hall of fame has something to show.
+
+    Returns:
+        list: The ids of the created debates
+    """
+    files = files or find_exports()
+    records = [record for path in files for record in iter_records(path)]
+
+    debates = []
+    for copy in range(copies):
+        for i, record in enumerate(records):
+            debates.append(Debate(
+                original_text=record['original_text'],
+                belligerent_1=record['belligerent_1'] or '',
+                belligerent_2=record['belligerent_2'] or '',
+                summary_1=record['summary_1'] or '',
+                summary_2=record['summary_2'] or '',
+                winner=record['winner'] or '',
+                credit_cost=Decimal(record.get('credit_cost') or '1.00'),
+                analysis=record['analysis'],
+                evaluation=record['evaluation'],
+                judgment=record['judgment'],
+                title=record.get('title') or f"{record['belligerent_1']} vs {record['belligerent_2']}",
+                evaluation_formatted=record['evaluation'],
+                judgment_formatted=record['judgment'],
+                evaluation_approvals=(copy + i) % 2,
+                judgment_approvals=(copy + i) % 3,
+                total_score=(copy + i) % 2 + (copy + i) % 3
+            ))
+    return [debate.id for debate in Debate.objects.bulk_create(debates, batch_size=500)]
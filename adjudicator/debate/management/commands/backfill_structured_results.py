@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from debate.models import Debate
+from debate.services.analysis import build_structured_results, STRUCTURED_RESULTS_VERSION
+
+
+class Command(BaseCommand):
+    help = 'Parse and store evaluation tables and advice for debates that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows written per bulk update')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-parse every debate, not only those missing current results')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        debates = Debate.objects.only('id', 'evaluation_formatted', 'judgment_formatted', 'judgment', 'structured_results')
+        if not options['force']:
+            debates = debates.filter(
+                Q(structured_results__isnull=True) | ~Q(structured_results__version=STRUCTURED_RESULTS_VERSION)
+            )
+
+        updated = 0
+        failed = 0
+        batch = []
+        for debate in debates.order_by('id').iterator(chunk_size=batch_size):
+            debate.structured_results = build_structured_results(
+                debate.evaluation_formatted, debate.judgment_formatted, debate.judgment
+            )
+            if debate.structured_results['evaluation_tables'] is None:
+                failed += 1
+            batch.append(debate)
+            if len(batch) >= batch_size:
+                updated += Debate.objects.bulk_update(batch, ['structured_results'])
+                batch = []
+        if batch:
+            updated += Debate.objects.bulk_update(batch, ['structured_results'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored structured results for {updated} debates ({failed} without parsable evaluation tables)'
+        ))
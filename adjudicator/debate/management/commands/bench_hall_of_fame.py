@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.db import models
+from debate.management.benchdb import bench_database
+from debate.models import Debate
+
+
+class Command(BaseCommand):
+    help = 'Compare the hall of fame queries on a large synthetic debate table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1_000_000, help='Synthetic debates to create')
+        parser.add_argument('--positive', type=float, default=0.01,
+                            help='Fraction of debates with a positive score')
+        parser.add_argument('--page', type=int, default=100, help='Page number used for the deep page comparison')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+
+    def seed(self, count, positive, batch_size):
+        rng = random.Random(0)
+        created = 0
+        while created < count:
+            batch = []
+            for _ in range(min(batch_size, count - created)):
+                score = rng.randint(1, 5) if rng.random() < positive else -rng.randint(0, 3)
+                approvals = max(score, 0)
+                disapprovals = max(-score, 0)
+                batch.append(Debate(
+                    original_text='x' * 2000,
+                    belligerent_1='A',
+                    belligerent_2='B',
+                    summary_1='',
+                    summary_2='',
+                    winner='A',
+                    credit_cost=Decimal('1.00'),
+                    title=f'Synthetic debate {created}',
+                    judgment_approvals=approvals,
+                    judgment_disapprovals=disapprovals,
+                    total_score=score
+                ))
+                created += 1
+            Debate.objects.bulk_create(batch)
+            self.stdout.write(f'\rSeeded {created}/{count}', ending='')
+        self.stdout.write('')
+
+    def time(self, label, make_queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = list(make_queryset())
+            timings.append(time.perf_counter() - start)
+        plan = ' / '.join(line.strip() for line in make_queryset().explain().splitlines())
+        self.stdout.write(f'{label:30} {statistics.median(timings) * 1000:9.2f} ms  {len(rows):3} rows  plan: {plan}')
+
+    def handle(self, *args, **options):
+        page_size = 10
+        page = options['page']
+        repeat = options['repeat']
+
+        def legacy():
+            return Debate.objects.annotate(
+                score=models.F('evaluation_approvals') - models.F('evaluation_disapprovals') +
+                      models.F('judgment_approvals') - models.F('judgment_disapprovals')
+            ).filter(score__gt=0).order_by('-created_at')
+
+        with bench_database():
+            self.seed(options['count'], options['positive'], options['batch_size'])
+            # The key of the last row on the page before the deep page, found once
+            last = Debate.objects.top_recent()[page * page_size - 1:page * page_size].get()
+
+            self.time('first page, expression', lambda: legacy()[:page_size], repeat)
+            self.time('first page, total_score', lambda: Debate.objects.summaries().top_recent()[:page_size], repeat)
+            self.time(f'page {page + 1}, expression offset',
+                      lambda: legacy()[page * page_size:(page + 1) * page_size], repeat)
+            self.time(f'page {page + 1}, keyset',
+                      lambda: Debate.objects.summaries().top_recent((last.created_at, last.id))[:page_size], repeat)
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import google.generativeai as genai
+from django.conf import settings
+from django.test.utils import override_settings
+from debate.services import clients
+from debate.services.ratelimit import reset_rate_limiter
+
+STUB_RESPONSE = json.dumps({
+    'choices': [{'message': {'content': '<winner>P1</winner>'}}]
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Minimal OpenRouter stand-in that answers every POST instantly"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(STUB_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(STUB_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Compare per-call overhead of bare requests.post against the pooled LLM client layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help='Number of calls per variant')
+
+    def _time(self, fn, calls):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        return (time.perf_counter() - start) / calls * 1000
+
+    def handle(self, *args, **options):
+        calls = options['calls']
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        url = f'http://127.0.0.1:{server.server_port}/api/v1/chat/completions'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # The provider quotas would otherwise make the pooled calls wait on
+        # the token bucket, and the comparison would measure that instead
+        unthrottled = override_settings(RATE_LIMIT={**getattr(settings, 'RATE_LIMIT', {}), 'PROVIDERS': {}})
+        try:
+            clients.reset_clients()
+            payload = {'model': clients.OPENROUTER_MODEL, 'messages': []}
+
+            bare_ms = self._time(lambda: requests.post(url, json=payload).json(), calls)
+            with unthrottled:
+                reset_rate_limiter()
+                pooled_ms = self._time(lambda: clients.openrouter_chat('system', 'prompt', url=url).json(), calls)
+
+            def build_gemini():
+                genai.configure(api_key='bench')
+                genai.GenerativeModel(clients.GEMINI_MODEL)
+
+            gemini_fresh_ms = self._time(build_gemini, calls)
+            clients.reset_clients()
+            gemini_cached_ms = self._time(clients.get_gemini_model, calls)
+        finally:
+            server.shutdown()
+            clients.reset_clients()
+            reset_rate_limiter()
+
+        self.stdout.write(f'OpenRouter stub, new connection per call: {bare_ms:.3f} ms/call')
+        self.stdout.write(f'OpenRouter stub, pooled keep-alive session: {pooled_ms:.3f} ms/call')
+        self.stdout.write(f'Gemini configure + GenerativeModel per call: {gemini_fresh_ms:.3f} ms/call')
+        self.stdout.write(f'Gemini cached model handle: {gemini_cached_ms:.3f} ms/call')
+        self.stdout.write(self.style.SUCCESS(
+            f'Pooled session saves {bare_ms - pooled_ms:.3f} ms/call against the local stub '
+            '(TLS handshakes against the real API add considerably more)'
+        ))
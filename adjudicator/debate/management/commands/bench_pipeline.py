@@ -0,0 +1,247 @@
+from django.core.management.base import BaseCommand, CommandError
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from debate.management.benchdb import bench_database
+from debate.models import Debate
+from debate.services.analysis import aperform_analysis, build_pipeline, build_structured_results, perform_analysis
+from debate.services.interactions import InteractionRecorder
+from debate.services.replay import build_replay_provider, set_replay_provider
+
+# Fields of an entry that must match for two runs to be compared
+CONFIG_FIELDS = ('mode', 'concurrency', 'runs', 'latency', 'jitter')
+
+
+def summarize(seconds):
+    """Mean, median and 95th percentile of a list of durations, in milliseconds"""
+    if not seconds:
+        return None
+    ordered = sorted(seconds)
+    return {
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+    }
+
+
+def stage_prompt_names():
+    """Map each pipeline stage name to the prompt its LLM call uses"""
+    names = {}
+    for stage in build_pipeline().stages:
+        request = stage.llm_request(defaultdict(str))
+        if request:
+            names[stage.name] = request['prompt_name']
+    return names
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Run the analysis pipeline end to end against recorded LLM responses and measure throughput, '
+            'per-stage overhead, parse time and database write time at several concurrency levels')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4,8', help='Comma-separated numbers of analyses run at once')
+        parser.add_argument('--runs', type=int, default=24, help='Analyses per concurrency level')
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Simulated seconds per LLM call')
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help='Simulated latency varies uniformly by up to this many seconds')
+        parser.add_argument('--mode', choices=['sync', 'async'], default='sync',
+                            help='sync runs perform_analysis on a thread pool; async awaits aperform_analysis')
+        parser.add_argument('--output', default=os.path.join('benchmarks', 'pipeline.jsonl'),
+                            help='JSONL file the results are appended to (empty to not store them)')
+        parser.add_argument('--label', default='', help='Free-form note stored with the results')
+
+    def save(self, text, result, recorder):
+        """Parse and store a finished analysis the way run_job does; returns (parse, write) seconds"""
+        start = time.perf_counter()
+        structured_results = build_structured_results(
+            result['evaluation_formatted'], result['judgment_formatted'], result['judgment']
+        )
+        parsed = time.perf_counter()
+        debate = Debate.objects.create(
+            original_text=text,
+            belligerent_1=result['belligerent_1'],
+            belligerent_2=result['belligerent_2'],
+            summary_1=result['summary_1'],
+            summary_2=result['summary_2'],
+            winner=result['winner'],
+            credit_cost=Decimal('1.00'),
+            analysis=result['analysis'],
+            evaluation=result['evaluation'],
+            judgment=result['judgment'],
+            title=result['title'],
+            evaluation_formatted=result['evaluation_formatted'],
+            judgment_formatted=result['judgment_formatted'],
+            structured_results=structured_results
+        )
+        recorder.save(debate)
+        return parsed - start, time.perf_counter() - parsed
+
+    def measure(self, start, result, saved):
+        parse, write = saved
+        return {
+            'pipeline': time.perf_counter() - start - parse - write,
+            'parse': parse,
+            'write': write,
+            'stages': {stage['stage']: stage['duration'] for stage in result['timings']['stages']},
+        }
+
+    def run_sync(self, texts, concurrency):
+        def run(text):
+            try:
+                recorder = InteractionRecorder()
+                start = time.perf_counter()
+                result = perform_analysis(text, recorder=recorder)
+                return self.measure(start, result, self.save(text, result, recorder))
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(run, texts))
+
+    def run_async(self, texts, concurrency):
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+            save = sync_to_async(self.save, thread_sensitive=False)
+
+            async def run(text):
+                async with semaphore:
+                    recorder = InteractionRecorder()
+                    start = time.perf_counter()
+                    result = await aperform_analysis(text, recorder=recorder)
+                    return self.measure(start, result, await save(text, result, recorder))
+
+            return await asyncio.gather(*(run(text) for text in texts))
+
+        return asyncio.run(run_all())
+
+    def bench(self, provider, concurrency, options):
+        texts = list(itertools.islice(itertools.cycle(provider.texts), options['runs']))
+        provider.reset_stats()
+        start = time.perf_counter()
+        if options['mode'] == 'async':
+            runs = self.run_async(texts, concurrency)
+        else:
+            runs = self.run_sync(texts, concurrency)
+        wall = time.perf_counter() - start
+
+        calls = provider.stats()
+        stages = {}
+        for stage, prompt_name in stage_prompt_names().items():
+            durations = [run['stages'][stage] for run in runs if stage in run['stages']]
+            if not durations:
+                continue
+            simulated = calls.get(prompt_name, {})
+            latency = simulated['simulated_seconds'] / simulated['calls'] if simulated.get('calls') else 0.0
+            stages[stage] = {
+                **summarize(durations),
+                # Time in the stage beyond the simulated provider latency
+                'overhead_ms': round((statistics.mean(durations) - latency) * 1000, 3),
+            }
+        return {
+            'concurrency': concurrency,
+            'wall_seconds': round(wall, 3),
+            'throughput': round(len(runs) / wall, 3),
+            'pipeline': summarize([run['pipeline'] for run in runs]),
+            'parse': summarize([run['parse'] for run in runs]),
+            'db_write': summarize([run['write'] for run in runs]),
+            'stages': stages,
+            'llm_calls': sum(stats['calls'] for stats in calls.values()),
+        }
+
+    def previous(self, path, entry):
+        """The last stored entry with the same configuration as entry, if any"""
+        if not path or not os.path.exists(path):
+            return None
+        match = None
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    stored = json.loads(line)
+                    if all(stored.get(field) == entry[field] for field in CONFIG_FIELDS):
+                        match = stored
+        return match
+
+    def report(self, entry, previous):
+        self.stdout.write(
+            f"concurrency {entry['concurrency']:3}: {entry['throughput']:8.2f} analyses/s  "
+            f"pipeline p50 {entry['pipeline']['p50_ms']:9.2f} ms  p95 {entry['pipeline']['p95_ms']:9.2f} ms  "
+            f"parse p50 {entry['parse']['p50_ms']:7.2f} ms  write p50 {entry['db_write']['p50_ms']:7.2f} ms"
+        )
+        for stage, timing in entry['stages'].items():
+            self.stdout.write(f"    {stage:24} p50 {timing['p50_ms']:9.2f} ms  overhead {timing['overhead_ms']:8.2f} ms")
+        if previous:
+            change = (entry['throughput'] - previous['throughput']) / previous['throughput'] * 100
+            style = self.style.ERROR if change < -10 else self.style.SUCCESS
+            self.stdout.write(style(
+                f"    throughput {change:+.1f}% against {previous.get('commit') or 'unknown commit'} "
+                f"({previous['timestamp']})"
+            ))
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError(f"--concurrency must be comma-separated integers: {options['concurrency']}")
+
+        provider = build_replay_provider({
+            **getattr(settings, 'LLM_REPLAY', {}),
+            'LATENCY': options['latency'],
+            'JITTER': options['jitter'],
+            'SEED': 0,
+        })
+        if not provider.texts:
+            raise CommandError('No debate in the exports can be replayed end to end')
+        self.stdout.write(
+            f'Replaying {len(provider)} recorded responses from {len(provider.texts)} debates, '
+            f"{options['mode']} mode, {options['latency'] * 1000:.0f} ms simulated latency per call"
+        )
+
+        common = {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'label': options['label'],
+            'mode': options['mode'],
+            'runs': options['runs'],
+            'latency': options['latency'],
+            'jitter': options['jitter'],
+            'debates': len(provider.texts),
+        }
+        entries = []
+        set_replay_provider(provider)
+        try:
+            with override_settings(LLM_PROVIDER='replay'), bench_database(on_disk=True):
+                for concurrency in levels:
+                    entry = {**common, **self.bench(provider, concurrency, options)}
+                    self.report(entry, self.previous(options['output'], entry))
+                    entries.append(entry)
+        finally:
+            set_replay_provider(None)
+
+        if options['output']:
+            os.makedirs(os.path.dirname(options['output']) or '.', exist_ok=True)
+            with open(options['output'], 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Appended {len(entries)} results to {options['output']}"))
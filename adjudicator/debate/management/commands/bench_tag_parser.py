@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+import glob
+import json
+import re
+import time
+from debate.services.xmltags import TagTree, parse_tags
+
+# Tags each stored response is checked for, as in the pipeline stages
+RESPONSE_TAGS = {
+    'analysis': ['debate_title', 'p1', 'p2', 's1', 's2', 'complexity'],
+    'evaluation': ['argument_map', 'direct_interactions', 'decisive_factors', 'uncertainties',
+                   'topic', 'p1_argument', 'p2_argument'],
+    'judgment': ['winner', 'reasoning', 'strength', 'strengthening_advice',
+                 'final_argument_map', 'p1_advice', 'p2_advice'],
+}
+# Number of readers of each response in the consumers scenario
+CONSUMERS = 3
+ALL_TAGS = sorted({tag for tags in RESPONSE_TAGS.values() for tag in tags})
+
+
+def regex_extract(text, tags):
+    """The previous approach: one freshly built pattern and full scan per tag"""
+    values = {}
+    for tag in tags:
+        match = re.search(fr'<{tag}>\s*(.*?)\s*</{tag}>', text, re.DOTALL)
+        values[tag] = match.group(1).strip() if match else None
+    return values
+
+
+def tree_extract(text, tags):
+    tree = TagTree(text)
+    return {tag: tree.get(tag) for tag in tags}
+
+
+class Command(BaseCommand):
+    help = 'Compare per-tag regex extraction against the single-pass tag tokenizer on exported responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*',
+                            help='Export files (default: llm_interactions_*.json and debates_*.json)')
+        parser.add_argument('--repeat', type=int, default=20, help='Passes over the corpus per variant')
+
+    def load_responses(self, files):
+        responses = []
+        for path in files:
+            with open(path) as f:
+                records = json.load(f)
+            for record in records:
+                # LLM interaction exports carry the raw response; debate exports one field per stage
+                if record.get('response'):
+                    responses.append((record['response'], ALL_TAGS))
+                for field, tags in RESPONSE_TAGS.items():
+                    if record.get(field):
+                        responses.append((record[field], tags))
+        return responses
+
+    def _time(self, fn, responses, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text, tags in responses:
+                fn(text, tags)
+        return (time.perf_counter() - start) / (repeat * len(responses)) * 1e6
+
+    def handle(self, *args, **options):
+        files = options['files'] or sorted(glob.glob('llm_interactions_*.json') + glob.glob('debates_*.json'))
+        responses = self.load_responses(files)
+        if not responses:
+            self.stderr.write('No stored responses found')
+            return
+
+        repeat = options['repeat']
+        total_chars = sum(len(text) for text, _ in responses)
+        self.stdout.write(f'{len(responses)} responses from {len(files)} files, '
+                          f'{total_chars / len(responses):.0f} chars on average')
+
+        mismatches = sum(
+            1 for text, tags in responses if regex_extract(text, tags) != tree_extract(text, tags)
+        )
+
+        regex_us = self._time(regex_extract, responses, repeat)
+        tree_us = self._time(tree_extract, responses, repeat)
+
+        # A response is read by several consumers (validation, the stage's
+        # finish, rendering); with parse_tags only the first one parses it
+        def regex_consumers(text, tags):
+            for _ in range(CONSUMERS):
+                regex_extract(text, tags)
+
+        def cached_consumers(text, tags):
+            for _ in range(CONSUMERS):
+                tree = parse_tags(text)
+                for tag in tags:
+                    tree.get(tag)
+
+        regex_all_us = self._time(regex_consumers, responses, repeat)
+        parse_tags.cache_clear()
+        cached_all_us = self._time(cached_consumers, responses, repeat)
+
+        self.stdout.write(f'single read    regex per tag: {regex_us:8.1f} us  '
+                          f'single-pass tree: {tree_us:8.1f} us  ({regex_us / tree_us:.1f}x)')
+        self.stdout.write(f'{CONSUMERS} consumers    regex per tag: {regex_all_us:8.1f} us  '
+                          f'parse_tags:       {cached_all_us:8.1f} us  ({regex_all_us / cached_all_us:.1f}x)')
+        self.stdout.write(f'results differing from regex: {mismatches}/{len(responses)}')
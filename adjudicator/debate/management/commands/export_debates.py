@@ -1,57 +1,136 @@
-from django.core.management.base import BaseCommand
-import json
+from django.core.management.base import BaseCommand, CommandError
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_datetime
+from debate.management.exports import open_export, JsonlWriter, JsonArrayWriter
 from debate.models import Debate, LLMInteraction
 
+DEBATE_FIELDS = (
+    'id', 'created_at', 'original_text', 'belligerent_1', 'belligerent_2', 'summary_1', 'summary_2',
+    'winner', 'credit_cost', 'analysis', 'evaluation', 'judgment', 'evaluation_approval', 'judgment_approval'
+)
+INTERACTION_FIELDS = (
+    'debate_id', 'timestamp', 'prompt_name', 'prompt_text', 'response', 'model_used', 'success', 'error_message',
+    'latency_ms', 'attempts', 'prompt_tokens', 'response_tokens'
+)
+
+
+def debate_record(row):
+    row['created_at'] = row['created_at'].isoformat()
+    row['credit_cost'] = str(row['credit_cost'])  # Convert Decimal to string
+    return row
+
+
+def interaction_record(row):
+    row['timestamp'] = row['timestamp'].isoformat()
+    return row
+
+
 class Command(BaseCommand):
-    help = 'Export all debates and their LLM interactions to JSON files'
+    help = 'Export debates and their LLM interactions, streaming rows to JSONL (or JSON) files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['jsonl', 'json'], default='jsonl',
+                            help='jsonl writes one record per line; json is the old single-array format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output files')
+        parser.add_argument('--since', help='Only debates created at or after this ISO datetime')
+        parser.add_argument('--after-id', type=int, help='Only debates with a larger id (the cursor printed '
+                                                         'by the previous export)')
+        parser.add_argument('--shards', type=int, default=1,
+                            help='Split the export into this many files by id range, written in parallel')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows fetched per database round trip')
+        parser.add_argument('--output-dir', default='.', help='Directory for the export files')
+
+    def debates(self, options):
+        debates = Debate.objects.all()
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"--since is not an ISO datetime: {options['since']}")
+            debates = debates.filter(created_at__gte=since)
+        if options['after_id'] is not None:
+            debates = debates.filter(id__gt=options['after_id'])
+        return debates
+
+    def shard_ranges(self, debates, shards):
+        """Split the id span of debates into up to shards contiguous (low, high) ranges"""
+        bounds = debates.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            return []
+        low, high = bounds['low'], bounds['high']
+        step = -(-(high - low + 1) // shards)
+        return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+    def write(self, path, rows, make_record, options):
+        writer_class = JsonlWriter if options['format'] == 'jsonl' else JsonArrayWriter
+        count = 0
+        with open_export(path, 'w') as f:
+            writer = writer_class(f)
+            for row in rows.iterator(chunk_size=options['chunk_size']):
+                writer.write(make_record(row))
+                count += 1
+            writer.close()
+        return count
+
+    def export_shard(self, debates, id_range, suffix, options):
+        """Write the debates in id_range and their interactions; returns (debates, interactions, last id)"""
+        try:
+            if id_range is not None:
+                debates = debates.filter(id__range=id_range)
+            debate_rows = debates.order_by('id').values(*DEBATE_FIELDS)
+            # Debates are written in id order, so the last one written is the
+            # cursor; rows inserted after the query started are left for the
+            # next incremental export
+            last_id = None
+
+            def record(row):
+                nonlocal last_id
+                last_id = row['id']
+                return debate_record(row)
+
+            output_dir = options['output_dir']
+            debate_count = self.write(
+                os.path.join(output_dir, f'debates_{suffix}'), debate_rows, record, options
+            )
+            written = debates.filter(id__lte=last_id) if last_id is not None else debates.none()
+            interaction_rows = LLMInteraction.objects.filter(
+                debate_id__in=written.values('id')
+            ).order_by('debate_id', 'timestamp', 'id').values(*INTERACTION_FIELDS)
+            interaction_count = self.write(
+                os.path.join(output_dir, f'llm_interactions_{suffix}'), interaction_rows, interaction_record, options
+            )
+            return debate_count, interaction_count, last_id
+        finally:
+            connections.close_all()
 
     def handle(self, *args, **options):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Export debates
-        debates_data = []
-        for debate in Debate.objects.all():
-            debates_data.append({
-                'id': debate.id,
-                'created_at': debate.created_at.isoformat(),
-                'original_text': debate.original_text,
-                'belligerent_1': debate.belligerent_1,
-                'belligerent_2': debate.belligerent_2,
-                'summary_1': debate.summary_1,
-                'summary_2': debate.summary_2,
-                'winner': debate.winner,
-                'credit_cost': str(debate.credit_cost),  # Convert Decimal to string
-                'analysis': debate.analysis,
-                'evaluation': debate.evaluation,
-                'judgment': debate.judgment,
-                'evaluation_approval': debate.evaluation_approval,
-                'judgment_approval': debate.judgment_approval
-            })
-        
-        with open(f'debates_{timestamp}.json', 'w', encoding='utf-8') as f:
-            json.dump(debates_data, f, indent=2, ensure_ascii=False)
-        
-        # Export LLM interactions
-        interactions_data = []
-        for interaction in LLMInteraction.objects.all():
-            interactions_data.append({
-                'debate_id': interaction.debate.id,
-                'timestamp': interaction.timestamp.isoformat(),
-                'prompt_name': interaction.prompt_name,
-                'prompt_text': interaction.prompt_text,
-                'response': interaction.response,
-                'model_used': interaction.model_used,
-                'success': interaction.success,
-                'error_message': interaction.error_message
-            })
-        
-        with open(f'llm_interactions_{timestamp}.json', 'w', encoding='utf-8') as f:
-            json.dump(interactions_data, f, indent=2, ensure_ascii=False)
-        
+        extension = options['format'] + ('.gz' if options['gzip'] else '')
+        debates = self.debates(options)
+
+        if options['shards'] > 1:
+            ranges = self.shard_ranges(debates, options['shards'])
+            jobs = [(id_range, f'{timestamp}_shard{i}.{extension}') for i, id_range in enumerate(ranges)]
+        else:
+            jobs = [(None, f'{timestamp}.{extension}')]
+
+        with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as executor:
+            results = list(executor.map(
+                lambda job: self.export_shard(debates, job[0], job[1], options), jobs
+            ))
+
+        debate_count = sum(result[0] for result in results)
+        interaction_count = sum(result[1] for result in results)
+        last_ids = [result[2] for result in results if result[2] is not None]
+        files = ', '.join(os.path.join(options['output_dir'], f'debates_{suffix}') for _, suffix in jobs)
         self.stdout.write(
             self.style.SUCCESS(
-                f'Successfully exported debates to debates_{timestamp}.json and '
-                f'LLM interactions to llm_interactions_{timestamp}.json'
+                f'Successfully exported {debate_count} debates to {files} and '
+                f'{interaction_count} LLM interactions to the matching llm_interactions_ files'
             )
-        ) 
\ No newline at end of file
+        )
+        if last_ids:
+            self.stdout.write(f'Next incremental export: --after-id {max(last_ids)}')
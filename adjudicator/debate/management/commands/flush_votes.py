@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from debate.models import ApprovalRecord, Debate
+from debate.services.votes import flush_votes, recount
+
+
+class Command(BaseCommand):
+    help = 'Fold buffered votes into the debate counters, or recount every voted debate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Debates flushed at most')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recount all debates with votes from their records, e.g. after a '
+                                 'process holding an in-memory buffer was stopped')
+        parser.add_argument('--batch-size', type=int, default=500, help='Debates recounted per transaction')
+
+    def handle(self, *args, **options):
+        if not options['rebuild']:
+            flushed = flush_votes(options['limit'])
+            self.stdout.write(self.style.SUCCESS(f'Flushed votes for {flushed} debates'))
+            return
+
+        # Debates with records, plus any whose counters say they have votes
+        debate_ids = sorted(
+            set(ApprovalRecord.objects.values_list('debate_id', flat=True).distinct())
+            | set(Debate.objects.exclude(
+                evaluation_approvals=0, evaluation_disapprovals=0,
+                judgment_approvals=0, judgment_disapprovals=0
+            ).values_list('id', flat=True))
+        )
+        batch_size = options['batch_size']
+        for start in range(0, len(debate_ids), batch_size):
+            recount(debate_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Recounted {len(debate_ids)} debates'))
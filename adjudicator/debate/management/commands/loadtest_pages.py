@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+import itertools
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from debate.management.benchdb import bench_database, seed_debates
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = 'Measure requests/second for the result and hall of fame pages with and without the page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Debate exports to seed from (default: debates_*.json)')
+        parser.add_argument('--requests', type=int, default=300, help='Requests per page and variant')
+        parser.add_argument('--concurrency', type=int, default=1, help='Client threads')
+        parser.add_argument('--use-existing-db', action='store_true',
+                            help='Run against the configured database instead of a seeded test database')
+
+    def run(self, paths, requests, concurrency):
+        local = threading.local()
+
+        def fetch(path):
+            # django.test.Client is not thread safe, so each thread gets its own
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            start = time.perf_counter()
+            response = local.client.get(path)
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f'{path} returned {response.status_code}')
+            return elapsed
+
+        def fetch_and_close(path):
+            try:
+                return fetch(path)
+            finally:
+                if concurrency > 1:
+                    connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(fetch_and_close, itertools.islice(itertools.cycle(paths), requests)))
+        wall = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'rps': requests / wall,
+            'mean_ms': statistics.mean(latencies) * 1000,
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        }
+
+    def report(self, label, uncached, cached):
+        self.stdout.write(
+            f"{label:14} uncached {uncached['rps']:8.1f} req/s (p95 {uncached['p95_ms']:6.1f} ms)   "
+            f"cached {cached['rps']:8.1f} req/s (p95 {cached['p95_ms']:6.1f} ms)   "
+            f"{cached['rps'] / uncached['rps']:.1f}x"
+        )
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def benchmark(self, debate_ids, requests, concurrency):
+        pages = {
+            'result': [f'/result/{debate_id}/' for debate_id in debate_ids],
+            'hall-of-fame': ['/hall-of-fame/'],
+        }
+        for label, paths in pages.items():
+            with override_settings(CACHES=NO_CACHE):
+                uncached = self.run(paths, requests, concurrency)
+            cache.clear()
+            # Warm the cache so the measured run reflects steady state
+            self.run(paths, len(paths), 1)
+            cached = self.run(paths, requests, concurrency)
+            self.report(label, uncached, cached)
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        concurrency = options['concurrency']
+
+        if options['use_existing_db']:
+            from debate.models import Debate
+            debate_ids = list(Debate.objects.order_by('-id').values_list('id', flat=True)[:50])
+            self.benchmark(debate_ids, requests, concurrency)
+            return
+
+        with bench_database():
+            debate_ids = seed_debates(options['files'])
+            self.stdout.write(f'Seeded {len(debate_ids)} debates into a test database')
+            self.benchmark(debate_ids, requests, concurrency)
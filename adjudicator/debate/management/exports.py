@@ -0,0 +1,64 @@
+import glob
+import gzip
+import json
+
+EXPORT_PATTERNS = ('debates_*.json', 'debates_*.json.gz', 'debates_*.jsonl', 'debates_*.jsonl.gz')
+
+
+def open_export(path, mode='r'):
+    """Open an export file as text, through gzip when the name ends in .gz"""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def iter_records(path):
+    """
+    Yield the records of an export_debates file one at a time
+
+    Handles the JSONL output (plain or gzipped) line by line and the legacy
+    single JSON array, which has to be loaded whole.
+    """
+    with open_export(path) as f:
+        if str(path).endswith(('.json', '.json.gz')):
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def find_exports(patterns=EXPORT_PATTERNS):
+    """Return the debate export files in the current directory, oldest name first"""
+    return sorted(path for pattern in patterns for path in glob.glob(pattern))
+
+
+class JsonlWriter:
+    """Writes one JSON record per line"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False))
+        self.f.write('\n')
+
+    def close(self):
+        pass
+
+
+class JsonArrayWriter:
+    """Writes records as one JSON array, the legacy export format, without holding them in memory"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+        self.f.write('[')
+
+    def write(self, record):
+        self.f.write(',\n' if self.count else '\n')
+        self.f.write(json.dumps(record, indent=2, ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        self.f.write('\n]' if self.count else ']')
@@ -1,19 +1,36 @@
 from django.http import HttpResponseForbidden
-import geoip2.database
+from django.db import connections
 from django.conf import settings
-import os
+import logging
+import time
+from .services.geo import get_ip_classifier
+from .services.metrics import get_metrics
+
+logger = logging.getLogger('llm_calls')
 
 class EUBlockerMiddleware:
+    """
+    Turns away requests from EU addresses
+
+    Classification is done by the shared IPClassifier (see services/geo.py),
+    which caches recent decisions. Paths in GEOIP['EXEMPT_PATHS'] (and GET
+    requests to GEOIP['EXEMPT_GET_PATHS']) are never looked up.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
-        try:
-            db_path = os.path.join(settings.BASE_DIR, 'GeoLite2-Country.mmdb')
-            self.reader = geoip2.database.Reader(db_path)
-        except FileNotFoundError:
-            self.reader = None
+        self.classifier = get_ip_classifier()
+        config = getattr(settings, 'GEOIP', {})
+        self.exempt_paths = tuple(config.get('EXEMPT_PATHS', ()))
+        self.exempt_get_paths = tuple(config.get('EXEMPT_GET_PATHS', ()))
+
+    def is_exempt(self, request):
+        return request.path.startswith(self.exempt_paths) or (
+            request.method == 'GET' and request.path.startswith(self.exempt_get_paths)
+        )
 
     def __call__(self, request):
-        if self.reader is None:
+        if self.classifier is None or self.is_exempt(request):
             return self.get_response(request)
 
         # Get client IP
@@ -23,21 +40,119 @@ class EUBlockerMiddleware:
         else:
             ip = request.META.get('REMOTE_ADDR')
 
-        try:
-            # Check if IP is from EU
-            response = self.reader.country(ip)
-            if response.country.is_in_european_union:
-                return HttpResponseForbidden('''
-                    <h1>Service Not Available in EU</h1>
-                    <p>We apologize, but this service is currently not available in the European Union 
-                    while we work on GDPR compliance.</p>
-                ''')
-        except:
-            # If we can't determine location, let the request through
-            pass
+        if self.classifier.is_eu(ip):
+            return HttpResponseForbidden('''
+                <h1>Service Not Available in EU</h1>
+                <p>We apologize, but this service is currently not available in the European Union 
+                while we work on GDPR compliance.</p>
+            ''')
 
         return self.get_response(request)
 
-    def __del__(self):
-        if self.reader:
-            self.reader.close() 
\ No newline at end of file
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a request runs more queries than its view's budget"""
+
+
+class QueryCounter:
+    """
+    Context manager counting the queries run on a database connection
+
+    Usable on its own in tests:
+
+        with QueryCounter() as counter:
+            client.get('/hall-of-fame/')
+        assert counter.count <= 3, counter.queries
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.count = 0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connections[self.using].execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries each request runs and checks them against a per-view budget
+
+    Budgets come from settings.QUERY_BUDGET: VIEWS maps URL names to a maximum
+    and DEFAULT applies to everything else (None for no limit). Going over is
+    logged, or raises QueryBudgetExceeded when STRICT is set, which makes the
+    test client fail the request. In DEBUG the count is also returned in an
+    X-Query-Count header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'QUERY_BUDGET', {})
+        self.default_budget = config.get('DEFAULT')
+        self.view_budgets = config.get('VIEWS', {})
+        self.strict = config.get('STRICT', False)
+
+    def __call__(self, request):
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(counter.count)
+
+        view_name = request.resolver_match.url_name if request.resolver_match else None
+        get_metrics().observe('adjudicator_http_db_queries', counter.count, view=view_name or 'unmatched')
+        budget = self.view_budgets.get(view_name, self.default_budget)
+        if budget is not None and counter.count > budget:
+            if self.strict:
+                raise QueryBudgetExceeded(
+                    f"{request.path} ran {counter.count} queries, budget is {budget}:\n" + "\n".join(counter.queries)
+                )
+            logger.warning("Query budget exceeded", extra={
+                'path': request.path,
+                'view': view_name,
+                'queries': counter.count,
+                'budget': budget
+            })
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Times every request into the HTTP metrics (see services/metrics.py)
+
+    Requests are labelled by URL name rather than path, so the number of
+    series stays bounded.
+    """
+
+    METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = get_metrics()
+        metrics.inc('adjudicator_http_in_flight')
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.inc('adjudicator_http_in_flight', -1)
+            metrics.observe(
+                'adjudicator_http_request_seconds',
+                time.perf_counter() - start,
+                view=request.resolver_match.url_name if request.resolver_match else 'unmatched',
+                method=request.method if request.method in self.METHODS else 'other',
+                status=status
+            )
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.5 on 2026-10-17 19:01
+
+import django.db.models.deletion
+import uuid
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debate', '0010_alter_ipcreditusage_ip_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('text', models.TextField()),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('credit_cost', models.DecimalField(decimal_places=2, default=Decimal('1.00'), max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('complete', 'Complete'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('stage_outputs', models.JSONField(default=dict)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('debate', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='debate.debate')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalysisEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='debate.analysisjob')),
+            ],
+            options={
+                'ordering': ['seq'],
+                'unique_together': {('job', 'seq')},
+            },
+        ),
+    ]
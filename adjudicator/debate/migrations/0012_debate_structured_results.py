@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debate', '0011_analysisjob_analysisevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='debate',
+            name='structured_results',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
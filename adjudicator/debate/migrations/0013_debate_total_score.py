@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2026-10-17 19:18
+
+from django.db import migrations, models
+
+
+def fill_total_score(apps, schema_editor):
+    Debate = apps.get_model('debate', 'Debate')
+    Debate.objects.update(total_score=(
+        models.F('evaluation_approvals') - models.F('evaluation_disapprovals')
+        + models.F('judgment_approvals') - models.F('judgment_disapprovals')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debate', '0012_debate_structured_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='debate',
+            name='total_score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_total_score, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='debate',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='debate',
+            index=models.Index(condition=models.Q(('total_score__gt', 0)), fields=['-created_at', '-id'], name='debate_positive_recent'),
+        ),
+    ]
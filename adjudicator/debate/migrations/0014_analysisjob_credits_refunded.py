@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debate', '0013_debate_total_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='credits_refunded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
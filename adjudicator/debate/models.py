@@ -1,12 +1,49 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from decimal import Decimal
+import uuid
+
+class DebateQuerySet(models.QuerySet):
+    # Columns needed to list debates; the large text fields are left unloaded
+    SUMMARY_FIELDS = (
+        'id', 'created_at', 'title', 'belligerent_1', 'belligerent_2', 'winner',
+        'evaluation_approvals', 'evaluation_disapprovals',
+        'judgment_approvals', 'judgment_disapprovals', 'total_score',
+    )
+
+    def summaries(self):
+        """
+        Restrict the query to the summary columns, for list views
+        
+        Rows are still Debate instances, so the score properties work, but
+        reading one of the text fields costs an extra query per row.
+        """
+        return self.only(*self.SUMMARY_FIELDS)
+
+    def top_recent(self, after=None):
+        """
+        Positively scored debates, newest first, for the hall of fame
+        
+        Served by the partial debate_positive_recent index. Pages are
+        fetched by keyset: after is the (created_at, id) of the last row of
+        the previous page.
+        """
+        debates = self.filter(total_score__gt=0)
+        if after is not None:
+            created_at, debate_id = after
+            debates = debates.filter(
+                models.Q(created_at__lt=created_at) | models.Q(created_at=created_at, id__lt=debate_id)
+            )
+        return debates.order_by('-created_at', '-id')
 
 class Debate(models.Model):
     class ApprovalStatus(models.TextChoices):
         APPROVED = 'approved', 'Approved'
         DISAPPROVED = 'disapproved', 'Disapproved'
     
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     original_text = models.TextField()
     belligerent_1 = models.CharField(max_length=255)
     belligerent_2 = models.CharField(max_length=255)
@@ -34,9 +71,24 @@ class Debate(models.Model):
     evaluation_disapprovals = models.IntegerField(default=0)
     judgment_approvals = models.IntegerField(default=0)
     judgment_disapprovals = models.IntegerField(default=0)
+    # Sum of both approval scores, kept in step with the vote counts above
+    total_score = models.IntegerField(default=0)
     title = models.CharField(max_length=255, null=True, blank=True)
     evaluation_formatted = models.TextField(null=True, blank=True)
     judgment_formatted = models.TextField(null=True, blank=True)
+    # Evaluation tables and advice parsed from the formatted output once, at creation
+    structured_results = models.JSONField(null=True, blank=True)
+
+    objects = DebateQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(total_score__gt=0),
+                name='debate_positive_recent'
+            ),
+        ]
 
     @property
     def evaluation_approval_score(self):
@@ -57,22 +109,38 @@ class CreditBalance(models.Model):
 
     @classmethod
     def deduct_credits(cls, amount):
-        balance = cls.objects.get(id=1)
-        if balance.balance >= Decimal(str(amount)):  # Convert float to Decimal
-            balance.balance -= Decimal(str(amount))
-            balance.save()
+        """
+        Take amount from the balance if it covers it, in one conditional UPDATE
+        
+        Returns:
+            bool: Whether the credits were deducted
+        """
+        amount = Decimal(str(amount))  # Convert float to Decimal
+        deduct = lambda: cls.objects.filter(id=1, balance__gte=amount).update(
+            balance=models.F('balance') - amount, last_updated=timezone.now()
+        )
+        if deduct():
             return True
-        return False
+        # The balance row is created with its default on first use
+        balance, created = cls.objects.get_or_create(id=1)
+        return bool(created and deduct())
 
 class LLMInteraction(models.Model):
     debate = models.ForeignKey(Debate, on_delete=models.CASCADE, related_name='llm_interactions')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the call finished; interactions are saved in bulk after the debate exists
+    timestamp = models.DateTimeField(default=timezone.now)
     prompt_name = models.CharField(max_length=100)  # e.g., 'analyze', 'evaluate', 'judge'
     prompt_text = models.TextField()
     response = models.TextField()
     model_used = models.CharField(max_length=100)  # e.g., 'deepseek-chat', 'gemini-2.0-flash-exp'
     success = models.BooleanField(default=True)
     error_message = models.TextField(null=True, blank=True)
+    # Milliseconds from the first attempt to the final response or error
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=1)
+    # As reported by the provider; None when it does not say (e.g. streamed responses)
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    response_tokens = models.PositiveIntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['timestamp'] 
@@ -88,18 +156,86 @@ class ApprovalRecord(models.Model):
         unique_together = ('debate', 'ip_address', 'field') 
 
 class IPCreditUsage(models.Model):
+    # Credits each IP address may spend until the balances are reset
+    CREDIT_LIMIT = Decimal('15')
+    
     ip_address = models.GenericIPAddressField(primary_key=True)
     credits_used = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     last_updated = models.DateTimeField(auto_now=True)
 
     @classmethod
-    def can_use_credits(cls, ip_address, amount):
-        usage, created = cls.objects.get_or_create(ip_address=ip_address)
-        return usage.credits_used + Decimal(str(amount)) <= 15
+    def get_usage(cls, ip_address):
+        """Return the credits an IP has used, without creating its row"""
+        used = cls.objects.filter(ip_address=ip_address).values_list('credits_used', flat=True).first()
+        return used if used is not None else Decimal('0')
 
     @classmethod
-    def add_usage(cls, ip_address, amount):
-        usage, created = cls.objects.get_or_create(ip_address=ip_address)
-        usage.credits_used += Decimal(str(amount))
-        usage.save()
-        return usage.credits_used 
\ No newline at end of file
+    def reserve_credits(cls, ip_address, amount):
+        """
+        Charge amount to an IP if it stays within CREDIT_LIMIT
+        
+        The check and the charge are one conditional UPDATE, so concurrent
+        submissions from the same IP cannot both get through on the last
+        credit. An IP's first reservation inserts its row instead.
+        
+        Returns:
+            bool: Whether the credits were reserved
+        """
+        amount = Decimal(str(amount))
+        if amount > cls.CREDIT_LIMIT:
+            return False
+        reserve = lambda: cls.objects.filter(
+            ip_address=ip_address, credits_used__lte=cls.CREDIT_LIMIT - amount
+        ).update(credits_used=models.F('credits_used') + amount, last_updated=timezone.now())
+        if reserve():
+            return True
+        try:
+            with transaction.atomic():
+                cls.objects.create(ip_address=ip_address, credits_used=amount)
+            return True
+        except IntegrityError:
+            # The row exists: either the IP is over its limit or a concurrent
+            # first reservation created it, in which case try again
+            return bool(reserve())
+
+    @classmethod
+    def refund_credits(cls, ip_address, amount):
+        """Give back credits taken by reserve_credits, e.g. when the analysis failed"""
+        cls.objects.filter(ip_address=ip_address).update(
+            credits_used=Greatest(models.F('credits_used') - Decimal(str(amount)), Value(Decimal('0'))),
+            last_updated=timezone.now()
+        )
+
+class AnalysisJob(models.Model):
+    """A debate analysis submitted for background processing"""
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        COMPLETE = 'complete', 'Complete'
+        FAILED = 'failed', 'Failed'
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    text = models.TextField()
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    credit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('1.00'))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Context keys produced by finished pipeline stages, used to resume
+    stage_outputs = models.JSONField(default=dict)
+    error_message = models.TextField(null=True, blank=True)
+    debate = models.ForeignKey(Debate, on_delete=models.SET_NULL, null=True, blank=True)
+    # Set once the credits of a failed job have been given back
+    credits_refunded = models.BooleanField(default=False)
+
+class AnalysisEvent(models.Model):
+    """One progress update for an AnalysisJob, replayable by sequence number"""
+    job = models.ForeignKey(AnalysisJob, on_delete=models.CASCADE, related_name='events')
+    seq = models.PositiveIntegerField()
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['seq']
+        unique_together = ('job', 'seq')
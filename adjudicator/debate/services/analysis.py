@@ -1,18 +1,29 @@
-import re
 import time
 import logging
 from .llm import make_llm_call, load_prompt, validate_xml_response
-from .pipeline import AnalysisPipeline, InitialAnalysisStage, EvaluationStage, JudgmentStage, FormattingStage
+from .xmltags import parse_tags
+from .pipeline import (AnalysisPipeline, InitialAnalysisStage, EvaluationStage, JudgmentStage,
+                       FormatEvaluationStage, FormatJudgmentStage)
+from .retry import get_retry_policy
 
 logger = logging.getLogger('llm_calls')
 
+# Bump when the layout of Debate.structured_results changes; older rows are re-parsed
+STRUCTURED_RESULTS_VERSION = 1
+
 def extract_tag(tag, content, required=True):
-    match = re.search(fr'<{tag}>\s*(.*?)\s*</{tag}>', content, re.DOTALL)
-    if match:
-        return match.group(1).strip()
+    """
+    Return the stripped content of the first <tag>...</tag> in content
+    
+    content may be the response text or an already parsed TagTree / TagNode.
+    """
+    tree = parse_tags(content) if isinstance(content, str) else content
+    node = tree.find(tag)
+    if node is not None:
+        return node.text
     if required:
-        logging.error(f"Failed to find required tag {tag} in response:\n{content}")
-        print(f'failed to find {tag} in:\n{content}')
+        logging.error(f"Failed to find required tag {tag} in response:\n{tree.raw}")
+        print(f'failed to find {tag} in:\n{tree.raw}')
         raise ValueError(f"Analysis failed: Could not identify {tag} in the debate")
     return None
 
@@ -27,14 +38,13 @@ def parse_evaluation_table(evaluation_text, judgment_text=None):
         if judgment_text:
             logger.debug("Attempting to parse judgment text:\n%s", judgment_text)
             try:
-                map_match = re.search(r'<final_argument_map>(.*?)</final_argument_map>', judgment_text, re.DOTALL)
-                if map_match:
-                    map_text = map_match.group(1)
-                    topic = extract_tag('topic', map_text)
-                    p1_arg = extract_tag('p1_argument', map_text)
-                    p2_arg = extract_tag('p2_argument', map_text)
-                    verdict = extract_tag('verdict', map_text)
-                    reason = extract_tag('reason', map_text)
+                map_node = parse_tags(judgment_text).find('final_argument_map')
+                if map_node is not None:
+                    topic = extract_tag('topic', map_node)
+                    p1_arg = extract_tag('p1_argument', map_node)
+                    p2_arg = extract_tag('p2_argument', map_node)
+                    verdict = extract_tag('verdict', map_node)
+                    reason = extract_tag('reason', map_node)
                     
                     tables.append({
                         'topic': topic,
@@ -50,14 +60,14 @@ def parse_evaluation_table(evaluation_text, judgment_text=None):
         # Then get argument maps from evaluation
         logger.debug("Attempting to parse evaluation text:\n%s", evaluation_text)
         try:
+            evaluation_tree = parse_tags(evaluation_text)
             if not judge_map:
                 # Get main argument map
-                map_match = re.search(r'<argument_map>(.*?)</argument_map>', evaluation_text, re.DOTALL)
-                if map_match:
-                    map_text = map_match.group(1)
-                    topic = extract_tag('topic', map_text)
-                    p1_arg = extract_tag('p1_argument', map_text)
-                    p2_arg = extract_tag('p2_argument', map_text)
+                map_node = evaluation_tree.find('argument_map')
+                if map_node is not None:
+                    topic = extract_tag('topic', map_node)
+                    p1_arg = extract_tag('p1_argument', map_node)
+                    p2_arg = extract_tag('p2_argument', map_node)
                     
                     tables.append({
                         'topic': topic,
@@ -68,18 +78,16 @@ def parse_evaluation_table(evaluation_text, judgment_text=None):
                     logger.debug("Successfully parsed evaluation argument map")
             
             # Get direct interactions
-            interactions_match = re.search(r'<direct_interactions>(.*?)</direct_interactions>', evaluation_text, re.DOTALL)
-            if interactions_match:
-                interactions_text = interactions_match.group(1)
-                interaction_matches = re.finditer(r'<interaction>\s*(.*?)\s*</interaction>', interactions_text, re.DOTALL)
-                
-                for interaction in interaction_matches:
-                    interaction_text = interaction.group(1).strip()
+            interactions_node = evaluation_tree.find('direct_interactions')
+            if interactions_node is not None:
+                for interaction in interactions_node.find_all('interaction'):
                     try:
-                        topic = extract_tag('topic', interaction_text)
-                        p1_pos = extract_tag('p1_position', interaction_text)
-                        p2_pos = extract_tag('p2_position', interaction_text)
-                        outcome = extract_tag('outcome', interaction_text)
+                        topic = extract_tag('topic', interaction)
+                        p1_pos = extract_tag('p1_position', interaction)
+                        p2_pos = extract_tag('p2_position', interaction)
+                        outcome = interaction.find('outcome')
+                        if outcome is None:
+                            raise ValueError("Analysis failed: Could not identify outcome in the debate")
                         verdict = extract_tag('verdict', outcome)
                         reason = extract_tag('reason', outcome)
                         
@@ -90,7 +98,7 @@ def parse_evaluation_table(evaluation_text, judgment_text=None):
                             'outcome': f"{verdict}: {reason}"
                         })
                     except Exception as e:
-                        logger.error("Failed to parse interaction: %s\nText was:\n%s", str(e), interaction_text)
+                        logger.error("Failed to parse interaction: %s\nText was:\n%s", str(e), interaction.text)
             
         except Exception as e:
             logger.error("Failed to parse evaluation map: %s", str(e))
@@ -105,8 +113,59 @@ def parse_evaluation_table(evaluation_text, judgment_text=None):
                     str(e), evaluation_text, judgment_text)
         return None
 
+def extract_advice(judgment_text, advice_type):
+    """Extract advice points (e.g. for 'p1_advice') from the judgment's strengthening_advice"""
+    if not judgment_text:
+        return []
+    
+    # Clean the text first
+    judgment_text = judgment_text.replace('*Qant*', '')
+    advice = parse_tags(judgment_text).find('strengthening_advice')
+    if advice is None:
+        return []
+    
+    # Extract points for the specified advice type
+    section = advice.find(advice_type)
+    if section is None:
+        return []
+    return [point.text for point in section.find_all('point') if point.text]
+
+def build_structured_results(evaluation_formatted, judgment_formatted, judgment):
+    """
+    Parse everything the result page shows from a debate's LLM output
+    
+    The result is stored on Debate.structured_results so viewing a debate
+    does not re-parse its text.
+    
+    Returns:
+        dict: The version, evaluation tables (None if parsing failed) and
+            advice points per participant
+    """
+    return {
+        'version': STRUCTURED_RESULTS_VERSION,
+        'evaluation_tables': parse_evaluation_table(evaluation_formatted, judgment_formatted),
+        'advice': {
+            'p1_advice': extract_advice(judgment, 'p1_advice'),
+            'p2_advice': extract_advice(judgment, 'p2_advice')
+        }
+    }
+
+def build_pipeline(debate_id=None):
+    """
+    Create the analysis pipeline; formatting the evaluation only needs the
+    evaluation, so it runs alongside the judgment
+    """
+    return AnalysisPipeline([
+        InitialAnalysisStage(debate_id),
+        EvaluationStage(debate_id),
+        JudgmentStage(debate_id),
+        FormatEvaluationStage(debate_id),
+        FormatJudgmentStage(debate_id)
+    ])
+
 # Replace the monolithic perform_analysis function with a pipeline-based approach
-def perform_analysis(text, debate_id=None, progress_callback=None):
+def perform_analysis(text, debate_id=None, progress_callback=None, stage_outputs=None, stage_callback=None,
+                     recorder=None, retry_budget=None):
     """
     Core analysis logic using a pipeline architecture
     
@@ -114,23 +173,44 @@ def perform_analysis(text, debate_id=None, progress_callback=None):
         text (str): The debate text to analyze
         debate_id (int): Optional debate ID for logging
         progress_callback (callable): Function to call with progress updates
+        stage_outputs (dict): Outputs of stages completed by an earlier,
+            interrupted run; those stages are skipped
+        stage_callback (callable): Called with (stage, outputs) as each stage finishes
+        recorder (InteractionRecorder): Collects the LLM interactions of the run,
+            to be saved once the debate exists
+        retry_budget (RetryBudget): Limits the retries of all the run's LLM
+            calls together; defaults to a fresh budget from settings.LLM_RETRY
         
     Returns:
         dict: The analysis results
     """
-    # Create and configure the pipeline
-    pipeline = AnalysisPipeline([
-        InitialAnalysisStage(debate_id),
-        EvaluationStage(debate_id),
-        JudgmentStage(debate_id),
-        FormattingStage(debate_id)
-    ])
-    
     # Process the text through the pipeline
-    result = pipeline.process({
+    result = build_pipeline(debate_id).process({
+        **(stage_outputs or {}),
         'text': text,
         'debate_id': debate_id,
-        'progress_callback': progress_callback
+        'progress_callback': progress_callback,
+        'stage_callback': stage_callback,
+        'recorder': recorder,
+        'retry_budget': retry_budget or get_retry_policy().budget()
     })
     
-    return result
\ No newline at end of file
+    return result
+
+async def aperform_analysis(text, debate_id=None, progress_callback=None, stage_outputs=None, stage_callback=None,
+                            recorder=None, retry_budget=None):
+    """
+    Async counterpart of perform_analysis, taking the same arguments
+    
+    Returns:
+        dict: The analysis results
+    """
+    return await build_pipeline(debate_id).aprocess({
+        **(stage_outputs or {}),
+        'text': text,
+        'debate_id': debate_id,
+        'progress_callback': progress_callback,
+        'stage_callback': stage_callback,
+        'recorder': recorder,
+        'retry_budget': retry_budget or get_retry_policy().budget()
+    })
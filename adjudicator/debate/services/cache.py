@@ -0,0 +1,184 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger('llm_calls')
+
+KEY_PREFIX = 'llm-response'
+
+
+class LRUBackend:
+    """In-process LRU with per-entry expiry, bounded by max_entries"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """Delegates to one of the caches configured in settings.CACHES"""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl or None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class RedisBackend:
+    """
+    Stores responses in Redis with SETEX. Size-based eviction is left to the
+    server's maxmemory policy (allkeys-lru is recommended).
+    """
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl):
+        if ttl:
+            self.client.setex(key, ttl, value)
+        else:
+            self.client.set(key, value)
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{KEY_PREFIX}:*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for LLM stage outputs.
+
+    Entries are keyed on (stage name, model, prompt template hash, system
+    prompt hash, exact prompt text) so any change to a template or input
+    produces a new key. Hit/miss counters are kept per stage.
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: {'hits': 0, 'misses': 0, 'errors': 0})
+
+    @staticmethod
+    def make_key(stage, model, template_hash, system_hash, prompt):
+        digest = hashlib.sha256(
+            json.dumps([stage, model, template_hash, system_hash, prompt]).encode('utf-8')
+        ).hexdigest()
+        return f'{KEY_PREFIX}:{stage}:{digest}'
+
+    def _count(self, stage, counter):
+        with self._lock:
+            self._counters[stage][counter] += 1
+
+    def get(self, stage, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            # A broken cache must never fail the analysis
+            logger.warning("Response cache read failed", extra={'stage': stage, 'error': str(e)})
+            self._count(stage, 'errors')
+            return None
+        self._count(stage, 'hits' if value is not None else 'misses')
+        return value
+
+    def set(self, stage, key, value):
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning("Response cache write failed", extra={'stage': stage, 'error': str(e)})
+            self._count(stage, 'errors')
+
+    def stats(self):
+        """Return hit/miss counters per stage plus overall totals"""
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self._counters.items()}
+        totals = {'hits': 0, 'misses': 0, 'errors': 0}
+        for counts in stages.values():
+            for name, value in counts.items():
+                totals[name] += value
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.0
+        return {'backend': type(self.backend).__name__, 'stages': stages, 'totals': totals}
+
+    def clear(self):
+        self.backend.clear()
+
+
+_UNSET = object()
+_cache = _UNSET
+_cache_lock = threading.Lock()
+
+
+def build_response_cache(config):
+    """
+    Build a ResponseCache from an LLM_CACHE settings dict, or return None when
+    caching is disabled.
+    """
+    backend_name = config.get('BACKEND', 'locmem')
+    if backend_name in (None, '', 'none'):
+        return None
+    if backend_name == 'locmem':
+        backend = LRUBackend(max_entries=config.get('MAX_ENTRIES', 512))
+    elif backend_name == 'django':
+        backend = DjangoCacheBackend(config.get('ALIAS', 'default'))
+    elif backend_name == 'redis':
+        backend = RedisBackend(config['LOCATION'])
+    else:
+        raise ValueError(f"Unknown LLM cache backend: {backend_name}")
+    return ResponseCache(backend, ttl=config.get('TTL'))
+
+
+def get_response_cache():
+    """Return the process-wide ResponseCache configured by settings.LLM_CACHE"""
+    global _cache
+    if _cache is _UNSET:
+        with _cache_lock:
+            if _cache is _UNSET:
+                from django.conf import settings
+                _cache = build_response_cache(getattr(settings, 'LLM_CACHE', {}))
+    return _cache
@@ -0,0 +1,331 @@
+import os
+import json
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from .ratelimit import get_rate_limiter
+
+OPENROUTER_URL = 'https://openrouter.ai/api/v1/chat/completions'
+OPENROUTER_MODEL = 'deepseek/deepseek-chat'
+GEMINI_MODEL = 'gemini-2.0-flash'
+
+# (connect, read) timeouts in seconds for provider calls
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '10'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '90'))
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '10'))
+
+GEMINI_ACK = 'Understood. I will follow the provided instructions.'
+
+# Statuses worth asking again for; anything else in 4xx will fail the same way
+RETRYABLE_STATUSES = (408, 409, 425, 429)
+
+
+class ProviderError(Exception):
+    """
+    An LLM provider call failed
+    
+    status is the HTTP status (None when no response arrived, e.g. a
+    timeout) and retry_after the seconds the provider asked us to wait.
+    """
+    
+    def __init__(self, message, provider=None, status=None, retry_after=None):
+        super().__init__(message)
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self):
+        return self.status is None or self.status in RETRYABLE_STATUSES or self.status >= 500
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def as_provider_error(error, provider):
+    """
+    Translate a transport or SDK exception into a ProviderError
+    
+    Returns:
+        The ProviderError, or error itself if it did not come from talking to
+        the provider
+    """
+    if isinstance(error, ProviderError):
+        return error
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        return ProviderError(str(error), provider, int(error.code) if error.code else None)
+    if isinstance(error, (requests.RequestException, httpx.TransportError, TimeoutError)):
+        return ProviderError(f"{type(error).__name__}: {error}", provider)
+    return error
+
+
+_lock = threading.Lock()
+_session = None
+_gemini_configured = False
+_gemini_models = {}
+# httpx async clients are bound to the event loop that created them
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def _openrouter_headers():
+    return {
+        'Authorization': f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+        'HTTP-Referer': 'https://adjudicator.ai',
+    }
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=LLM_POOL_SIZE, pool_maxsize=LLM_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(_openrouter_headers())
+    return session
+
+
+def get_http_session():
+    """
+    Return the process-wide keep-alive session used for OpenRouter calls.
+
+    The session is created lazily so that each gunicorn worker builds its own
+    connection pool after forking.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_async_http_client():
+    """Return the keep-alive httpx.AsyncClient for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            headers=_openrouter_headers(),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=LLM_POOL_SIZE),
+        )
+        _async_http_clients[loop] = client
+    return client
+
+
+async def aclose_async_http_client():
+    """Close the running loop's httpx client, before a short-lived loop ends"""
+    client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def get_gemini_model(model_name=GEMINI_MODEL):
+    """Return a cached GenerativeModel, configuring the SDK on first use"""
+    global _gemini_configured
+    model = _gemini_models.get(model_name)
+    if model is None:
+        with _lock:
+            if not _gemini_configured:
+                genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+                _gemini_configured = True
+            model = _gemini_models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                _gemini_models[model_name] = model
+    return model
+
+
+def reset_clients():
+    """Drop all cached clients so the next call builds fresh ones"""
+    global _session, _gemini_configured
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _gemini_configured = False
+        _gemini_models.clear()
+        _async_http_clients.clear()
+
+
+def _openrouter_payload(system_prompt, prompt, model, stream):
+    payload = {
+        'model': model,
+        'messages': [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': prompt}
+        ]
+    }
+    if stream:
+        payload['stream'] = True
+    return payload
+
+
+def openrouter_chat(system_prompt, prompt, model=OPENROUTER_MODEL, url=OPENROUTER_URL, stream=False):
+    """
+    Send a chat completion request to OpenRouter over the pooled session.
+
+    With stream=True the completion is requested as server-sent events and
+    the body is left unread; pass response.iter_lines() to openrouter_deltas.
+
+    Returns:
+        requests.Response: The raw HTTP response
+    """
+    get_rate_limiter().throttle('openrouter')
+    return get_http_session().post(
+        url,
+        json=_openrouter_payload(system_prompt, prompt, model, stream),
+        timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+        stream=stream
+    )
+
+
+async def aopenrouter_chat(system_prompt, prompt, model=OPENROUTER_MODEL, url=OPENROUTER_URL):
+    """
+    Async variant of openrouter_chat using the loop's pooled httpx client.
+
+    Returns:
+        httpx.Response: The raw HTTP response
+    """
+    await get_rate_limiter().athrottle('openrouter')
+    return await get_async_http_client().post(
+        url,
+        json=_openrouter_payload(system_prompt, prompt, model, False)
+    )
+
+
+@asynccontextmanager
+async def aopenrouter_stream(system_prompt, prompt, model=OPENROUTER_MODEL, url=OPENROUTER_URL):
+    """
+    Open a streamed OpenRouter completion on the loop's pooled httpx client.
+
+    Returns:
+        An async context manager yielding the httpx.Response; pass
+        response.aiter_lines() to aopenrouter_deltas
+    """
+    await get_rate_limiter().athrottle('openrouter')
+    async with get_async_http_client().stream(
+        'POST',
+        url,
+        json=_openrouter_payload(system_prompt, prompt, model, True)
+    ) as response:
+        yield response
+
+
+def _openrouter_delta(line):
+    """Return the text delta carried by one SSE line, '' for none, or None at [DONE]"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    # Blank lines separate events; lines starting with ':' are keep-alive comments
+    if not line.startswith('data:'):
+        return ''
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None
+    choices = json.loads(data).get('choices') or [{}]
+    return choices[0].get('delta', {}).get('content') or ''
+
+
+def openrouter_deltas(lines):
+    """Yield completion text deltas from the SSE lines of a streamed OpenRouter response"""
+    for line in lines:
+        delta = _openrouter_delta(line)
+        if delta is None:
+            break
+        if delta:
+            yield delta
+
+
+async def aopenrouter_deltas(lines):
+    """Async variant of openrouter_deltas"""
+    async for line in lines:
+        delta = _openrouter_delta(line)
+        if delta is None:
+            break
+        if delta:
+            yield delta
+
+
+def _gemini_contents(system_prompt, prompt):
+    return [
+        {'role': 'user', 'parts': [system_prompt]},
+        {'role': 'model', 'parts': [GEMINI_ACK]},
+        {'role': 'user', 'parts': [prompt]},
+    ]
+
+
+def gemini_chat(system_prompt, prompt, model_name=GEMINI_MODEL, stream=False):
+    """
+    Send a single-turn conversation to Gemini using a cached model handle.
+
+    The system prompt is replayed as conversation history, matching the
+    previous start_chat() behaviour without creating a chat object per call.
+    With stream=True the response is iterated chunk by chunk; pass it to
+    gemini_deltas.
+
+    Returns:
+        The Gemini GenerateContentResponse
+    """
+    model = get_gemini_model(model_name)
+    get_rate_limiter().throttle('gemini')
+    return model.generate_content(
+        _gemini_contents(system_prompt, prompt),
+        stream=stream,
+        request_options={'timeout': LLM_READ_TIMEOUT}
+    )
+
+
+async def agemini_chat(system_prompt, prompt, model_name=GEMINI_MODEL, stream=False):
+    """Async variant of gemini_chat"""
+    model = get_gemini_model(model_name)
+    await get_rate_limiter().athrottle('gemini')
+    return await model.generate_content_async(
+        _gemini_contents(system_prompt, prompt),
+        stream=stream,
+        request_options={'timeout': LLM_READ_TIMEOUT}
+    )
+
+
+def _gemini_chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # Chunks that only carry finish metadata have no text parts
+        return ''
+
+
+def gemini_deltas(response):
+    """Yield text deltas from a streamed Gemini response"""
+    for chunk in response:
+        text = _gemini_chunk_text(chunk)
+        if text:
+            yield text
+
+
+async def agemini_deltas(response):
+    """Async variant of gemini_deltas"""
+    async for chunk in response:
+        text = _gemini_chunk_text(chunk)
+        if text:
+            yield text
@@ -0,0 +1,167 @@
+import bisect
+import ipaddress
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import geoip2.database
+import geoip2.errors
+import maxminddb
+
+logger = logging.getLogger('llm_calls')
+
+
+def compile_eu_intervals(networks):
+    """
+    Collapse the EU networks of a MaxMind country database into sorted ranges
+
+    Args:
+        networks: (ipaddress network, record) pairs, as yielded by iterating
+            a maxminddb reader
+
+    Returns:
+        dict: {4: (starts, ends), 6: (starts, ends)} of merged, sorted
+            integer address ranges (inclusive) in the EU
+    """
+    ranges = {4: [], 6: []}
+    for network, record in networks:
+        if not (record or {}).get('country', {}).get('is_in_european_union'):
+            continue
+        ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+    intervals = {}
+    for version, spans in ranges.items():
+        starts, ends = [], []
+        for start, end in sorted(spans):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        intervals[version] = (starts, ends)
+    return intervals
+
+
+def load_eu_intervals(db_path):
+    """Read a GeoLite2/GeoIP2 country database and compile its EU ranges"""
+    with maxminddb.open_database(db_path) as reader:
+        return compile_eu_intervals(reader)
+
+
+class IPClassifier:
+    """
+    Decides whether a client IP is in the EU, with an LRU of recent decisions
+
+    Lookups go to the precompiled intervals when given (a binary search, no
+    database reader involved), otherwise to a geoip2 reader. Addresses that
+    are invalid or not in the database count as outside the EU; other
+    lookup errors are logged and also let through.
+    """
+
+    def __init__(self, reader=None, intervals=None, cache_size=4096):
+        self.reader = reader
+        self.intervals = intervals
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.lookup_seconds = 0.0
+
+    def is_eu(self, ip):
+        with self._lock:
+            in_eu = self._cache.get(ip)
+            if in_eu is not None:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return in_eu
+
+        start = time.perf_counter()
+        in_eu = self._lookup(ip)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self.lookup_seconds += elapsed
+            self._cache[ip] = in_eu
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return in_eu
+
+    def _lookup(self, ip):
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except (AttributeError, ValueError):
+            return False
+
+        if self.intervals is not None:
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            starts, ends = self.intervals[address.version]
+            value = int(address)
+            i = bisect.bisect_right(starts, value) - 1
+            return i >= 0 and value <= ends[i]
+
+        try:
+            return bool(self.reader.country(str(address)).country.is_in_european_union)
+        except geoip2.errors.AddressNotFoundError:
+            return False
+        except Exception as e:
+            # Let the request through rather than block on a broken lookup
+            self.errors += 1
+            logger.warning("GeoIP lookup failed", extra={'ip': ip, 'error': str(e)})
+            return False
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'mode': 'intervals' if self.intervals is not None else 'reader',
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'mean_lookup_us': round(self.lookup_seconds / self.misses * 1e6, 2) if self.misses else None,
+        }
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def build_ip_classifier(config):
+    """
+    Build an IPClassifier from a GEOIP settings dict, or return None when the
+    database file is missing (the EU check is then skipped)
+    """
+    db_path = config.get('DB_PATH')
+    if not db_path or not os.path.exists(db_path):
+        return None
+    if config.get('PRECOMPILE'):
+        start = time.perf_counter()
+        intervals = load_eu_intervals(db_path)
+        logger.info("Compiled EU IP ranges", extra={
+            'ipv4_ranges': len(intervals[4][0]),
+            'ipv6_ranges': len(intervals[6][0]),
+            'seconds': round(time.perf_counter() - start, 2)
+        })
+        return IPClassifier(intervals=intervals, cache_size=config.get('CACHE_SIZE', 4096))
+    return IPClassifier(reader=geoip2.database.Reader(db_path), cache_size=config.get('CACHE_SIZE', 4096))
+
+
+def get_ip_classifier():
+    """Return the process-wide IPClassifier configured by settings.GEOIP (or None)"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                from django.conf import settings
+                _classifier = build_ip_classifier(getattr(settings, 'GEOIP', {})) or False
+    return _classifier or None
@@ -0,0 +1,66 @@
+import logging
+import threading
+from django.utils import timezone
+
+logger = logging.getLogger('llm_calls')
+
+
+class InteractionRecorder:
+    """
+    Collects the LLM interactions of one analysis in memory
+
+    Calls are recorded as they finish, from whichever pipeline thread or
+    task made them, and written with a single bulk_create once the debate
+    they belong to has been saved. An analysis that fails before then has
+    no debate to attach them to, so its interactions are only logged.
+    """
+
+    def __init__(self):
+        self._interactions = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._interactions)
+
+    def record(self, prompt_name, prompt_text, response='', model_used='unknown', success=True,
+               error_message=None, latency_ms=None, attempts=1, prompt_tokens=None, response_tokens=None):
+        """Add one finished call; takes the fields of LLMInteraction"""
+        with self._lock:
+            self._interactions.append({
+                'timestamp': timezone.now(),
+                'prompt_name': prompt_name,
+                'prompt_text': prompt_text,
+                'response': response,
+                'model_used': model_used,
+                'success': success,
+                'error_message': error_message,
+                'latency_ms': latency_ms,
+                'attempts': attempts,
+                'prompt_tokens': prompt_tokens,
+                'response_tokens': response_tokens,
+            })
+
+    def save(self, debate):
+        """
+        Write the recorded interactions for debate and clear them
+
+        Returns:
+            list: The created LLMInteraction rows
+        """
+        from ..models import LLMInteraction
+        with self._lock:
+            interactions, self._interactions = self._interactions, []
+        return LLMInteraction.objects.bulk_create(
+            [LLMInteraction(debate=debate, **fields) for fields in interactions]
+        )
+
+    def discard(self, reason):
+        """Drop the recorded interactions, e.g. when the analysis failed"""
+        with self._lock:
+            interactions, self._interactions = self._interactions, []
+        if interactions:
+            logger.info("Discarded LLM interactions", extra={
+                'count': len(interactions),
+                'reason': reason,
+                'prompt_names': [fields['prompt_name'] for fields in interactions]
+            })
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from ..models import AnalysisJob, AnalysisEvent, Debate, IPCreditUsage
+from .analysis import aperform_analysis, build_structured_results
+from .clients import ProviderError, aclose_async_http_client
+from .interactions import InteractionRecorder
+
+logger = logging.getLogger('llm_calls')
+
+# Stages that end a progress stream
+TERMINAL_STAGES = ('complete', 'error')
+
+RATE_LIMIT_MESSAGE = (
+    "I'm currently using free-tier API access while testing. "
+    "Please wait a minute and try again. "
+    "Rate limits will be increased once cost controls are in place."
+)
+
+
+class ProgressChannel:
+    """
+    Append-only progress log for one analysis job
+
+    Every update is stored as an AnalysisEvent with an increasing sequence
+    number, so SSE readers can resume after a reconnect from Last-Event-ID.
+    The channel keeps the percentage monotonic and accumulates content
+    snippets, so each stored event is a complete snapshot for the client.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self._lock = threading.Lock()
+        last = job.events.order_by('-seq').first()
+        self.seq = last.seq if last else 0
+        self.last_percent = last.data.get('percent', 0) if last else 0
+        self.snippets = dict(last.data.get('snippets', {})) if last else {}
+
+    def publish(self, data):
+        with self._lock:
+            # Save data in appropriate category if it has content
+            if 'content_snippet' in data and data.get('content_type'):
+                self.snippets[data['content_type']] = data['content_snippet']
+
+            # Only ever move the percentage forward
+            if data.get('percent', 0) > self.last_percent:
+                self.last_percent = data['percent']
+
+            event = {
+                'stage': data.get('stage', 'processing'),
+                'message': data.get('message', 'Processing...'),
+                'percent': self.last_percent,
+                'snippets': dict(self.snippets)
+            }
+            for key in ('title', 'belligerent_1', 'belligerent_2', 'summary_1', 'summary_2', 'attempt'):
+                if key in data:
+                    event[key] = data[key]
+
+            self.seq += 1
+            AnalysisEvent.objects.create(job=self.job, seq=self.seq, data=event)
+            return self.seq
+
+    def finish(self, data):
+        """Publish a terminal event verbatim (complete or error)"""
+        with self._lock:
+            self.seq += 1
+            AnalysisEvent.objects.create(job=self.job, seq=self.seq, data=data)
+            return self.seq
+
+
+def run_pipeline(text, progress_callback, stage_outputs, stage_callback, recorder):
+    """
+    Run an analysis on an event loop of its own, through aperform_analysis
+
+    Stages await their LLM calls, so waiting on the provider does not hold a
+    thread per call. The callbacks write to the database, which Django does
+    not allow on an event loop, so they are handed to a single writer thread
+    that keeps them in order; it has finished them all when this returns.
+
+    Returns:
+        dict: The analysis results
+    """
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis-writer')
+
+    def in_writer(fn):
+        def call(*args):
+            writer.submit(fn, *args).add_done_callback(log_write_error)
+        return call
+
+    async def analyse():
+        try:
+            return await aperform_analysis(
+                text,
+                progress_callback=in_writer(progress_callback),
+                stage_outputs=stage_outputs,
+                stage_callback=in_writer(stage_callback),
+                recorder=recorder
+            )
+        finally:
+            await aclose_async_http_client()
+
+    try:
+        return asyncio.run(analyse())
+    finally:
+        writer.submit(connections.close_all)
+        writer.shutdown(wait=True)
+
+
+def log_write_error(future):
+    if future.exception() is not None:
+        logger.error("Failed to record analysis progress", extra={'error': str(future.exception())})
+
+
+def run_job(job_id):
+    """
+    Run (or resume) an analysis job and record its progress
+
+    Outputs of finished stages are saved on the job as they complete, so a
+    job that is retried after a worker restart skips the stages it already
+    paid for.
+    """
+    job = AnalysisJob.objects.get(id=job_id)
+    if job.status == AnalysisJob.Status.COMPLETE:
+        return job.debate_id
+
+    job.status = AnalysisJob.Status.RUNNING
+    job.attempts += 1
+    job.save(update_fields=['status', 'attempts', 'updated_at'])
+    channel = ProgressChannel(job)
+    recorder = InteractionRecorder()
+    outputs_lock = threading.Lock()
+
+    def save_stage_outputs(stage, outputs):
+        with outputs_lock:
+            job.stage_outputs.update(outputs)
+            AnalysisJob.objects.filter(id=job.id).update(stage_outputs=job.stage_outputs)
+
+    try:
+        result = run_pipeline(job.text, channel.publish, job.stage_outputs, save_stage_outputs, recorder)
+
+        debate = Debate.objects.create(
+            original_text=job.text,
+            belligerent_1=result['belligerent_1'],
+            belligerent_2=result['belligerent_2'],
+            summary_1=result['summary_1'],
+            summary_2=result['summary_2'],
+            winner=result['winner'],
+            credit_cost=job.credit_cost,
+            analysis=result['analysis'],
+            evaluation=result['evaluation'],
+            judgment=result['judgment'],
+            title=result['title'],
+            evaluation_formatted=result['evaluation_formatted'],
+            judgment_formatted=result['judgment_formatted'],
+            structured_results=build_structured_results(
+                result['evaluation_formatted'], result['judgment_formatted'], result['judgment']
+            )
+        )
+        logger.info(f"Created debate with ID: {debate.id}")
+
+        job.debate = debate
+        job.status = AnalysisJob.Status.COMPLETE
+        job.save(update_fields=['debate', 'status', 'updated_at'])
+
+        channel.finish({
+            'stage': 'complete',
+            'message': 'Analysis complete!',
+            'percent': 100,
+            'redirect': f'/result/{debate.id}/',
+            'debate_id': debate.id,
+            'winner': result['winner'],
+            'judgment': result['judgment']
+        })
+        save_interactions(recorder, debate)
+        return debate.id
+
+    except Exception as e:
+        logger.error("Analysis job failed", extra={'job_id': str(job.id), 'error': str(e)})
+        job.status = AnalysisJob.Status.FAILED
+        job.error_message = str(e)
+        job.save(update_fields=['status', 'error_message', 'updated_at'])
+        refund_job_credits(job)
+        recorder.discard('analysis failed')
+
+        if isinstance(e, ProviderError) and e.status == 429:
+            message = RATE_LIMIT_MESSAGE
+        else:
+            message = str(e)
+        channel.finish({'stage': 'error', 'message': message, 'percent': 0})
+        raise
+
+
+def save_interactions(recorder, debate):
+    """Write a finished analysis's LLM interactions, after the client has been told it is done"""
+    try:
+        recorder.save(debate)
+    except Exception as e:
+        # Telemetry only; the debate itself is already saved
+        logger.error("Failed to save LLM interactions", extra={'debate_id': debate.id, 'error': str(e)})
+
+
+def refund_job_credits(job):
+    """Give a failed job's credits back to its IP, at most once per job"""
+    if job.ip_address and AnalysisJob.objects.filter(id=job.id, credits_refunded=False).update(credits_refunded=True):
+        IPCreditUsage.refund_credits(job.ip_address, job.credit_cost)
+
+
+def _run_job_in_thread(job_id):
+    try:
+        run_job(job_id)
+    except Exception:
+        # Already recorded on the job and its progress stream
+        pass
+    finally:
+        connections.close_all()
+
+
+def submit_analysis(text, ip_address=None, credit_cost=Decimal('1.00')):
+    """
+    Create an AnalysisJob and hand it to the job queue
+
+    With ANALYSIS_QUEUE = 'celery' the job is sent to the Celery broker (or
+    run inline when CELERY_TASK_ALWAYS_EAGER is set, as in tests). With
+    'thread' it runs in a background thread of the current process, which is
+    only meant for local development without a broker.
+
+    Returns:
+        AnalysisJob: The created job
+    """
+    job = AnalysisJob.objects.create(text=text, ip_address=ip_address, credit_cost=credit_cost)
+    ProgressChannel(job).publish({
+        'stage': 'queued',
+        'message': 'Identifying participants and arguments...',
+        'percent': 5
+    })
+
+    if settings.ANALYSIS_QUEUE == 'celery':
+        from ..tasks import run_analysis
+        run_analysis.delay(str(job.id))
+    else:
+        threading.Thread(target=_run_job_in_thread, args=(job.id,), daemon=True).start()
+    return job
+
+
+def lost_job_message(job_id):
+    """
+    Explain why a job will never publish a terminal event, if it will not
+    
+    That is the case when the job failed without one, or when it is still
+    pending or running but has shown no progress for ANALYSIS_STALE_SECONDS.
+    
+    Returns:
+        str: The message to end the job's progress stream with, or None if
+            the job may still finish
+    """
+    job = AnalysisJob.objects.get(id=job_id)
+    last = job.events.order_by('-seq').first()
+    if last and last.data.get('stage') in TERMINAL_STAGES:
+        # The stream will pick it up on its next poll
+        return None
+    if job.status == AnalysisJob.Status.FAILED:
+        return job.error_message or 'The analysis failed.'
+    if job.status == AnalysisJob.Status.COMPLETE:
+        return None
+    active = max(job.updated_at, last.created_at) if last else job.updated_at
+    if (timezone.now() - active).total_seconds() > settings.ANALYSIS_STALE_SECONDS:
+        logger.error("Analysis job lost", extra={'job_id': str(job.id), 'status': job.status})
+        return 'The analysis stopped responding. Please try again.'
+    return None
+
+
+def events_after(job_id, last_seq):
+    """Return the stored events for a job with a sequence number above last_seq"""
+    return AnalysisEvent.objects.filter(job_id=job_id, seq__gt=last_seq).order_by('seq')
@@ -1,38 +1,27 @@
-import os
+import asyncio
 import logging
-from datetime import datetime
-import requests
-import google.generativeai as genai
 import re
 import time
+from contextlib import contextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import clients
+from .prompts import get_registry
+from .cache import get_response_cache
+from .metrics import Tracker, get_metrics
+from .replay import get_replay_provider
+from .retry import get_retry_policy
+from .xmltags import TagTree, parse_tags, strip_tags
 
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-HEADERS = {
-    'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-    'HTTP-Referer': 'https://adjudicator.ai',
-}
+logger = logging.getLogger('llm_calls')
 
-def setup_llm_logger():
-    log_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
-    os.makedirs(log_dir, exist_ok=True)
-    
-    logger = logging.getLogger('llm_calls')
-    logger.setLevel(logging.DEBUG)
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    handler = logging.FileHandler(os.path.join(log_dir, f'llm_calls_{today}.log'))
-    handler.setLevel(logging.DEBUG)
-    
-    formatter = logging.Formatter('%(asctime)s\n%(message)s\n' + '-'*80 + '\n')
-    handler.setFormatter(formatter)
-    
-    logger.addHandler(handler)
-    return logger
+# Minimum seconds between partial-content updates while a response streams
+STREAM_SNIPPET_INTERVAL = 1.0
+# Number of trailing characters of partial content sent with each update
+STREAM_SNIPPET_CHARS = 600
 
 def load_prompt(filename):
-    prompt_path = os.path.join(os.path.dirname(__file__), '..', 'prompts', filename)
-    with open(prompt_path) as f:
-        return f.read().strip()
+    return get_registry().text(filename)
 
 def validate_xml_response(response, expected_tags, prompt_name):
     """
@@ -46,21 +35,454 @@ def validate_xml_response(response, expected_tags, prompt_name):
     Returns:
         tuple: (is_valid, missing_tags)
     """
-    logger = logging.getLogger('llm_calls')
-    missing_tags = []
-    
-    for tag in expected_tags:
-        if not re.search(f'<{tag}>(.*?)</{tag}>', response, re.DOTALL):
-            missing_tags.append(tag)
+    missing_tags = parse_tags(response).missing(expected_tags)
     
     if missing_tags:
-        logger.warning(f"Response for {prompt_name} missing tags: {', '.join(missing_tags)}")
+        logger.warning("LLM response missing tags", extra={
+            'prompt_name': prompt_name,
+            'missing_tags': missing_tags
+        })
         return False, missing_tags
     
     return True, []
 
+class TagStreamWatcher:
+    """
+    Watches a streamed response for tags of interest and reports their
+    partial content as it arrives
+    
+    Text is fed in chunk by chunk into a TagTree, which only tokenizes the
+    newly received part, so the cost per chunk does not grow with the length
+    of the response. Updates for a tag are throttled to one per
+    STREAM_SNIPPET_INTERVAL, with a final update as soon as its closing tag
+    arrives.
+    """
+    
+    def __init__(self, tags, callback, interval=STREAM_SNIPPET_INTERVAL):
+        """
+        Args:
+            tags (dict): Maps tag names to the snippet content_type they feed
+            callback (callable): Called with (content_type, partial_text)
+            interval (float): Minimum seconds between updates for a tag
+        """
+        self.tags = tags
+        self.callback = callback
+        self.interval = interval
+        self.tree = TagTree()
+        self._closed = set()
+        self._last_sent = {}
+        self._last_text = {}
+    
+    @property
+    def buffer(self):
+        return self.tree.text
+    
+    def feed(self, chunk):
+        self.tree.feed(chunk)
+        
+        for tag, content_type in self.tags.items():
+            if tag in self._closed:
+                continue
+            
+            node = self.tree.find_open(tag)
+            if node is None:
+                continue
+            if node.closed:
+                self._closed.add(tag)
+                self._send(tag, content_type, node.raw)
+            elif time.monotonic() - self._last_sent.get(tag, 0) >= self.interval:
+                self._send(tag, content_type, node.raw)
+    
+    def _send(self, tag, content_type, raw):
+        self._last_sent[tag] = time.monotonic()
+        # Snippets are shown as plain text, so drop nested markup
+        text = re.sub(r'\s+', ' ', strip_tags(raw)).strip()
+        if len(text) > STREAM_SNIPPET_CHARS:
+            text = '...' + text[-STREAM_SNIPPET_CHARS:]
+        if not text or text == self._last_text.get(tag):
+            return
+        self._last_text[tag] = text
+        self.callback(content_type, text)
+
+class LLMCall:
+    """
+    State and bookkeeping for one logical LLM call across its retry attempts
+    
+    The transport (blocking or async) lives in make_llm_call and
+    amake_llm_call; everything else - progress updates, caching, validation,
+    retry decisions, logging and interaction records - is shared through
+    this class.
+    
+    A response that has only some of the expected tags is first repaired:
+    the next attempt sends just that response and the names of the missing
+    tags, and the sections that come back are appended to it. If the
+    repaired response is still invalid, the attempt after that regenerates
+    it in full.
+    """
+    
+    RETRY_REMINDER = "IMPORTANT: Your response MUST include all the XML tags specified in the instructions. Make sure to properly open and close all tags."
+    
+    def __init__(self, prompt, use_openrouter=False, role='system', debate_id=None, prompt_name=None,
+                 expected_tags=None, max_retries=2, user_update_callback=None, use_cache=True,
+                 stream_tags=None, recorder=None, retry_budget=None, cancellation=None):
+        self.prompt = prompt
+        self.use_openrouter = use_openrouter
+        self.role = role
+        self.debate_id = debate_id
+        self.prompt_name = prompt_name
+        self.expected_tags = expected_tags
+        self.max_retries = max_retries
+        self.user_update_callback = user_update_callback
+        self.current_prompt = prompt
+        self.model_used = None
+        
+        self.policy = get_retry_policy()
+        self.retry_budget = retry_budget
+        self.cancellation = cancellation
+        # (response, missing tags) to repair on the next attempt, and the
+        # pair being repaired by the current one
+        self.pending_repair = None
+        self.repairing = None
+        
+        # Telemetry kept with the interaction record
+        self.recorder = recorder
+        self.tracker = Tracker()
+        self.started = None
+        self.attempt = 0
+        self.prompt_tokens = None
+        self.response_tokens = None
+        
+        # Stream the response only when someone is listening for partial content
+        self.stream_tags = stream_tags if user_update_callback and prompt_name else None
+        self.watcher = None
+        
+        # Pre-rendered system prompt for this role
+        system = get_registry().system_prompt(role)
+        self.system_prompt = system.text
+        self.system_hash = system.hash
+        
+        # Recorded responses stand in for the provider when replaying; they
+        # are kept out of the response cache
+        self.replay = get_replay_provider() if getattr(settings, 'LLM_PROVIDER', 'live') == 'replay' else None
+        
+        self.cache = get_response_cache() if use_cache and prompt_name and not self.replay else None
+        self.cache_key = None
+        if self.cache:
+            template = get_registry().templates.get(f'{prompt_name}.txt')
+            self.cache_key = self.cache.make_key(
+                prompt_name,
+                clients.OPENROUTER_MODEL if use_openrouter else clients.GEMINI_MODEL,
+                template.hash if template else '',
+                self.system_hash,
+                prompt
+            )
+    
+    @property
+    def provider(self):
+        if self.replay:
+            return 'replay'
+        return 'openrouter' if self.use_openrouter else 'gemini'
+    
+    @contextmanager
+    def track(self):
+        """Time the whole call, retries included, into the LLM metrics"""
+        with get_metrics().track('adjudicator_llm_call_seconds', 'adjudicator_llm_in_flight',
+                                 prompt_name=self.prompt_name or 'unnamed') as self.tracker:
+            yield self.tracker
+    
+    def count(self, metric, amount=1, **labels):
+        get_metrics().inc(metric, amount, prompt_name=self.prompt_name or 'unnamed', **labels)
+    
+    def notify(self, status, message, **extra):
+        if self.user_update_callback and self.prompt_name:
+            self.user_update_callback({
+                'status': status,
+                'stage': self.prompt_name,
+                'message': message,
+                **extra
+            })
+    
+    def start(self):
+        """
+        Announce the call and check the response cache
+        
+        Returns:
+            str: A cached response, or None if the provider must be called
+        """
+        self.started = time.monotonic()
+        self.notify('processing', f"Processing {self.prompt_name} step...")
+        logger.info("LLM call started", extra={
+            'prompt_name': self.prompt_name,
+            'role': self.role,
+            'system_prompt_hash': self.system_hash,
+            'prompt_chars': len(self.prompt),
+            'debate_id': self.debate_id
+        })
+        
+        # Serve identical (stage, model, template, input) requests from the cache
+        if self.cache:
+            cached = self.cache.get(self.prompt_name, self.cache_key)
+            self.count('adjudicator_llm_cache_requests_total', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                self.tracker.outcome = 'cached'
+                logger.info("LLM response served from cache", extra={'prompt_name': self.prompt_name})
+                self.notify('completed', f"Completed {self.prompt_name} step")
+                return cached
+        return None
+    
+    def attempts(self):
+        """Yield the attempt numbers, stopping with PipelineCancelled once the pipeline gave up"""
+        for attempt in range(1, self.max_retries + 2):
+            if self.cancellation:
+                self.cancellation.check()
+            yield attempt
+    
+    def prepare_attempt(self, attempt):
+        """
+        Return the prompt for this attempt: a repair request, or the full
+        prompt, emphasising format requirements on retries
+        """
+        self.attempt = attempt
+        self.repairing, self.pending_repair = self.pending_repair, None
+        if self.repairing:
+            response, missing_tags = self.repairing
+            self.current_prompt = load_prompt('repair.txt').format(
+                missing_tags=', '.join(f'<{tag}>' for tag in missing_tags),
+                response=response
+            )
+            self.notify(
+                'retrying',
+                f"Repairing {self.prompt_name} step (attempt {attempt}/{self.max_retries+1})...",
+                attempt=attempt
+            )
+            return self.current_prompt
+        
+        self.current_prompt = self.prompt
+        if attempt > 1:
+            self.current_prompt = f"{self.RETRY_REMINDER}\n\n{self.prompt}"
+            self.notify(
+                'retrying',
+                f"Retrying {self.prompt_name} step (attempt {attempt}/{self.max_retries+1})...",
+                attempt=attempt
+            )
+        return self.current_prompt
+    
+    @property
+    def streaming(self):
+        # Repairs are short and only complete sections are kept from them
+        return bool(self.stream_tags) and not self.repairing
+    
+    def repaired(self, content):
+        """Append the sections returned by a repair attempt to the response being repaired"""
+        if not self.repairing:
+            return content
+        response, missing_tags = self.repairing
+        tree = parse_tags(content)
+        sections = [f'<{tag}>{node.raw}</{tag}>' for tag in missing_tags if (node := tree.find(tag)) is not None]
+        return '\n\n'.join([response] + sections)
+    
+    def allow_retry(self, attempt, delay):
+        """Whether another attempt, delay seconds from now, fits in max_retries and the retry budget"""
+        if attempt > self.max_retries:
+            return False
+        if self.retry_budget is not None and not self.retry_budget.spend(delay):
+            logger.warning("Retry budget exhausted", extra={
+                'prompt_name': self.prompt_name,
+                'attempt': attempt
+            })
+            return False
+        return True
+    
+    def check_openrouter_status(self, response, attempt):
+        """Raise if OpenRouter answered with an error status"""
+        if response.status_code != 200:
+            error_msg = f"API returned status code {response.status_code}: {response.text}"
+            logger.error("OpenRouter returned an error", extra={
+                'prompt_name': self.prompt_name,
+                'attempt': attempt,
+                'status_code': response.status_code,
+                'response_excerpt': response.text[:500]
+            })
+            raise clients.ProviderError(
+                error_msg,
+                'openrouter',
+                response.status_code,
+                clients.parse_retry_after(response.headers.get('Retry-After'))
+            )
+        self.model_used = clients.OPENROUTER_MODEL
+    
+    def openrouter_content(self, response, attempt):
+        """Extract the completion text from an OpenRouter HTTP response"""
+        self.check_openrouter_status(response, attempt)
+        data = response.json()
+        usage = data.get('usage') or {}
+        self.prompt_tokens = usage.get('prompt_tokens')
+        self.response_tokens = usage.get('completion_tokens')
+        return data['choices'][0]['message']['content']
+    
+    def gemini_content(self, response):
+        self.model_used = 'gemini-2.0-flash-exp'
+        self.gemini_usage(response)
+        return response.text
+    
+    def gemini_usage(self, response):
+        """Take token counts from a Gemini response (streamed ones have them once fully read)"""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            self.prompt_tokens = usage.prompt_token_count or None
+            self.response_tokens = usage.candidates_token_count or None
+    
+    def replay_content(self, prompt):
+        """Serve the recorded response for prompt in place of a provider call"""
+        self.model_used = 'replay'
+        if self.streaming:
+            return self.collect(self.replay.deltas(self.prompt_name, prompt))
+        return self.replay.chat(self.prompt_name, prompt)
+    
+    async def areplay_content(self, prompt):
+        """Async variant of replay_content"""
+        self.model_used = 'replay'
+        if self.streaming:
+            return await self.acollect(self.replay.adeltas(self.prompt_name, prompt))
+        return await self.replay.achat(self.prompt_name, prompt)
+    
+    def stream_snippet(self, content_type, text):
+        self.notify('streaming', f"Receiving {self.prompt_name} step...",
+                    content_type=content_type, content_snippet=text)
+    
+    def collect(self, deltas):
+        """Accumulate streamed text deltas, reporting partial tag content on the way"""
+        self.watcher = TagStreamWatcher(self.stream_tags, self.stream_snippet)
+        for delta in deltas:
+            self.watcher.feed(delta)
+        return self.watcher.buffer
+    
+    async def acollect(self, deltas):
+        """Async variant of collect"""
+        self.watcher = TagStreamWatcher(self.stream_tags, self.stream_snippet)
+        async for delta in deltas:
+            self.watcher.feed(delta)
+        return self.watcher.buffer
+    
+    def accept(self, content, attempt):
+        """
+        Validate a response
+        
+        Returns:
+            bool: False if the response is malformed and should be retried
+        """
+        logger.info("LLM response received", extra={
+            'prompt_name': self.prompt_name,
+            'attempt': attempt,
+            'model': self.model_used,
+            'response_chars': len(content)
+        })
+        
+        self.is_valid = True
+        if self.expected_tags:
+            self.is_valid, missing_tags = validate_xml_response(content, self.expected_tags, self.prompt_name)
+            if not self.is_valid:
+                self.count('adjudicator_llm_validation_failures_total')
+                # The provider did answer, so there is nothing to wait for
+                if self.allow_retry(attempt, 0):
+                    # Recordings only hold responses to the full prompt
+                    repair = (self.policy.repair and not self.repairing and not self.replay
+                              and len(missing_tags) < len(self.expected_tags))
+                    if repair:
+                        self.pending_repair = (content, missing_tags)
+                    self.count('adjudicator_llm_retries_total', reason='repair' if repair else 'invalid_response')
+                    logger.warning("Invalid response format, retrying", extra={
+                        'prompt_name': self.prompt_name,
+                        'attempt': attempt,
+                        'missing_tags': missing_tags,
+                        'repair': repair
+                    })
+                    return False
+                logger.error("Failed to get valid response", extra={
+                    'prompt_name': self.prompt_name,
+                    'attempts': attempt
+                })
+        return True
+    
+    def succeed(self, content):
+        """Cache, record and announce a successful response"""
+        # Only cache responses that passed validation
+        if self.cache and self.is_valid:
+            self.cache.set(self.prompt_name, self.cache_key, content)
+        
+        if not self.is_valid:
+            self.tracker.outcome = 'invalid'
+        for direction, tokens in (('prompt', self.prompt_tokens), ('response', self.response_tokens)):
+            if tokens:
+                self.count('adjudicator_llm_tokens_total', provider=self.provider, direction=direction, amount=tokens)
+        
+        self.record(response=content)
+        self.notify('completed', f"Completed {self.prompt_name} step")
+        return content
+    
+    def record(self, **fields):
+        """
+        Keep the interaction, with its latency, attempts and token counts
+        
+        With a recorder it is only collected in memory, to be saved with the
+        rest of the analysis. Otherwise it is written straight away when the
+        call belongs to an existing debate.
+        """
+        if not self.prompt_name:
+            return
+        fields.update(
+            prompt_name=self.prompt_name,
+            # A repaired response answers the full prompt
+            prompt_text=self.prompt if self.repairing else self.current_prompt,
+            model_used=self.model_used or 'unknown',
+            latency_ms=round((time.monotonic() - self.started) * 1000) if self.started else None,
+            attempts=self.attempt,
+            prompt_tokens=self.prompt_tokens,
+            response_tokens=self.response_tokens
+        )
+        if self.recorder is not None:
+            self.recorder.record(**fields)
+        elif self.debate_id:
+            from ..models import LLMInteraction
+            LLMInteraction.objects.create(debate_id=self.debate_id, **fields)
+    
+    def retry_delay(self, error, attempt):
+        """
+        Log a failed attempt and decide whether to try again
+        
+        Args:
+            error (Exception): The error, as returned by clients.as_provider_error
+            attempt (int): The attempt that failed
+            
+        Returns:
+            float: Seconds to wait before the next attempt, or None to give up
+        """
+        status = getattr(error, 'status', None)
+        logger.error("Error making LLM call", extra={
+            'prompt_name': self.prompt_name,
+            'attempt': attempt,
+            'status': status,
+            'error': str(error)
+        })
+        self.count('adjudicator_llm_provider_errors_total', provider=self.provider,
+                   error=f'status_{status}' if status else type(error).__name__)
+        
+        # The next attempt repairs the same response again
+        self.pending_repair = self.repairing
+        delay = self.policy.delay(attempt, error)
+        if delay is None or not self.allow_retry(attempt, delay):
+            return None
+        self.count('adjudicator_llm_retries_total', reason='error')
+        return delay
+    
+    def fail(self, error):
+        """Record and announce a call that exhausted its retries"""
+        self.record(success=False, error_message=str(error))
+        self.notify('error', f"Error in {self.prompt_name} step: {str(error)}")
+
 def make_llm_call(prompt, use_openrouter=False, role='system', debate_id=None, prompt_name=None, 
-                  expected_tags=None, max_retries=2, user_update_callback=None):
+                  expected_tags=None, max_retries=2, user_update_callback=None, use_cache=True,
+                  stream_tags=None, recorder=None, retry_budget=None, cancellation=None):
     """
     Make an LLM call with validation and retry logic
     
@@ -68,157 +490,134 @@ def make_llm_call(prompt, use_openrouter=False, role='system', debate_id=None, p
         prompt (str): The prompt to send to the LLM
         use_openrouter (bool): Whether to use OpenRouter or Gemini
         role (str): The role for the LLM ('system', 'summarizer', etc.)
-        debate_id (int): The ID of the debate for logging
+        debate_id (int): The ID of the debate for logging (the interaction is saved
+            against it straight away when no recorder is given)
         prompt_name (str): Name of the prompt being used
         expected_tags (list): List of XML tags that must be in the response
         max_retries (int): Maximum number of retry attempts
         user_update_callback (callable): Function to call with progress updates
+        use_cache (bool): Whether to serve and store validated responses in the response cache
+        stream_tags (dict): Tags whose partial content is sent to user_update_callback
+            as the response streams in, mapped to their snippet content_type
+        recorder (InteractionRecorder): Collects the interaction instead of it
+            being written to the database during the call
+        retry_budget (RetryBudget): Retries shared with the other calls made for
+            the same request; without one only max_retries limits them
+        cancellation (Cancellation): The pipeline's cancellation, checked before
+            each attempt
         
     Returns:
         str: The LLM response
     """
-    logger = setup_llm_logger()
-    logger.debug("=== LLM Call ===\nPrompt:\n%s", prompt)
-    
-    # Send update to user if callback provided
-    if user_update_callback and prompt_name:
-        user_update_callback({
-            'status': 'processing',
-            'stage': prompt_name,
-            'message': f"Processing {prompt_name} step..."
-        })
-    
-    attempt = 0
-    content = None
-    model_used = None
-    
-    while attempt <= max_retries:
-        attempt += 1
-        
-        try:
-            # Set up system prompt based on role
-            if role == 'summarizer':
-                system_prompt = load_prompt('summarizer.txt')
-            else:
-                system_prompt = load_prompt('system.txt')
-                principles = load_prompt('principles.txt')
-                system_prompt = system_prompt.format(principles=principles)
+    call = LLMCall(prompt, use_openrouter, role, debate_id, prompt_name,
+                   expected_tags, max_retries, user_update_callback, use_cache, stream_tags, recorder,
+                   retry_budget, cancellation)
+    with call.track():
+        cached = call.start()
+        if cached is not None:
+            return cached
+        
+        for attempt in call.attempts():
+            try:
+                current_prompt = call.prepare_attempt(attempt)
             
-            # Modify prompt for retries to emphasize format requirements
-            current_prompt = prompt
-            if attempt > 1:
-                reminder = "IMPORTANT: Your response MUST include all the XML tags specified in the instructions. Make sure to properly open and close all tags."
-                current_prompt = f"{reminder}\n\n{prompt}"
-                
-                if user_update_callback:
-                    user_update_callback({
-                        'status': 'retrying',
-                        'stage': prompt_name,
-                        'attempt': attempt,
-                        'message': f"Retrying {prompt_name} step (attempt {attempt}/{max_retries+1})..."
-                    })
+                # Make the actual API call
+                if call.replay:
+                    content = call.replay_content(current_prompt)
+                elif call.use_openrouter and call.streaming:
+                    with clients.openrouter_chat(call.system_prompt, current_prompt, stream=True) as response:
+                        call.check_openrouter_status(response, attempt)
+                        content = call.collect(clients.openrouter_deltas(response.iter_lines()))
+                elif call.use_openrouter:
+                    response = clients.openrouter_chat(call.system_prompt, current_prompt)
+                    content = call.openrouter_content(response, attempt)
+                elif call.streaming:
+                    response = clients.gemini_chat(call.system_prompt, current_prompt, stream=True)
+                    call.model_used = 'gemini-2.0-flash-exp'
+                    content = call.collect(clients.gemini_deltas(response))
+                    call.gemini_usage(response)
+                else:
+                    response = clients.gemini_chat(call.system_prompt, current_prompt)
+                    content = call.gemini_content(response)
             
-            # Make the actual API call
-            if use_openrouter:
-                # OpenRouter implementation
-                response = requests.post(
-                    'https://openrouter.ai/api/v1/chat/completions',
-                    headers=HEADERS,
-                    json={
-                        'model': 'deepseek/deepseek-chat',
-                        'messages': [
-                            {'role': 'system', 'content': system_prompt},
-                            {'role': 'user', 'content': current_prompt}
-                        ]
-                    }
-                )
-                
-                logger.debug("Status Code: %d", response.status_code)
-                logger.debug("Full Response:\n%s", response.text)
-                
-                if response.status_code != 200:
-                    error_msg = f"API returned status code {response.status_code}: {response.text}"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-                    
-                response_json = response.json()
-                content = response_json['choices'][0]['message']['content']
-                model_used = 'deepseek/deepseek-chat'
-            else:
-                # Gemini implementation
-                GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-                genai.configure(api_key=GOOGLE_API_KEY)
-                
-                model = genai.GenerativeModel('gemini-2.0-flash')
-                chat = model.start_chat(history=[
-                    {'role': 'user', 'parts': [system_prompt]},
-                    {'role': 'model', 'parts': ['Understood. I will follow the provided instructions.']}
-                ])
-                
-                response = chat.send_message(current_prompt)
-                content = response.text
-                model_used = 'gemini-2.0-flash-exp'
-                
-                logger.debug("Gemini Response:\n%s", content)
+                content = call.repaired(content)
+                if not call.accept(content, attempt):
+                    continue
             
-            # Validate response if expected tags were provided
-            if expected_tags:
-                is_valid, missing_tags = validate_xml_response(content, expected_tags, prompt_name)
-                if not is_valid:
-                    if attempt <= max_retries:
-                        logger.warning(f"Invalid response format, missing tags: {missing_tags}. Retrying...")
-                        time.sleep(1)  # Short delay before retry
-                        continue
-                    else:
-                        logger.error(f"Failed to get valid response after {max_retries+1} attempts")
+                return call.succeed(content)
             
-            # Save the interaction if debate_id is provided
-            if debate_id and prompt_name:
-                from ..models import LLMInteraction, Debate
-                debate = Debate.objects.get(id=debate_id)
-                LLMInteraction.objects.create(
-                    debate=debate,
-                    prompt_name=prompt_name,
-                    prompt_text=current_prompt,
-                    response=content,
-                    model_used=model_used
-                )
+            except Exception as e:
+                error = clients.as_provider_error(e, call.provider)
+                delay = call.retry_delay(error, attempt)
+                if delay is not None:
+                    time.sleep(delay)
+                    continue
             
-            # Success - send update and return content
-            if user_update_callback:
-                user_update_callback({
-                    'status': 'completed',
-                    'stage': prompt_name,
-                    'message': f"Completed {prompt_name} step"
-                })
-                
-            return content
+                call.fail(error)
+                if error is e:
+                    raise
+                raise error from e
+
+async def amake_llm_call(prompt, use_openrouter=False, role='system', debate_id=None, prompt_name=None,
+                         expected_tags=None, max_retries=2, user_update_callback=None, use_cache=True,
+                         stream_tags=None, recorder=None, retry_budget=None, cancellation=None):
+    """
+    Async counterpart of make_llm_call
+    
+    Provider requests go through the pooled httpx.AsyncClient / async Gemini
+    client and retry delays use asyncio.sleep, so waiting on the provider
+    never ties up a thread. Cache and database bookkeeping run via
+    sync_to_async. Takes the same arguments as make_llm_call.
+    
+    Returns:
+        str: The LLM response
+    """
+    call = LLMCall(prompt, use_openrouter, role, debate_id, prompt_name,
+                   expected_tags, max_retries, user_update_callback, use_cache, stream_tags, recorder,
+                   retry_budget, cancellation)
+    with call.track():
+        cached = await sync_to_async(call.start)()
+        if cached is not None:
+            return cached
+        
+        for attempt in call.attempts():
+            try:
+                current_prompt = call.prepare_attempt(attempt)
             
-        except Exception as e:
-            logger.error("Error making LLM call: %s", str(e))
+                if call.replay:
+                    content = await call.areplay_content(current_prompt)
+                elif call.use_openrouter and call.streaming:
+                    async with clients.aopenrouter_stream(call.system_prompt, current_prompt) as response:
+                        if response.status_code != 200:
+                            await response.aread()
+                        call.check_openrouter_status(response, attempt)
+                        content = await call.acollect(clients.aopenrouter_deltas(response.aiter_lines()))
+                elif call.use_openrouter:
+                    response = await clients.aopenrouter_chat(call.system_prompt, current_prompt)
+                    content = call.openrouter_content(response, attempt)
+                elif call.streaming:
+                    response = await clients.agemini_chat(call.system_prompt, current_prompt, stream=True)
+                    call.model_used = 'gemini-2.0-flash-exp'
+                    content = await call.acollect(clients.agemini_deltas(response))
+                    call.gemini_usage(response)
+                else:
+                    response = await clients.agemini_chat(call.system_prompt, current_prompt)
+                    content = call.gemini_content(response)
             
-            if attempt <= max_retries:
-                time.sleep(2)  # Delay before retry
-                continue
-                
-            # Log the failed attempt if we've exhausted retries
-            if debate_id and prompt_name:
-                from ..models import LLMInteraction, Debate
-                debate = Debate.objects.get(id=debate_id)
-                LLMInteraction.objects.create(
-                    debate=debate,
-                    prompt_name=prompt_name,
-                    prompt_text=current_prompt if 'current_prompt' in locals() else prompt,
-                    model_used=model_used if model_used else 'unknown',
-                    success=False,
-                    error_message=str(e)
-                )
+                content = call.repaired(content)
+                if not call.accept(content, attempt):
+                    continue
             
-            if user_update_callback:
-                user_update_callback({
-                    'status': 'error',
-                    'stage': prompt_name,
-                    'message': f"Error in {prompt_name} step: {str(e)}"
-                })
-                
-            raise 
\ No newline at end of file
+                return await sync_to_async(call.succeed)(content)
+            
+            except Exception as e:
+                error = clients.as_provider_error(e, call.provider)
+                delay = call.retry_delay(error, attempt)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+            
+                await sync_to_async(call.fail)(error)
+                if error is e:
+                    raise
+                raise error from e
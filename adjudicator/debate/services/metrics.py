@@ -0,0 +1,277 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('llm_calls')
+
+# Histogram buckets, in seconds for latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name: (type, help, buckets)
+METRICS = {
+    'adjudicator_pipeline_seconds': (
+        'histogram', 'Duration of whole analysis pipeline runs', LATENCY_BUCKETS),
+    'adjudicator_pipeline_in_flight': (
+        'gauge', 'Analysis pipelines currently running', None),
+    'adjudicator_stage_seconds': (
+        'histogram', 'Duration of pipeline stages', LATENCY_BUCKETS),
+    'adjudicator_stage_in_flight': (
+        'gauge', 'Pipeline stages currently running', None),
+    'adjudicator_llm_call_seconds': (
+        'histogram', 'Duration of LLM calls by prompt, including retries and cache hits', LATENCY_BUCKETS),
+    'adjudicator_llm_in_flight': (
+        'gauge', 'LLM calls currently waiting on a provider or retry', None),
+    'adjudicator_llm_retries_total': (
+        'counter', 'LLM call attempts repeated, by the reason for the retry', None),
+    'adjudicator_llm_validation_failures_total': (
+        'counter', 'LLM responses missing expected XML tags', None),
+    'adjudicator_llm_provider_errors_total': (
+        'counter', 'Errors raised while calling an LLM provider', None),
+    'adjudicator_llm_cache_requests_total': (
+        'counter', 'LLM response cache lookups, by result', None),
+    'adjudicator_llm_tokens_total': (
+        'counter', 'Tokens reported by LLM providers', None),
+    'adjudicator_http_request_seconds': (
+        'histogram', 'Time to produce a response (streamed bodies are not included)', LATENCY_BUCKETS),
+    'adjudicator_http_in_flight': (
+        'gauge', 'HTTP requests currently being handled', None),
+    'adjudicator_http_db_queries': (
+        'histogram', 'Database queries run per HTTP request', QUERY_BUCKETS),
+}
+
+
+class Tracker:
+    """Handle yielded by MetricsRegistry.track; set outcome to label the observation"""
+
+    def __init__(self):
+        self.outcome = 'ok'
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms of one process
+
+    Series are identified by metric name and a set of labels. When a
+    directory is given, the values are written there as metrics_<pid>.json
+    at most every flush_interval seconds after they change (and at exit),
+    so the /metrics view of any process can add up all of them.
+    """
+
+    def __init__(self, directory=None, flush_interval=10):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._values = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @staticmethod
+    def _series(name, labels):
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric: {name}")
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter or gauge"""
+        series = self._series(name, labels)
+        with self._lock:
+            self._values[series] = self._values.get(series, 0) + amount
+            self._schedule()
+
+    def observe(self, name, value, **labels):
+        """Add one observation to a histogram"""
+        series = self._series(name, labels)
+        buckets = METRICS[name][2]
+        with self._lock:
+            counts, total, count = self._values.get(series) or ([0] * len(buckets), 0.0, 0)
+            # A new list, since snapshots may still be reading the old one
+            counts = list(counts)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[series] = (counts, total + value, count + 1)
+            self._schedule()
+
+    @contextmanager
+    def track(self, name, gauge=None, **labels):
+        """
+        Time the enclosed block into histogram name, labelled with its outcome
+
+        While it runs, gauge (if given) is raised by one. The outcome is
+        'error' if the block raises, otherwise whatever it set on the
+        yielded Tracker ('ok' by default).
+        """
+        tracker = Tracker()
+        if gauge:
+            self.inc(gauge, **labels)
+        start = time.perf_counter()
+        try:
+            yield tracker
+        except BaseException:
+            tracker.outcome = 'error'
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, outcome=tracker.outcome, **labels)
+            if gauge:
+                self.inc(gauge, -1, **labels)
+
+    def snapshot(self):
+        """The current values in the form written to the snapshot files"""
+        with self._lock:
+            values = list(self._values.items())
+        return {
+            'pid': self.pid,
+            'series': [
+                [name, [list(label) for label in labels], list(value) if isinstance(value, tuple) else value]
+                for (name, labels), value in values
+            ]
+        }
+
+    def _schedule(self):
+        if self.directory and self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._run_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Writing the metrics snapshot failed")
+
+    def path(self):
+        return os.path.join(self.directory, f'metrics_{self.pid}.json')
+
+    def flush(self):
+        """Write this process's snapshot file"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect(registry):
+    """
+    Add up the live values of registry and the snapshots of all other processes
+
+    Counters and histograms of exited processes are kept, so totals never go
+    backwards; their gauges are dropped.
+
+    Returns:
+        dict: {(name, labels): value}
+    """
+    snapshots = [registry.snapshot()]
+    if registry.directory:
+        for path in glob.glob(os.path.join(registry.directory, 'metrics_*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get('pid') != registry.pid:
+                snapshots.append(snapshot)
+
+    totals = {}
+    for snapshot in snapshots:
+        alive = snapshot['pid'] == registry.pid or process_alive(snapshot['pid'])
+        for name, labels, value in snapshot['series']:
+            if name not in METRICS:
+                continue
+            kind = METRICS[name][0]
+            if kind == 'gauge' and not alive:
+                continue
+            series = (name, tuple(tuple(label) for label in labels))
+            if kind == 'histogram':
+                counts, total, count = value
+                if series in totals:
+                    old_counts, old_total, old_count = totals[series]
+                    if len(old_counts) != len(counts):
+                        continue
+                    counts = [a + b for a, b in zip(old_counts, counts)]
+                    total, count = total + old_total, count + old_count
+                totals[series] = (counts, total, count)
+            else:
+                totals[series] = totals.get(series, 0) + value
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def render(totals):
+    """Format collected values in the Prometheus text exposition format"""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (series_name, labels), value in totals.items() if series_name == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", float(bound))])} {bucket_count}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {float(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def build_metrics(config):
+    """Build a MetricsRegistry from a METRICS settings dict"""
+    registry = MetricsRegistry(config.get('DIR') or None, config.get('FLUSH_INTERVAL', 10))
+    if registry.directory:
+        atexit.register(registry.flush)
+    return registry
+
+
+def get_metrics():
+    """
+    Return this process's MetricsRegistry, configured by settings.METRICS
+
+    A process forked after the registry was built (e.g. a Celery prefork
+    child) gets a fresh one, so its counts are not mixed with the parent's.
+    """
+    global _registry
+    if _registry is None or _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                from django.conf import settings
+                _registry = build_metrics(getattr(settings, 'METRICS', {}))
+    return _registry
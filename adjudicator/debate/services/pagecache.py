@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+# Fragment names used by the {% cache %} blocks in debate/result.html
+VOTE_FIELDS = ('judgment', 'evaluation')
+
+HALL_OF_FAME_KEY = 'page:hall-of-fame'
+
+
+def result_ttl():
+    return settings.PAGE_CACHE_TTL
+
+
+def original_text(debate_id, fetch):
+    """
+    Return a debate's original text from the cache, calling fetch() on a miss
+
+    fetch() should raise Debate.DoesNotExist for unknown ids, so this doubles
+    as the existence check for the otherwise cached result page.
+    """
+    key = f'page:original-text:{debate_id}'
+    text = cache.get(key)
+    if text is None:
+        text = fetch()
+        cache.set(key, text, result_ttl())
+    return text
+
+
+def vote_fragment_keys(debate_id):
+    return [make_template_fragment_key('result_votes', [debate_id, field]) for field in VOTE_FIELDS]
+
+
+def invalidate_votes(debate_id):
+    """Drop the cached approval buttons of a debate after a vote"""
+    cache.delete_many(vote_fragment_keys(debate_id))
+
+
+def hall_of_fame(fetch):
+    """
+    Return the hall of fame debates, cached for HALL_OF_FAME_CACHE_TTL seconds
+
+    The list is allowed to lag behind votes by up to the TTL.
+    """
+    debates = cache.get(HALL_OF_FAME_KEY)
+    if debates is None:
+        debates = list(fetch())
+        cache.set(HALL_OF_FAME_KEY, debates, settings.HALL_OF_FAME_CACHE_TTL)
+    return debates
@@ -1,45 +1,420 @@
-import re
 import time
+import asyncio
 import logging
-from .llm import make_llm_call, load_prompt
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.db import connections
+from .llm import make_llm_call, amake_llm_call, load_prompt
+from .metrics import get_metrics
+from .xmltags import parse_tags
 
 logger = logging.getLogger('llm_calls')
 
+def run_in_worker(fn, *args, **kwargs):
+    """Run fn in a worker thread, releasing that thread's DB connections afterwards"""
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+class StageTimeoutError(TimeoutError):
+    """Raised when a pipeline stage runs past its timeout"""
+
+class PipelineCancelled(Exception):
+    """Raised in a stage that is still running after its pipeline gave up"""
+
+class Cancellation:
+    """
+    Tells the stages of a pipeline that gave up to stop
+    
+    A stage that is already running cannot be interrupted, so after a
+    timeout or another stage's failure it carries on in its worker. It
+    checks this before every LLM attempt, and its progress callback is
+    dropped once the pipeline is cancelled, so it neither makes further
+    paid calls nor publishes progress after the job's terminal event.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled = False
+    
+    def cancel(self):
+        # Waits for a progress update in flight, so none is published once this returns
+        with self._lock:
+            self.cancelled = True
+    
+    def check(self):
+        """Raise PipelineCancelled if the pipeline was cancelled"""
+        if self.cancelled:
+            raise PipelineCancelled("The pipeline was stopped")
+    
+    def guard(self, callback):
+        """Wrap a progress callback so it does nothing once the pipeline is cancelled"""
+        if callback is None:
+            return None
+        def guarded(data):
+            with self._lock:
+                if not self.cancelled:
+                    callback(data)
+        return guarded
+
 class AnalysisPipeline:
-    def __init__(self, stages=None):
+    """
+    Runs pipeline stages as a dependency graph
+    
+    Each stage declares the context keys it `requires` and `provides`. A stage
+    is started on a bounded thread pool as soon as every stage producing one
+    of its required keys has finished, so independent stages overlap. Each
+    stage works on a copy of the context and only its declared outputs are
+    merged back.
+    
+    Stages whose outputs are all present in the initial context are treated
+    as already done, which lets an interrupted analysis resume from its saved
+    stage outputs. If the context has a 'stage_callback', it is called with
+    (stage, outputs) as each stage finishes.
+    
+    When a stage times out or fails, the stages still running are cancelled
+    (see Cancellation) rather than waited for.
+    """
+    
+    def __init__(self, stages=None, max_workers=4):
         self.stages = stages or []
+        self.max_workers = max_workers
+    
+    def build_graph(self, available_keys=()):
+        """
+        Work out which stages each stage has to wait for
+        
+        Args:
+            available_keys (iterable): Context keys present before any stage runs
+            
+        Returns:
+            dict: Mapping of stage to the set of stages it depends on
+            
+        Raises:
+            ValueError: If a key has two producers, a required key has no
+                producer, or the dependencies contain a cycle
+        """
+        available_keys = set(available_keys)
+        producers = {}
+        for stage in self.stages:
+            for key in stage.provides:
+                if key in producers:
+                    raise ValueError(f"Context key '{key}' is provided by both {producers[key].name} and {stage.name}")
+                producers[key] = stage
+        
+        dependencies = {}
+        for stage in self.stages:
+            dependencies[stage] = set()
+            for key in stage.requires:
+                if key in producers:
+                    dependencies[stage].add(producers[key])
+                elif key not in available_keys:
+                    raise ValueError(f"{stage.name} requires '{key}' but no stage provides it")
+        
+        # Kahn's algorithm: anything left unsorted sits on a cycle
+        remaining = {stage: set(deps) for stage, deps in dependencies.items()}
+        while True:
+            ready = [stage for stage, deps in remaining.items() if not deps]
+            if not ready:
+                break
+            for stage in ready:
+                del remaining[stage]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        if remaining:
+            names = ', '.join(stage.name for stage in remaining)
+            raise ValueError(f"Pipeline stages form a dependency cycle: {names}")
+        
+        return dependencies
+    
+    @staticmethod
+    def _take_ready(pending, finished):
+        """Remove and return the pending stages whose dependencies have all finished"""
+        ready = [stage for stage, deps in pending.items() if deps <= finished]
+        for stage in ready:
+            del pending[stage]
+        return ready
+    
+    def _completed_stages(self, context):
+        """Stages whose outputs were supplied up front, e.g. when resuming"""
+        return {
+            stage for stage in self.stages
+            if stage.provides and all(key in context for key in stage.provides)
+        }
+    
+    @staticmethod
+    def _stage_context(context, cancellation):
+        """The copy of the context a stage works on, reporting progress until the pipeline is cancelled"""
+        return {
+            **context,
+            'cancellation': cancellation,
+            'progress_callback': cancellation.guard(context.get('progress_callback'))
+        }
+    
+    @staticmethod
+    def _run_stage(stage, context):
+        with get_metrics().track('adjudicator_stage_seconds', 'adjudicator_stage_in_flight', stage=stage.name):
+            return stage.process(context)
+    
+    @staticmethod
+    async def _arun_stage(stage, context):
+        with get_metrics().track('adjudicator_stage_seconds', 'adjudicator_stage_in_flight', stage=stage.name):
+            return await stage.aprocess(context)
+    
+    def _merge(self, context, stage, result):
+        outputs = {key: result[key] for key in stage.provides}
+        context.update(outputs)
+        if context.get('stage_callback'):
+            context['stage_callback'](stage, outputs)
+    
+    @staticmethod
+    def _expired_stage(running, deadlines):
+        now = time.monotonic()
+        for handle, deadline in deadlines.items():
+            if deadline <= now:
+                return running[handle]
+        return None
+    
+    def _report_error(self, context, stage, error):
+        name = stage.name if stage else 'pipeline'
+        logger.error(f"Error in pipeline stage {name}: {str(error)}")
+        if context.get('progress_callback'):
+            context['progress_callback']({
+                'stage': 'error',
+                'message': f"Error in {name}: {str(error)}",
+                'percent': 0
+            })
+    
+    def _complete(self, context, dependencies, trace):
+        context['timings'] = self.timing_trace(dependencies, trace)
+        logger.info("Pipeline finished", extra={'timings': context['timings']})
         
+        if context.get('progress_callback'):
+            context['progress_callback']({
+                'stage': 'processing_complete',
+                'percent': 100,
+                'message': 'Analysis complete!'
+            })
+        
+        return context
+    
     def process(self, context):
         """
         Process the input through all pipeline stages
         
+        Args:
+            context (dict): The initial context containing at minimum 'text'
+            
+        Returns:
+            dict: The final result after all processing stages, with a
+                'timings' trace of every stage and the critical path
+        """
+        with get_metrics().track('adjudicator_pipeline_seconds', 'adjudicator_pipeline_in_flight', mode='sync'):
+            return self._process(context)
+    
+    def _process(self, context):
+        dependencies = self.build_graph(context.keys())
+        finished = self._completed_stages(context)
+        pending = {s: deps for s, deps in dependencies.items() if s not in finished}
+        running = {}
+        deadlines = {}
+        trace = {}
+        started_at = time.monotonic()
+        cancellation = Cancellation()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        
+        def submit_ready():
+            for stage in self._take_ready(pending, finished):
+                future = executor.submit(run_in_worker, self._run_stage, stage,
+                                         self._stage_context(context, cancellation))
+                running[future] = stage
+                now = time.monotonic()
+                trace[stage] = {'start': now - started_at}
+                if stage.timeout:
+                    deadlines[future] = now + stage.timeout
+        
+        stage = None
+        try:
+            submit_ready()
+            while running:
+                timeout = None
+                if deadlines:
+                    timeout = max(min(deadlines.values()) - time.monotonic(), 0)
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                
+                if not done:
+                    stage = self._expired_stage(running, deadlines)
+                    if stage:
+                        raise StageTimeoutError(f"{stage.name} did not finish within {stage.timeout}s")
+                    continue
+                
+                for future in done:
+                    stage = running.pop(future)
+                    deadlines.pop(future, None)
+                    result = future.result()
+                    self._merge(context, stage, result)
+                    trace[stage]['end'] = time.monotonic() - started_at
+                    finished.add(stage)
+                stage = None
+                submit_ready()
+        except Exception as e:
+            cancellation.cancel()
+            self._report_error(context, stage, e)
+            raise
+        finally:
+            cancellation.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        return self._complete(context, dependencies, trace)
+    
+    async def aprocess(self, context):
+        """
+        Async counterpart of process
+        
+        Ready stages run as asyncio tasks via PipelineStage.aprocess, so a
+        whole analysis waits on its LLM calls without holding any thread.
+        
         Args:
             context (dict): The initial context containing at minimum 'text'
             
         Returns:
             dict: The final result after all processing stages
         """
-        for stage in self.stages:
-            try:
-                context = stage.process(context)
-            except Exception as e:
-                logger.error(f"Error in pipeline stage {stage.__class__.__name__}: {str(e)}")
-                if context.get('progress_callback'):
-                    context['progress_callback']({
-                        'stage': 'error',
-                        'message': f"Error in {stage.__class__.__name__}: {str(e)}",
-                        'percent': 0
-                    })
-                raise
+        with get_metrics().track('adjudicator_pipeline_seconds', 'adjudicator_pipeline_in_flight', mode='async'):
+            return await self._aprocess(context)
+    
+    async def _aprocess(self, context):
+        dependencies = self.build_graph(context.keys())
+        finished = self._completed_stages(context)
+        pending = {s: deps for s, deps in dependencies.items() if s not in finished}
+        running = {}
+        deadlines = {}
+        trace = {}
+        started_at = time.monotonic()
+        cancellation = Cancellation()
+        
+        def submit_ready():
+            for stage in self._take_ready(pending, finished):
+                task = asyncio.ensure_future(self._arun_stage(stage, self._stage_context(context, cancellation)))
+                running[task] = stage
+                now = time.monotonic()
+                trace[stage] = {'start': now - started_at}
+                if stage.timeout:
+                    deadlines[task] = now + stage.timeout
+        
+        stage = None
+        try:
+            submit_ready()
+            while running:
+                timeout = None
+                if deadlines:
+                    timeout = max(min(deadlines.values()) - time.monotonic(), 0)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
                 
-        return context
+                if not done:
+                    stage = self._expired_stage(running, deadlines)
+                    if stage:
+                        raise StageTimeoutError(f"{stage.name} did not finish within {stage.timeout}s")
+                    continue
+                
+                for task in done:
+                    stage = running.pop(task)
+                    deadlines.pop(task, None)
+                    result = task.result()
+                    self._merge(context, stage, result)
+                    trace[stage]['end'] = time.monotonic() - started_at
+                    finished.add(stage)
+                stage = None
+                submit_ready()
+        except Exception as e:
+            cancellation.cancel()
+            self._report_error(context, stage, e)
+            raise
+        finally:
+            cancellation.cancel()
+            for task in running:
+                task.cancel()
+        
+        return self._complete(context, dependencies, trace)
+    
+    @staticmethod
+    def timing_trace(dependencies, trace):
+        """
+        Summarise stage timings and walk back the critical path
+        
+        The critical path starts at the stage that finished last and repeatedly
+        steps to whichever of the current stage's dependencies finished last.
+        """
+        stages = [
+            {
+                'stage': stage.name,
+                'start': round(times['start'], 4),
+                'end': round(times['end'], 4),
+                'duration': round(times['end'] - times['start'], 4),
+                'depends_on': sorted(dep.name for dep in dependencies[stage])
+            }
+            for stage, times in sorted(trace.items(), key=lambda item: item[1]['start'])
+        ]
+        
+        critical_path = []
+        current = max(trace, key=lambda s: trace[s]['end']) if trace else None
+        while current is not None:
+            critical_path.append(current.name)
+            deps = dependencies[current]
+            # Stages restored from saved outputs have no timings
+            deps = [dep for dep in deps if dep in trace]
+            current = max(deps, key=lambda s: trace[s]['end']) if deps else None
+        critical_path.reverse()
+        
+        return {
+            'stages': stages,
+            'critical_path': critical_path,
+            'total': round(max((t['end'] for t in trace.values()), default=0), 4)
+        }
 
 class PipelineStage:
     """Base class for all pipeline stages"""
     
+    # Context keys read and written by the stage, used to schedule it
+    requires = ()
+    provides = ()
+    # Seconds the stage may run before the pipeline gives up on it
+    timeout = None
+    
     def __init__(self, debate_id=None):
         self.debate_id = debate_id
     
+    @property
+    def name(self):
+        return self.__class__.__name__
+    
+    def begin(self, context):
+        """Report that the stage has started"""
+    
+    def llm_request(self, context):
+        """
+        Describe the LLM call this stage needs
+        
+        Returns:
+            dict: Keyword arguments for make_llm_call / amake_llm_call, or
+                None if the stage makes no call
+        """
+        return None
+    
+    def finish(self, context, response):
+        """
+        Fold the LLM response into the context
+        
+        Args:
+            context (dict): The input context
+            response (str): The LLM response, or None if no call was made
+            
+        Returns:
+            dict: The updated context
+        """
+        return context
+    
     def process(self, context):
         """
         Process the input context and return updated context
@@ -50,8 +425,23 @@ class PipelineStage:
         Returns:
             dict: The updated context
         """
-        # Base implementation does nothing
-        return context
+        self.begin(context)
+        request = self.llm_request(context)
+        response = make_llm_call(**request, cancellation=context.get('cancellation')) if request else None
+        return self.finish(context, response)
+    
+    async def aprocess(self, context):
+        """
+        Async counterpart of process, awaiting the LLM call instead of blocking
+        
+        Stages that override process() directly are run in a worker thread.
+        """
+        if type(self).process is not PipelineStage.process:
+            return await asyncio.to_thread(run_in_worker, self.process, context)
+        self.begin(context)
+        request = self.llm_request(context)
+        response = await amake_llm_call(**request, cancellation=context.get('cancellation')) if request else None
+        return self.finish(context, response)
     
     def update_progress(self, context, status):
         """Helper method to update progress if callback exists"""
@@ -60,44 +450,49 @@ class PipelineStage:
 
 class InitialAnalysisStage(PipelineStage):
     """Stage for initial analysis of the debate text"""
+    requires = ('text',)
+    provides = ('analysis', 'anonymized_analysis', 'belligerent_1', 'belligerent_2',
+                'summary_1', 'summary_2', 'title')
+    timeout = 180
     
-    def process(self, context):
-        # Extract required data from context
-        text = context['text']
-        debate_id = context.get('debate_id')
-        
+    def begin(self, context):
         # Update progress
         self.update_progress(context, {
             'stage': 'analysis', 
             'percent': 10, 
             'message': 'Identifying participants and arguments...'
         })
-        
+    
+    def llm_request(self, context):
         # Expected tags for validation
         analysis_expected_tags = ['debate_title', 'p1', 'p2', 's1', 's2', 'complexity']
         
-        # Make LLM call for initial analysis
+        # LLM call for initial analysis
         analysis_prompt = load_prompt('analyze.txt')
-        analysis = make_llm_call(
-            analysis_prompt.format(
-                text=text,
+        return dict(
+            prompt=analysis_prompt.format(
+                text=context['text'],
                 text_party_1="{first party name}",
                 text_party_2="{second party name}"
             ),
             role='summarizer',
-            debate_id=debate_id,
+            debate_id=context.get('debate_id'),
+            recorder=context.get('recorder'),
+            retry_budget=context.get('retry_budget'),
             prompt_name='analyze',
             expected_tags=analysis_expected_tags,
             user_update_callback=lambda data: self.update_progress(context, data)
         )
-        
+    
+    def finish(self, context, analysis):
         # Extract key information
         from .analysis import extract_tag
-        belligerent_1 = extract_tag('p1', analysis)
-        belligerent_2 = extract_tag('p2', analysis)
-        summary_1 = extract_tag('s1', analysis)
-        summary_2 = extract_tag('s2', analysis)
-        debate_title = extract_tag('debate_title', analysis)
+        tree = parse_tags(analysis)
+        belligerent_1 = extract_tag('p1', tree)
+        belligerent_2 = extract_tag('p2', tree)
+        summary_1 = extract_tag('s1', tree)
+        summary_2 = extract_tag('s2', tree)
+        debate_title = extract_tag('debate_title', tree)
         
         # Update progress with extracted information
         self.update_progress(context, {
@@ -121,8 +516,7 @@ class InitialAnalysisStage(PipelineStage):
         })
         
         # Anonymize the analysis for next stages
-        anonymized_analysis = re.sub(r'<p1>.*?</p1>', 'P1', analysis)
-        anonymized_analysis = re.sub(r'<p2>.*?</p2>', 'P2', anonymized_analysis)
+        anonymized_analysis = tree.replace({'p1': 'P1', 'p2': 'P2'})
         
         # Update context with results
         context.update({
@@ -139,31 +533,36 @@ class InitialAnalysisStage(PipelineStage):
 
 class EvaluationStage(PipelineStage):
     """Stage for evaluating the debate arguments"""
+    requires = ('anonymized_analysis',)
+    provides = ('evaluation',)
+    timeout = 180
     
-    def process(self, context):
-        # Extract required data from context
-        anonymized_analysis = context['anonymized_analysis']
-        debate_id = context.get('debate_id')
-        
+    def begin(self, context):
         # Update progress
         self.update_progress(context, {
             'stage': 'evaluation', 
             'percent': 40, 
             'message': 'Evaluating arguments...'
         })
-        
+    
+    def llm_request(self, context):
         # Expected tags for validation
         evaluation_expected_tags = ['argument_map', 'direct_interactions', 'decisive_factors', 'uncertainties']
         
-        # Make LLM call for evaluation
-        evaluation = make_llm_call(
-            load_prompt('evaluate.txt').format(structured_arguments=anonymized_analysis),
-            debate_id=debate_id,
+        # LLM call for evaluation
+        return dict(
+            prompt=load_prompt('evaluate.txt').format(structured_arguments=context['anonymized_analysis']),
+            debate_id=context.get('debate_id'),
+            recorder=context.get('recorder'),
+            retry_budget=context.get('retry_budget'),
             prompt_name='evaluate',
             expected_tags=evaluation_expected_tags,
-            user_update_callback=lambda data: self.update_progress(context, data)
+            user_update_callback=lambda data: self.update_progress(context, data),
+            # Show the argument map while it is being written
+            stream_tags={'argument_map': 'evaluation'}
         )
-        
+    
+    def finish(self, context, evaluation):
         # Extract a snippet of the evaluation and send it
         try:
             from .analysis import extract_tag, parse_evaluation_table
@@ -217,31 +616,35 @@ class EvaluationStage(PipelineStage):
 
 class JudgmentStage(PipelineStage):
     """Stage for determining the final judgment"""
+    requires = ('evaluation',)
+    provides = ('judgment', 'winner')
+    timeout = 180
     
-    def process(self, context):
-        # Extract required data from context
-        evaluation = context['evaluation']
-        debate_id = context.get('debate_id')
-        
+    def begin(self, context):
         # Update progress
         self.update_progress(context, {
             'stage': 'judgment', 
             'percent': 70, 
             'message': 'Determining final judgment...'
         })
-        
+    
+    def llm_request(self, context):
         # Expected tags for validation
         judgment_expected_tags = ['winner', 'reasoning', 'strength', 'strengthening_advice']
         
-        # Make LLM call for judgment
-        judgment = make_llm_call(
-            load_prompt('judge.txt').format(evaluations=evaluation),
-            debate_id=debate_id,
+        # LLM call for judgment
+        return dict(
+            prompt=load_prompt('judge.txt').format(evaluations=context['evaluation']),
+            debate_id=context.get('debate_id'),
+            recorder=context.get('recorder'),
+            retry_budget=context.get('retry_budget'),
             prompt_name='judge',
             expected_tags=judgment_expected_tags,
-            user_update_callback=lambda data: self.update_progress(context, data)
+            user_update_callback=lambda data: self.update_progress(context, data),
+            stream_tags={'reasoning': 'judgment'}
         )
-        
+    
+    def finish(self, context, judgment):
         # Extract winner but don't send it as a snippet
         try:
             from .analysis import extract_tag
@@ -266,49 +669,58 @@ class JudgmentStage(PipelineStage):
         
         return context
 
-class FormattingStage(PipelineStage):
-    """Stage for formatting the results for better readability"""
+class FormatEvaluationStage(PipelineStage):
+    """Stage for rewriting the evaluation for readability"""
+    requires = ('evaluation',)
+    provides = ('evaluation_formatted',)
+    timeout = 180
     
-    def process(self, context):
-        # Extract required data from context
-        evaluation = context['evaluation']
-        judgment = context['judgment']
-        debate_id = context.get('debate_id')
-        
-        # Update progress
+    def begin(self, context):
         self.update_progress(context, {
             'stage': 'formatting', 
-            'percent': 85, 
-            'message': 'Formatting results...'
+            'percent': 65, 
+            'message': 'Formatting argument analysis...'
         })
-        
-        # Format the evaluation for better readability
-        evaluation_formatted = make_llm_call(
-            load_prompt('format_evaluation.txt').format(text=evaluation),
+    
+    def llm_request(self, context):
+        return dict(
+            prompt=load_prompt('format_evaluation.txt').format(text=context['evaluation']),
             role='copywriter',
-            debate_id=debate_id,
+            debate_id=context.get('debate_id'),
+            recorder=context.get('recorder'),
+            retry_budget=context.get('retry_budget'),
             prompt_name='format_evaluation',
             user_update_callback=lambda data: self.update_progress(context, data)
         )
-        
-        # Format the judgment for better readability
-        judgment_formatted = make_llm_call(
-            load_prompt('format_judgment.txt').format(text=judgment),
+    
+    def finish(self, context, evaluation_formatted):
+        context['evaluation_formatted'] = evaluation_formatted
+        return context
+
+class FormatJudgmentStage(PipelineStage):
+    """Stage for rewriting the judgment for readability"""
+    requires = ('judgment',)
+    provides = ('judgment_formatted',)
+    timeout = 180
+    
+    def begin(self, context):
+        self.update_progress(context, {
+            'stage': 'formatting', 
+            'percent': 85, 
+            'message': 'Formatting judgment...'
+        })
+    
+    def llm_request(self, context):
+        return dict(
+            prompt=load_prompt('format_judgment.txt').format(text=context['judgment']),
             role='copywriter',
-            debate_id=debate_id,
+            debate_id=context.get('debate_id'),
+            recorder=context.get('recorder'),
+            retry_budget=context.get('retry_budget'),
             prompt_name='format_judgment',
             user_update_callback=lambda data: self.update_progress(context, data)
         )
-        
-        # Update context with formatted results
-        context['evaluation_formatted'] = evaluation_formatted
+    
+    def finish(self, context, judgment_formatted):
         context['judgment_formatted'] = judgment_formatted
-        
-        # Final progress update
-        self.update_progress(context, {
-            'stage': 'processing_complete', 
-            'percent': 100, 
-            'message': 'Analysis complete!'
-        })
-        
-        return context 
\ No newline at end of file
+        return context
@@ -0,0 +1,131 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+logger = logging.getLogger('llm_calls')
+
+PROMPTS_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'prompts'))
+
+# System prompt template used for each LLM role
+ROLE_TEMPLATES = {
+    'summarizer': 'summarizer.txt',
+    'system': 'system.txt',
+    'copywriter': 'system_copywriter.txt',
+}
+
+# Minimum seconds between mtime checks when hot reloading
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class PromptTemplate(NamedTuple):
+    name: str
+    text: str
+    hash: str
+    mtime: float
+
+
+class SystemPrompt(NamedTuple):
+    role: str
+    text: str
+    hash: str
+
+
+def content_hash(text):
+    """Short, stable identifier for a piece of prompt text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+class PromptRegistry:
+    """
+    Loads every template in the prompts directory once and hands out
+    pre-rendered system prompts per role.
+
+    With hot_reload enabled the file mtimes are re-checked (at most once per
+    RELOAD_CHECK_INTERVAL) and the registry reloads when any template changes.
+    """
+
+    def __init__(self, directory=PROMPTS_DIR, hot_reload=False):
+        self.directory = directory
+        self.hot_reload = hot_reload
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._templates = MappingProxyType({})
+        self._system_prompts = MappingProxyType({})
+        self.load()
+
+    def _scan_mtimes(self):
+        return {
+            entry.name: entry.stat().st_mtime
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith('.txt')
+        }
+
+    def load(self):
+        """(Re)read all templates from disk and re-render the system prompts"""
+        templates = {}
+        for name, mtime in self._scan_mtimes().items():
+            with open(os.path.join(self.directory, name)) as f:
+                text = f.read().strip()
+            templates[name] = PromptTemplate(name, text, content_hash(text), mtime)
+
+        system_prompts = {}
+        for role, name in ROLE_TEMPLATES.items():
+            text = templates[name].text
+            if role == 'system':
+                text = text.format(principles=templates['principles.txt'].text)
+            system_prompts[role] = SystemPrompt(role, text, content_hash(text))
+
+        with self._lock:
+            self._templates = MappingProxyType(templates)
+            self._system_prompts = MappingProxyType(system_prompts)
+            self._last_check = time.monotonic()
+        logger.info("Loaded %d prompt templates from %s", len(templates), self.directory)
+
+    def _maybe_reload(self):
+        if not self.hot_reload or time.monotonic() - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        current = {name: t.mtime for name, t in self._templates.items()}
+        if self._scan_mtimes() != current:
+            self.load()
+        else:
+            self._last_check = time.monotonic()
+
+    def get(self, name):
+        """Return the PromptTemplate for a file name such as 'judge.txt'"""
+        self._maybe_reload()
+        return self._templates[name]
+
+    def text(self, name):
+        return self.get(name).text
+
+    def template_hash(self, name):
+        return self.get(name).hash
+
+    def system_prompt(self, role):
+        """Return the pre-rendered SystemPrompt for a role, defaulting to 'system'"""
+        self._maybe_reload()
+        return self._system_prompts.get(role, self._system_prompts['system'])
+
+    @property
+    def templates(self):
+        self._maybe_reload()
+        return self._templates
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide PromptRegistry, hot reloading when DEBUG is on"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from django.conf import settings
+                _registry = PromptRegistry(hot_reload=settings.DEBUG)
+    return _registry
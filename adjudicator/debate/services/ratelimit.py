@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('llm_calls')
+
+KEY_PREFIX = 'ratelimit'
+
+# Atomically refill and take from a bucket stored as a hash {tokens, ts}
+# (a negative cost puts tokens back).
+# Returns {allowed, seconds until enough tokens} (the wait as a string, since
+# Lua numbers are truncated to integers on the way out).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class MemoryBucketStore:
+    """
+    Token buckets in process memory
+
+    At most max_keys buckets are kept; the least recently used is dropped
+    first, which only ever makes a client's bucket full again.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, cost=1):
+        """
+        Take cost tokens from the bucket at key if it has them (a negative
+        cost puts tokens back, up to capacity)
+
+        Returns:
+            tuple: (allowed, seconds until the bucket would have had enough)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                allowed, wait = True, 0.0
+                tokens = min(capacity, tokens - cost)
+            else:
+                allowed, wait = False, (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+
+class RedisBucketStore:
+    """Token buckets in Redis, shared by all workers; each take is one script call"""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, capacity, cost=1):
+        allowed, wait = self.script(keys=[f'{KEY_PREFIX}:{key}'], args=[rate, capacity, cost])
+        return bool(allowed), float(wait)
+
+
+class RateLimiter:
+    """
+    Named token-bucket limits over a bucket store
+
+    Each limit is a dict with RATE (tokens per second) and BURST (bucket
+    size); a missing limit or a RATE of 0 means unlimited.
+    """
+
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+
+    def take(self, name, key=None, cost=1):
+        """
+        Take from the bucket of limit name (per key, if given)
+
+        Returns:
+            float: 0 if allowed, otherwise the seconds to wait before retrying
+        """
+        limit = self.limits.get(name) or {}
+        rate = limit.get('RATE')
+        if not rate:
+            return 0.0
+        bucket = f'{name}:{key}' if key is not None else name
+        allowed, wait = self.store.take(bucket, rate, limit.get('BURST', 1), cost)
+        return 0.0 if allowed else max(wait, 0.001)
+
+    def refund(self, name, key=None, cost=1):
+        """Put back tokens taken from the bucket of limit name"""
+        self.take(name, key, -cost)
+
+    def check_analysis(self, ip_address):
+        """
+        Admit an analysis request from ip_address against the per-IP and global limits
+
+        Returns:
+            float: 0 if admitted, otherwise the seconds the client should wait
+        """
+        wait = self.take('ANALYSIS_PER_IP', ip_address)
+        if wait:
+            return wait
+        wait = self.take('ANALYSIS_GLOBAL')
+        if wait:
+            # The request is not admitted, so it must not count against the client
+            self.refund('ANALYSIS_PER_IP', ip_address)
+        return wait
+
+    def throttle(self, provider):
+        """Block until an outbound call to provider fits within its quota"""
+        waited = 0.0
+        while wait := self.take(f'PROVIDER:{provider}'):
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            logger.info("Throttled provider call", extra={'provider': provider, 'waited': round(waited, 3)})
+
+    async def athrottle(self, provider):
+        """Async variant of throttle; the store is used from a worker thread, as Redis calls block"""
+        waited = 0.0
+        while wait := await asyncio.to_thread(self.take, f'PROVIDER:{provider}'):
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited:
+            logger.info("Throttled provider call", extra={'provider': provider, 'waited': round(waited, 3)})
+
+
+def build_rate_limiter(config):
+    """Build a RateLimiter from a RATE_LIMIT settings dict"""
+    backend_name = config.get('BACKEND', 'memory')
+    if backend_name == 'memory':
+        store = MemoryBucketStore()
+    elif backend_name == 'redis':
+        store = RedisBucketStore(config['LOCATION'])
+    else:
+        raise ValueError(f"Unknown rate limit backend: {backend_name}")
+    limits = {
+        'ANALYSIS_PER_IP': config.get('ANALYSIS_PER_IP'),
+        'ANALYSIS_GLOBAL': config.get('ANALYSIS_GLOBAL'),
+    }
+    for provider, limit in config.get('PROVIDERS', {}).items():
+        limits[f'PROVIDER:{provider}'] = limit
+    return RateLimiter(store, limits)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide RateLimiter configured by settings.RATE_LIMIT"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                from django.conf import settings
+                _limiter = build_rate_limiter(getattr(settings, 'RATE_LIMIT', {}))
+    return _limiter
+
+
+def reset_rate_limiter():
+    """Drop the process-wide limiter, e.g. after changing settings in tests"""
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger('llm_calls')
+
+INTERACTION_PATTERNS = (
+    'llm_interactions_*.json', 'llm_interactions_*.json.gz', 'llm_interactions_*.jsonl', 'llm_interactions_*.jsonl.gz'
+)
+
+# Where each stage's response is kept on an exported debate. The formatted
+# outputs are not exported, so the raw text stands in for them, as when
+# seeding benchmark databases.
+DEBATE_RESPONSE_FIELDS = {
+    'analyze': ('analysis',),
+    'evaluate': ('evaluation',),
+    'judge': ('judgment',),
+    'format_evaluation': ('evaluation_formatted', 'evaluation'),
+    'format_judgment': ('judgment_formatted', 'judgment'),
+}
+
+
+class ReplayMiss(LookupError):
+    """No recorded response matches a prompt"""
+
+
+def replay_key(prompt_name, prompt):
+    """
+    Key a recorded response by prompt name and prompt text
+
+    The reminder prepended on retries is ignored, so a retried call replays
+    the same response as the first attempt.
+    """
+    from .llm import LLMCall
+    reminder = f"{LLMCall.RETRY_REMINDER}\n\n"
+    if prompt.startswith(reminder):
+        prompt = prompt[len(reminder):]
+    return prompt_name, hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def interaction_responses(records):
+    """Yield (prompt_name, prompt, response) from exported LLM interactions"""
+    for record in records:
+        if record.get('success', True) and record.get('prompt_name') and record.get('response'):
+            yield record['prompt_name'], record['prompt_text'], record['response']
+
+
+def upgrade_analysis(record):
+    """
+    Bring a recorded analysis up to the current analyze prompt's output
+
+    Debates exported before titles were introduced have no <debate_title>;
+    one is made from the participants, as seed_debates does.
+    """
+    from .xmltags import parse_tags
+    analysis = record.get('analysis')
+    if not analysis or parse_tags(analysis).find('debate_title') is not None:
+        return analysis
+    title = record.get('title') or f"{record['belligerent_1']} vs {record['belligerent_2']}"
+    return f"<debate_title>{title}</debate_title>\n\n{analysis}"
+
+
+def debate_responses(record):
+    """
+    Work out the (prompt_name, prompt, response) calls behind an exported debate
+
+    Debates do not keep their prompts, so the debate is walked through the
+    analysis pipeline's stages: every stage builds its prompt from the
+    context so far and folds the recorded response back in, exactly as a
+    live run would.
+
+    Returns:
+        list: The calls, or None if a response is missing or lacks tags the
+            stage now expects (replaying it would mostly time retry delays)
+    """
+    from .analysis import build_pipeline
+    from .xmltags import parse_tags
+    record = {**record, 'analysis': upgrade_analysis(record)}
+    context = {'text': record['original_text']}
+    responses = []
+    try:
+        for stage in build_pipeline().stages:
+            if not all(key in context for key in stage.requires):
+                continue
+            request = stage.llm_request(context)
+            if request is None:
+                context = stage.finish(context, None)
+                continue
+            fields = DEBATE_RESPONSE_FIELDS.get(request['prompt_name'], ())
+            response = next((record[field] for field in fields if record.get(field)), None)
+            if response is None or parse_tags(response).missing(request.get('expected_tags') or []):
+                return None
+            responses.append((request['prompt_name'], request['prompt'], response))
+            context = stage.finish(context, response)
+    except Exception as e:
+        logger.warning("Skipped debate that could not be replayed", extra={
+            'debate_id': record.get('id'),
+            'error': str(e)
+        })
+        return None
+    return responses
+
+
+class ReplayProvider:
+    """
+    Serves recorded LLM responses in place of a provider
+
+    Responses are looked up by prompt name and prompt text. Each call waits
+    latency seconds, plus or minus up to jitter, to stand in for the
+    provider's response time; streamed responses are split into chunks of
+    chunk_chars with the wait spread across them.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, chunk_chars=200, seed=None):
+        self.responses = {}
+        # Debate texts whose whole analysis can be replayed
+        self.texts = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_chars = max(1, chunk_chars)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'calls': 0, 'misses': 0, 'simulated_seconds': 0.0})
+
+    def add(self, prompt_name, prompt, response):
+        self.responses[replay_key(prompt_name, prompt)] = response
+
+    def add_debate(self, text, responses):
+        """Record every call of one debate's analysis, as returned by debate_responses"""
+        for prompt_name, prompt, response in responses:
+            self.add(prompt_name, prompt, response)
+        self.texts[text] = None
+
+    def __len__(self):
+        return len(self.responses)
+
+    def response(self, prompt_name, prompt):
+        """
+        Return the recorded response for a prompt
+
+        Raises:
+            ReplayMiss: If nothing was recorded for it
+        """
+        response = self.responses.get(replay_key(prompt_name, prompt))
+        with self._lock:
+            stats = self._stats[prompt_name]
+            stats['calls'] += 1
+            if response is None:
+                stats['misses'] += 1
+        if response is None:
+            raise ReplayMiss(f"No recorded response for {prompt_name} ({len(prompt)} character prompt)")
+        return response
+
+    def delay(self, prompt_name):
+        """Draw the simulated response time of one call"""
+        with self._lock:
+            seconds = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            self._stats[prompt_name]['simulated_seconds'] += seconds
+        return seconds
+
+    def chunks(self, response):
+        return [response[i:i + self.chunk_chars] for i in range(0, len(response), self.chunk_chars)]
+
+    def chat(self, prompt_name, prompt):
+        response = self.response(prompt_name, prompt)
+        time.sleep(self.delay(prompt_name))
+        return response
+
+    def deltas(self, prompt_name, prompt):
+        """Yield the response as streamed text deltas"""
+        chunks = self.chunks(self.response(prompt_name, prompt))
+        pause = self.delay(prompt_name) / max(len(chunks), 1)
+        for chunk in chunks:
+            time.sleep(pause)
+            yield chunk
+
+    async def achat(self, prompt_name, prompt):
+        response = self.response(prompt_name, prompt)
+        await asyncio.sleep(self.delay(prompt_name))
+        return response
+
+    async def adeltas(self, prompt_name, prompt):
+        """Async variant of deltas"""
+        chunks = self.chunks(self.response(prompt_name, prompt))
+        pause = self.delay(prompt_name) / max(len(chunks), 1)
+        for chunk in chunks:
+            await asyncio.sleep(pause)
+            yield chunk
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def build_replay_provider(config):
+    """Build a ReplayProvider from an LLM_REPLAY settings dict"""
+    from debate.management.exports import EXPORT_PATTERNS, find_exports, iter_records
+    interaction_files = config.get('INTERACTION_FILES')
+    debate_files = config.get('DEBATE_FILES')
+    start = time.perf_counter()
+    provider = ReplayProvider(
+        latency=config.get('LATENCY', 0.0),
+        jitter=config.get('JITTER', 0.0),
+        chunk_chars=config.get('CHUNK_CHARS', 200),
+        seed=config.get('SEED')
+    )
+    for path in find_exports(INTERACTION_PATTERNS) if interaction_files is None else interaction_files:
+        for prompt_name, prompt, response in interaction_responses(iter_records(path)):
+            provider.add(prompt_name, prompt, response)
+    for path in find_exports(EXPORT_PATTERNS) if debate_files is None else debate_files:
+        for record in iter_records(path):
+            responses = debate_responses(record)
+            if responses:
+                provider.add_debate(record['original_text'], responses)
+    logger.info("Loaded recorded LLM responses", extra={
+        'responses': len(provider),
+        'debates': len(provider.texts),
+        'seconds': round(time.perf_counter() - start, 2)
+    })
+    return provider
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_replay_provider():
+    """Return the process-wide ReplayProvider configured by settings.LLM_REPLAY"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                from django.conf import settings
+                _provider = build_replay_provider(getattr(settings, 'LLM_REPLAY', {}))
+    return _provider
+
+
+def set_replay_provider(provider):
+    """Replace the process-wide ReplayProvider (None reloads it from settings on next use)"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
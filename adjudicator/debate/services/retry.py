@@ -0,0 +1,109 @@
+import random
+import threading
+from .clients import ProviderError
+from .replay import ReplayMiss
+
+
+class RetryBudget:
+    """
+    Retries and retry wait shared by every LLM call made for one request
+
+    A flaky provider then costs an analysis at most `retries` extra calls
+    and `seconds` of waiting in total, however the failures are spread
+    over its stages.
+    """
+
+    def __init__(self, retries, seconds):
+        self.retries = retries
+        self.seconds = seconds
+        self._lock = threading.Lock()
+
+    def spend(self, delay):
+        """Take one retry waiting delay seconds from the budget; False if it does not fit"""
+        with self._lock:
+            if self.retries < 1 or delay > self.seconds:
+                return False
+            self.retries -= 1
+            self.seconds -= delay
+            return True
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed LLM call is tried again
+
+    Waits grow exponentially from base_delay up to max_delay, and each is
+    shortened by a random fraction of up to jitter so that calls which
+    failed together do not retry together. A provider's Retry-After is
+    used as is, unless it asks for more than max_retry_after, in which case
+    the call fails instead. Malformed responses are retried straight away,
+    as a repair request when repair is set.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=30.0, multiplier=2.0, jitter=0.5, max_retry_after=60.0,
+                 budget_retries=6, budget_seconds=120.0, repair=True, seed=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.budget_retries = budget_retries
+        self.budget_seconds = budget_seconds
+        self.repair = repair
+        self._random = random.Random(seed)
+
+    def retryable(self, error):
+        if isinstance(error, ReplayMiss):
+            return False
+        if isinstance(error, ProviderError):
+            return error.retryable
+        # Anything unexpected gets another try, as it always has
+        return True
+
+    def delay(self, attempt, error=None):
+        """
+        Seconds to wait after attempt failed with error
+
+        Returns:
+            float: The wait, or None if the error should not be retried
+        """
+        if error is not None and not self.retryable(error):
+            return None
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        backoff = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return backoff * (1 - self.jitter * self._random.random())
+
+    def budget(self):
+        """A fresh RetryBudget for one request"""
+        return RetryBudget(self.budget_retries, self.budget_seconds)
+
+
+def build_retry_policy(config):
+    """Build a RetryPolicy from an LLM_RETRY settings dict"""
+    return RetryPolicy(
+        base_delay=config.get('BASE_DELAY', 1.0),
+        max_delay=config.get('MAX_DELAY', 30.0),
+        multiplier=config.get('MULTIPLIER', 2.0),
+        jitter=config.get('JITTER', 0.5),
+        max_retry_after=config.get('MAX_RETRY_AFTER', 60.0),
+        budget_retries=config.get('BUDGET_RETRIES', 6),
+        budget_seconds=config.get('BUDGET_SECONDS', 120.0),
+        repair=config.get('REPAIR', True)
+    )
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_retry_policy():
+    """Return the process-wide RetryPolicy configured by settings.LLM_RETRY"""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                from django.conf import settings
+                _policy = build_retry_policy(getattr(settings, 'LLM_RETRY', {}))
+    return _policy
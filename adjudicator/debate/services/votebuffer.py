@@ -0,0 +1,150 @@
+import logging
+import threading
+
+logger = logging.getLogger('llm_calls')
+
+KEY_PREFIX = 'votes'
+DIRTY_KEY = f'{KEY_PREFIX}:dirty'
+
+
+class MemoryVoteBuffer:
+    """
+    Per-process buffer of debates with unflushed votes
+
+    Holds the latest vote per debate and field. When flush_interval is set,
+    the first vote after a flush schedules flush() on a timer thread, since
+    no other process can see this buffer.
+    """
+
+    def __init__(self, flush_interval=None, flush=None):
+        self.flush_interval = flush_interval
+        self.flush = flush
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def record(self, debate_id, field, value):
+        with self._lock:
+            self._pending.setdefault(debate_id, {})[field] = value
+            if self.flush and self.flush_interval and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._run_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Scheduled vote flush failed")
+
+    def pending(self, debate_id):
+        with self._lock:
+            return dict(self._pending.get(debate_id, {}))
+
+    def drain(self, limit=None):
+        """Remove and return up to limit dirty debates as {debate_id: {field: value}}"""
+        with self._lock:
+            debate_ids = list(self._pending)[:limit]
+            return {debate_id: self._pending.pop(debate_id) for debate_id in debate_ids}
+
+    def restore(self, batch):
+        """Put back a drained batch whose flush failed, keeping any newer votes"""
+        with self._lock:
+            for debate_id, votes in batch.items():
+                pending = self._pending.setdefault(debate_id, {})
+                for field, value in votes.items():
+                    pending.setdefault(field, value)
+
+
+class RedisVoteBuffer:
+    """
+    Buffer shared by all processes, in Redis
+
+    Each debate's latest votes are a hash votes:pending:<id> (an empty string
+    for a removed vote), and votes:dirty is the set of debates to flush.
+    """
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, debate_id):
+        return f'{KEY_PREFIX}:pending:{debate_id}'
+
+    def record(self, debate_id, field, value):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(debate_id), field, value or '')
+        pipe.sadd(DIRTY_KEY, debate_id)
+        pipe.execute()
+
+    def pending(self, debate_id):
+        return {field: value or None for field, value in self.client.hgetall(self._key(debate_id)).items()}
+
+    def drain(self, limit=None):
+        """
+        Remove and return up to limit dirty debates as {debate_id: {field: value}}
+
+        A vote recorded while this runs either lands in the drained hash or
+        marks the debate dirty again, so it is never lost; at worst the
+        debate is flushed once more.
+        """
+        debate_ids = self.client.spop(DIRTY_KEY, limit or self.client.scard(DIRTY_KEY))
+        if not debate_ids:
+            return {}
+        pipe = self.client.pipeline()
+        for debate_id in debate_ids:
+            pipe.hgetall(self._key(debate_id))
+            pipe.delete(self._key(debate_id))
+        results = pipe.execute()[::2]
+        return {
+            int(debate_id): {field: value or None for field, value in votes.items()}
+            for debate_id, votes in zip(debate_ids, results)
+        }
+
+    def restore(self, batch):
+        """Put back a drained batch whose flush failed, keeping any newer votes"""
+        pipe = self.client.pipeline()
+        for debate_id, votes in batch.items():
+            for field, value in votes.items():
+                pipe.hsetnx(self._key(debate_id), field, value or '')
+            pipe.sadd(DIRTY_KEY, debate_id)
+        pipe.execute()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def build_vote_buffer(config, flush=None):
+    """Build a vote buffer from a VOTE_BUFFER settings dict"""
+    backend_name = config.get('BACKEND', 'memory')
+    if backend_name == 'memory':
+        return MemoryVoteBuffer(config.get('FLUSH_INTERVAL'), flush)
+    elif backend_name == 'redis':
+        return RedisVoteBuffer(config['LOCATION'])
+    raise ValueError(f"Unknown vote buffer backend: {backend_name}")
+
+
+def get_vote_buffer(flush=None):
+    """
+    Return the process-wide vote buffer configured by settings.VOTE_BUFFER
+
+    flush is the function an in-process buffer calls on its timer; it is
+    only used the first time the buffer is built.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from django.conf import settings
+                _buffer = build_vote_buffer(getattr(settings, 'VOTE_BUFFER', {}), flush)
+    return _buffer
+
+
+def reset_vote_buffer():
+    """Drop the process-wide vote buffer, e.g. after changing settings in tests"""
+    global _buffer
+    with _buffer_lock:
+        _buffer = None
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+from ..models import Debate, ApprovalRecord
+from . import pagecache
+from .votebuffer import get_vote_buffer
+
+# Vote field -> (approvals counter, disapprovals counter, last vote column)
+VOTE_COLUMNS = {
+    'evaluation': ('evaluation_approvals', 'evaluation_disapprovals', 'evaluation_approval'),
+    'judgment': ('judgment_approvals', 'judgment_disapprovals', 'judgment_approval'),
+}
+
+
+def vote_deltas(field, previous, value):
+    """
+    Counter changes for moving one voter's vote on field from previous to value
+
+    Args:
+        field (str): 'evaluation' or 'judgment'
+        previous (str): The voter's current vote, or None
+        value (str): The vote being cast, or None to remove it
+
+    Returns:
+        dict: Column name -> change, including total_score
+    """
+    approvals, disapprovals, _ = VOTE_COLUMNS[field]
+    deltas = {approvals: 0, disapprovals: 0}
+    for vote, sign in ((previous, -1), (value, 1)):
+        if vote == Debate.ApprovalStatus.APPROVED:
+            deltas[approvals] += sign
+        elif vote == Debate.ApprovalStatus.DISAPPROVED:
+            deltas[disapprovals] += sign
+    deltas['total_score'] = deltas[approvals] - deltas[disapprovals]
+    return deltas
+
+
+def _update_record(debate_id, ip_address, field, value, lock=False):
+    """
+    Create, switch or remove the voter's ApprovalRecord
+
+    Returns:
+        tuple: The voter's (previous, new) vote, either of which may be None
+    """
+    records = ApprovalRecord.objects.filter(debate_id=debate_id, ip_address=ip_address, field=field)
+    record = (records.select_for_update() if lock else records).first()
+    previous = record.value if record else None
+
+    if record is None:
+        ApprovalRecord.objects.create(
+            debate_id=debate_id,
+            ip_address=ip_address,
+            field=field,
+            value=value
+        )
+    elif previous == value:
+        # Clicking the same button again removes the vote
+        record.delete()
+        value = None
+    else:
+        record.value = value
+        record.save(update_fields=['value'])
+    return previous, value
+
+
+def cast_vote(debate_id, ip_address, field, value):
+    """
+    Record a vote on a debate's evaluation or judgment
+
+    Casting the same vote again removes it, casting the other one switches
+    it. In the default 'direct' VOTE_MODE the debate row is locked for the
+    duration, so concurrent votes on it are applied one at a time, and only
+    the counter columns are written. In 'buffered' mode only the voter's
+    record is written and the counters catch up at the next flush_votes().
+
+    Args:
+        debate_id (int): The debate voted on
+        ip_address (str): The voter
+        field (str): 'evaluation' or 'judgment'
+        value (str): 'approved' or 'disapproved'
+
+    Returns:
+        str: The voter's vote after the change, or None if it was removed
+
+    Raises:
+        ValueError: If field or value is not a known vote
+        Debate.DoesNotExist: If there is no such debate
+    """
+    if field not in VOTE_COLUMNS:
+        raise ValueError(f"Unknown vote field: {field}")
+    if value not in Debate.ApprovalStatus.values:
+        raise ValueError(f"Unknown vote value: {value}")
+
+    if settings.VOTE_MODE == 'buffered':
+        return _cast_buffered_vote(debate_id, ip_address, field, value)
+
+    with transaction.atomic():
+        Debate.objects.select_for_update().values_list('id', flat=True).get(id=debate_id)
+
+        previous, value = _update_record(debate_id, ip_address, field, value)
+
+        updates = {
+            column: F(column) + delta
+            for column, delta in vote_deltas(field, previous, value).items() if delta
+        }
+        updates[VOTE_COLUMNS[field][2]] = value
+        Debate.objects.filter(id=debate_id).update(**updates)
+
+        transaction.on_commit(lambda: pagecache.invalidate_votes(debate_id))
+
+    return value
+
+
+def _cast_buffered_vote(debate_id, ip_address, field, value):
+    if not Debate.objects.filter(id=debate_id).exists():
+        raise Debate.DoesNotExist(f"Debate {debate_id} does not exist")
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                previous, new_value = _update_record(debate_id, ip_address, field, value, lock=True)
+                # Only marked once the record is committed, so a flush that
+                # drains the mark always sees the record
+                transaction.on_commit(lambda: get_buffer().record(debate_id, field, new_value))
+                transaction.on_commit(lambda: pagecache.invalidate_votes(debate_id))
+            return new_value
+        except IntegrityError:
+            # A concurrent first vote by the same voter was inserted first;
+            # the retry sees and updates it
+            if attempt:
+                raise
+
+
+def get_buffer():
+    return get_vote_buffer(flush=flush_votes_in_background)
+
+
+def vote_state(debate):
+    """
+    The last vote on each field of a debate, as shown by the approval buttons
+
+    Includes buffered votes that have not been flushed yet, so a voter who
+    reloads the page sees their own vote.
+    """
+    pending = get_buffer().pending(debate.id) if settings.VOTE_MODE == 'buffered' else {}
+    return {
+        field: pending[field] if field in pending else getattr(debate, columns[2])
+        for field, columns in VOTE_COLUMNS.items()
+    }
+
+
+def recount(debate_ids, pending=None):
+    """
+    Recompute the counters of debates from their ApprovalRecords
+
+    Counting from the records rather than adding up buffered deltas makes a
+    flush idempotent: a debate flushed twice, or flushed after a failure,
+    still ends up with each vote counted exactly once.
+
+    Args:
+        debate_ids (list): Debates to recount
+        pending (dict): Optional {debate_id: {field: value}} of last votes to
+            store in the evaluation_approval/judgment_approval columns
+    """
+    pending = pending or {}
+    counts = defaultdict(int)
+    rows = ApprovalRecord.objects.filter(debate_id__in=debate_ids).values_list(
+        'debate_id', 'field', 'value'
+    ).annotate(count=Count('id'))
+    for debate_id, field, value, count in rows:
+        counts[debate_id, field, value] = count
+
+    counter_columns = [column for columns in VOTE_COLUMNS.values() for column in columns[:2]]
+    last_vote_columns = [columns[2] for columns in VOTE_COLUMNS.values()]
+    with transaction.atomic():
+        debates = list(
+            Debate.objects.select_for_update().only('id', *last_vote_columns).filter(id__in=debate_ids)
+        )
+        for debate in debates:
+            debate.total_score = 0
+            for field, (approvals, disapprovals, last_vote) in VOTE_COLUMNS.items():
+                setattr(debate, approvals, counts[debate.id, field, Debate.ApprovalStatus.APPROVED])
+                setattr(debate, disapprovals, counts[debate.id, field, Debate.ApprovalStatus.DISAPPROVED])
+                debate.total_score += getattr(debate, approvals) - getattr(debate, disapprovals)
+                if field in pending.get(debate.id, {}):
+                    setattr(debate, last_vote, pending[debate.id][field])
+        Debate.objects.bulk_update(debates, counter_columns + last_vote_columns + ['total_score'])
+    for debate in debates:
+        pagecache.invalidate_votes(debate.id)
+    return len(debates)
+
+
+def flush_votes(limit=None):
+    """
+    Fold buffered votes into the debate counters
+
+    Returns:
+        int: The number of debates updated
+    """
+    buffer = get_buffer()
+    batch = buffer.drain(limit)
+    if not batch:
+        return 0
+    try:
+        return recount(list(batch), batch)
+    except Exception:
+        buffer.restore(batch)
+        raise
+
+
+def flush_votes_in_background():
+    """Flush from the in-process buffer's timer thread, which owns its own connection"""
+    try:
+        flush_votes()
+    finally:
+        connection.close()
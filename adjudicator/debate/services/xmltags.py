@@ -0,0 +1,186 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+# Plain opening or closing tags as written by the prompts, e.g. <p1> or </argument_map>.
+# Anything with attributes or other markup is left as text.
+TAG_RE = re.compile(r'<(/?)([A-Za-z_][\w.-]*)\s*>')
+
+# A tag cut off at the end of a partially received response
+PARTIAL_TAG_RE = re.compile(r'<[^<>]*$')
+
+# Number of parsed responses kept by parse_tags
+PARSE_CACHE_SIZE = 64
+
+
+class TagNode:
+    """
+    One tag in a parsed response
+
+    Only offsets into the response are stored; text is sliced out on demand,
+    so it is exactly what the model wrote, nested markup included. Nodes
+    share the response through a one-item list rather than pointing back at
+    the tree, so parsed trees hold no reference cycles and are freed as soon
+    as they are dropped (e.g. evicted from parse_tags' cache) instead of
+    waiting for the cyclic garbage collector.
+    """
+
+    __slots__ = ('source', 'name', 'tag_start', 'start', 'end', 'tag_end', 'children')
+
+    def __init__(self, source, name, tag_start, start):
+        self.source = source
+        self.name = name
+        # Offset of the opening tag, and of the first character after it
+        self.tag_start = tag_start
+        self.start = start
+        # Offsets of the closing tag and the first character after it, or
+        # None while the tag is still open
+        self.end = None
+        self.tag_end = None
+        self.children = []
+
+    @property
+    def closed(self):
+        return self.end is not None
+
+    @property
+    def raw(self):
+        """The content between the tags, or everything received so far if still open"""
+        text = self.source[0]
+        return text[self.start:self.end if self.end is not None else len(text)]
+
+    @property
+    def text(self):
+        return self.raw.strip()
+
+    def find(self, name):
+        """Return the first closed descendant called name, or None"""
+        pending = self.children[::-1]
+        while pending:
+            node = pending.pop()
+            if node.name == name and node.end is not None:
+                return node
+            pending.extend(reversed(node.children))
+        return None
+
+    def find_all(self, name):
+        """Return the closed children called name, in order"""
+        return [child for child in self.children if child.name == name and child.closed]
+
+    def __repr__(self):
+        return f'<TagNode {self.name} [{self.start}:{self.end}]>'
+
+
+class TagTree:
+    """
+    Single-pass tokenizer for the tagged responses the prompts ask for
+
+    The response is scanned once with TAG_RE and turned into a tree of
+    TagNodes. It can be fed incrementally while a response streams in; only
+    new text is scanned on each feed. A closing tag closes the nearest open
+    tag of the same name, and stray closing tags are ignored, so the
+    unmatched placeholders models sometimes write (e.g. "FOR <p1>") do not
+    disturb the tags around them.
+    """
+
+    def __init__(self, text=''):
+        self._source = ['']
+        self.root = TagNode(self._source, None, 0, 0)
+        self.index = defaultdict(list)
+        self._stack = [self.root]
+        self._pos = 0
+        if text:
+            self.feed(text)
+
+    @property
+    def text(self):
+        return self._source[0]
+
+    @property
+    def raw(self):
+        return self._source[0]
+
+    def feed(self, chunk):
+        text = self._source[0] = self._source[0] + chunk
+        stack = self._stack
+        pos = self._pos
+        for match in TAG_RE.finditer(text, pos):
+            closing, name = match.groups()
+            if not closing:
+                node = TagNode(self._source, name, match.start(), match.end())
+                stack[-1].children.append(node)
+                stack.append(node)
+                self.index[name].append(node)
+            else:
+                for depth in range(len(stack) - 1, 0, -1):
+                    if stack[depth].name == name:
+                        stack[depth].end = match.start()
+                        stack[depth].tag_end = match.end()
+                        # Anything opened inside it and never closed stays unclosed
+                        del stack[depth:]
+                        break
+            pos = match.end()
+
+        # Re-scan a possibly incomplete tag at the end on the next feed
+        partial = text.rfind('<', pos)
+        self._pos = partial if partial != -1 and '>' not in text[partial:] else len(text)
+        return self
+
+    def find(self, name):
+        """Return the first closed tag called name, or None"""
+        for node in self.index.get(name, ()):
+            if node.closed:
+                return node
+        return None
+
+    def find_open(self, name):
+        """Return the first tag called name whether or not it has been closed yet"""
+        nodes = self.index.get(name)
+        return nodes[0] if nodes else None
+
+    def get(self, name, default=None):
+        """Return the stripped content of the first closed tag called name"""
+        node = self.find(name)
+        return node.text if node is not None else default
+
+    def missing(self, names):
+        """Return the names that have no closed tag"""
+        return [name for name in names if self.find(name) is None]
+
+    def replace(self, replacements):
+        """
+        Return the text with every closed tag named in replacements swapped
+        (tags included) for its replacement string
+        """
+        spans = sorted(
+            (node.tag_start, node.tag_end, replacements[node.name])
+            for name in replacements
+            for node in self.index.get(name, ())
+            if node.closed
+        )
+        parts = []
+        pos = 0
+        for start, end, replacement in spans:
+            if start < pos:
+                # Nested inside a tag that has already been replaced
+                continue
+            parts.append(self.text[pos:start])
+            parts.append(replacement)
+            pos = end
+        parts.append(self.text[pos:])
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_tags(text):
+    """
+    Parse a complete response, reusing the tree if the same text was parsed recently
+
+    The returned tree is shared between callers and must not be fed further.
+    """
+    return TagTree(text)
+
+
+def strip_tags(text):
+    """Drop tags (including one cut off at the end) from text for plain display"""
+    return TAG_RE.sub(' ', PARTIAL_TAG_RE.sub('', text))
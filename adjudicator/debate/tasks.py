@@ -0,0 +1,15 @@
+from celery import shared_task
+from .services.jobs import run_job
+from .services.votes import flush_votes as flush_vote_buffer
+
+
+@shared_task(acks_late=True)
+def run_analysis(job_id):
+    """Run an analysis job on a Celery worker, resuming from saved stage outputs"""
+    return run_job(job_id)
+
+
+@shared_task
+def flush_votes():
+    """Fold buffered votes into the debate counters (VOTE_MODE=buffered)"""
+    return flush_vote_buffer()
@@ -1,20 +1,26 @@
 from django import template
 import re
-import xml.etree.ElementTree as ET
-from io import StringIO
+from ..services import analysis
+from ..services.xmltags import parse_tags
 
 register = template.Library()
 
 @register.filter
 def split_section(text, section_header):
     """Extract content between a section header and the next section"""
-    if section_header == "For P1:":
-        pattern = r'<p1_advice>(.*?)</p1_advice>'
-    elif section_header == "For P2:":
-        pattern = r'<p2_advice>(.*?)</p2_advice>'
-    else:
-        # Use raw string (r prefix) for the regex pattern
-        pattern = fr"{section_header}(.*?)(?=\n\w+:|$)"
+    if section_header in ("For P1:", "For P2:"):
+        tag = 'p1_advice' if section_header == "For P1:" else 'p2_advice'
+        section = parse_tags(text).find(tag)
+        if section is None:
+            return ""
+        # Extract items from list if present
+        items = [item.raw for item in section.find_all('item')]
+        if items:
+            return items
+        return section.text
+    
+    # Use raw string (r prefix) for the regex pattern
+    pattern = fr"{section_header}(.*?)(?=\n\w+:|$)"
         
     match = re.search(pattern, text, re.DOTALL)
     if match:
@@ -42,21 +48,7 @@ def clean_analysis(text):
 def extract_advice(judgment_text, advice_type):
     """Extract advice points from the XML structure in the judgment text"""
     try:
-        # Clean the text first
-        judgment_text = judgment_text.replace('*Qant*', '')
-        
-        # Find the strengthening_advice section
-        advice_match = re.search(r'<strengthening_advice>(.*?)</strengthening_advice>', judgment_text, re.DOTALL)
-        if not advice_match:
-            return []
-
-        # Parse the XML
-        advice_xml = f'<root>{advice_match.group(1)}</root>'
-        root = ET.fromstring(advice_xml)
-        
-        # Extract points for the specified advice type
-        points = root.findall(f'.//{advice_type}/point')
-        return [point.text.strip() for point in points if point.text]
+        return analysis.extract_advice(judgment_text, advice_type)
     except Exception:
         # Fallback to handle legacy format or parsing errors
-        return [] 
\ No newline at end of file
+        return []
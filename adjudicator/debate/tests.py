@@ -1,3 +1,780 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.models import Count, Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .management.commands.export_debates import interaction_record
+from .management.exports import EXPORT_PATTERNS, find_exports, iter_records
+from .log_handlers import JsonFormatter, QueuedTimedRotatingFileHandler
+from .middleware import QueryCounter
+from .models import AnalysisEvent, AnalysisJob, ApprovalRecord, CreditBalance, Debate, IPCreditUsage, LLMInteraction
+from .services.llm import LLMCall, load_prompt, make_llm_call
+from .services.jobs import ProgressChannel, lost_job_message, submit_analysis
+from .services.cache import get_response_cache
+from .services.clients import ProviderError
+from .services.pipeline import AnalysisPipeline, PipelineStage, StageTimeoutError
+from .services.ratelimit import MemoryBucketStore, RateLimiter, reset_rate_limiter
+from .services.replay import ReplayProvider, debate_responses, set_replay_provider
+from .services.xmltags import TagTree, strip_tags
+from .services.votebuffer import reset_vote_buffer
+from .services.votes import VOTE_COLUMNS, cast_vote, flush_votes
 
-# Create your tests here.
+ANALYSIS_RESULT = {
+    'analysis': '<debate_title>Tabs vs Spaces</debate_title>',
+    'belligerent_1': 'Alice',
+    'belligerent_2': 'Bob',
+    'summary_1': 'Tabs are better.',
+    'summary_2': 'Spaces are better.',
+    'title': 'Tabs vs Spaces',
+    'evaluation': 'evaluation',
+    'judgment': '<winner>Alice</winner>',
+    'evaluation_formatted': '',
+    'judgment_formatted': '',
+    'winner': 'Alice',
+}
+
+
+def make_debate(**fields):
+    return Debate.objects.create(**{
+        'original_text': 'Alice: tabs. Bob: spaces.',
+        'belligerent_1': 'Alice',
+        'belligerent_2': 'Bob',
+        'summary_1': 'Tabs are better.',
+        'summary_2': 'Spaces are better.',
+        'winner': 'Alice',
+        'credit_cost': Decimal('1.00'),
+        'title': 'Tabs vs Spaces',
+        **fields
+    })
+
+
+async def fake_analysis(text, progress_callback=None, **kwargs):
+    """Stands in for aperform_analysis, publishing progress without calling any LLM"""
+    progress_callback({'stage': 'analysis', 'percent': 10, 'message': 'Identifying participants...'})
+    progress_callback({'stage': 'evaluation', 'percent': 40, 'message': 'Evaluating arguments...'})
+    progress_callback({'stage': 'judgment', 'percent': 70, 'message': 'Judging...'})
+    return dict(ANALYSIS_RESULT)
+
+
+async def read_stream(response):
+    """Parse a text/event-stream response into (id, data) pairs, skipping heartbeats"""
+    body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+    events = []
+    for block in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+        if 'data' not in fields:
+            continue
+        data = json.loads(fields['data'])
+        if not data.get('heartbeat'):
+            events.append((int(fields['id']) if 'id' in fields else None, data))
+    return events
+
+
+@override_settings(ANALYSIS_QUEUE='celery', CELERY_TASK_ALWAYS_EAGER=True)
+class AnalysisStreamTests(TransactionTestCase):
+    """Submitting analyses as Celery jobs (run eagerly) and streaming their progress"""
+
+    def setUp(self):
+        reset_rate_limiter()
+
+    async def submit(self):
+        with mock.patch('debate.services.jobs.aperform_analysis', side_effect=fake_analysis):
+            response = await self.async_client.post('/analyze-stream/', {'debate_text': 'Alice: tabs. Bob: spaces.'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['job_id']
+
+    async def test_stream_replays_job_events(self):
+        job_id = await self.submit()
+        job = await AnalysisJob.objects.aget(id=job_id)
+        self.assertEqual(job.status, AnalysisJob.Status.COMPLETE)
+
+        events = await read_stream(await self.async_client.get('/analyze-stream/'))
+        self.assertEqual([seq for seq, _ in events], list(range(1, len(events) + 1)))
+        self.assertEqual(
+            [data['stage'] for _, data in events],
+            ['queued', 'analysis', 'evaluation', 'judgment', 'complete']
+        )
+        self.assertEqual(events[-1][1]['debate_id'], job.debate_id)
+        # Percentages never go backwards
+        percents = [data['percent'] for _, data in events]
+        self.assertEqual(percents, sorted(percents))
+
+    async def test_stream_resumes_after_last_event_id(self):
+        job_id = await self.submit()
+        full = await read_stream(await self.async_client.get(f'/analyze-stream/?job={job_id}'))
+
+        resumed = await read_stream(await self.async_client.get(
+            f'/analyze-stream/?job={job_id}', headers={'Last-Event-ID': '2'}
+        ))
+        self.assertEqual(resumed, full[2:])
+        self.assertEqual(resumed[-1][1]['stage'], 'complete')
+
+    async def test_failed_analysis_ends_stream_with_error(self):
+        with mock.patch('debate.services.jobs.aperform_analysis', side_effect=RuntimeError('provider down')):
+            response = await self.async_client.post('/analyze-stream/', {'debate_text': 'Alice: tabs.'})
+        job = await AnalysisJob.objects.aget(id=response.json()['job_id'])
+        self.assertEqual(job.status, AnalysisJob.Status.FAILED)
+        self.assertTrue(job.credits_refunded)
+
+        events = await read_stream(await self.async_client.get(f'/analyze-stream/?job={job.id}'))
+        self.assertEqual(events[-1][1]['stage'], 'error')
+        self.assertEqual(events[-1][1]['message'], 'provider down')
+
+
+# A complete debate whose stage responses can be replayed
+REPLAYED_DEBATE = {
+    'original_text': 'Alice: tabs. Bob: spaces.',
+    'analysis': (
+        '<debate_title>Tabs vs Spaces</debate_title><p1>Alice</p1><p2>Bob</p2>'
+        '<s1>Tabs are better.</s1><s2>Spaces are better.</s2><complexity>low</complexity>'
+    ),
+    'evaluation': (
+        '<argument_map><topic>Indentation</topic><p1_argument>Tabs are configurable.</p1_argument>'
+        '<p2_argument>Spaces look the same everywhere.</p2_argument></argument_map>'
+        '<direct_interactions>none</direct_interactions>'
+        '<decisive_factors>consistency</decisive_factors><uncertainties>none</uncertainties>'
+    ),
+    'judgment': (
+        '<winner>Alice</winner><reasoning>Tabs are configurable.</reasoning>'
+        '<strength>moderate</strength><strengthening_advice>Cite editors.</strengthening_advice>'
+    ),
+    'evaluation_formatted': 'Both sides argued about indentation.',
+    'judgment_formatted': 'Alice wins.',
+}
+
+
+@override_settings(ANALYSIS_QUEUE='celery', CELERY_TASK_ALWAYS_EAGER=True, LLM_PROVIDER='replay')
+class AsyncJobRunnerTests(TransactionTestCase):
+    """Jobs run the async pipeline end to end, here against replayed LLM responses"""
+
+    def setUp(self):
+        provider = ReplayProvider()
+        provider.add_debate(REPLAYED_DEBATE['original_text'], debate_responses(REPLAYED_DEBATE))
+        set_replay_provider(provider)
+        self.addCleanup(set_replay_provider, None)
+
+    def test_job_runs_through_the_async_pipeline(self):
+        with mock.patch.object(AnalysisPipeline, 'process', side_effect=AssertionError('blocking pipeline used')):
+            job = submit_analysis(REPLAYED_DEBATE['original_text'])
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.Status.COMPLETE)
+        self.assertEqual(job.debate.winner, 'Alice')
+        self.assertEqual(job.debate.judgment_formatted, 'Alice wins.')
+        self.assertEqual(set(job.stage_outputs), {
+            'analysis', 'anonymized_analysis', 'belligerent_1', 'belligerent_2', 'summary_1', 'summary_2',
+            'title', 'evaluation', 'judgment', 'winner', 'evaluation_formatted', 'judgment_formatted'
+        })
+        self.assertEqual(LLMInteraction.objects.filter(debate=job.debate).count(), 5)
+
+        stages = list(job.events.order_by('seq').values_list('data__stage', flat=True))
+        self.assertEqual(stages[0], 'queued')
+        self.assertEqual(stages[-2:], ['processing_complete', 'complete'])
+        self.assertIn('title_extracted', stages)
+
+
+@mock.patch('debate.views.analysis.STREAM_POLL_INTERVAL', 0)
+@mock.patch('debate.views.analysis.STREAM_STATUS_INTERVAL', 0)
+class LostJobTests(TestCase):
+    """Progress streams of jobs that will never publish a terminal event"""
+
+    def make_job(self, status, idle_seconds=0):
+        job = AnalysisJob.objects.create(text='Alice: tabs.', status=status)
+        ProgressChannel(job).publish({'stage': 'analysis', 'percent': 10})
+        if idle_seconds:
+            past = timezone.now() - timedelta(seconds=idle_seconds)
+            AnalysisJob.objects.filter(id=job.id).update(updated_at=past)
+            AnalysisEvent.objects.filter(job=job).update(created_at=past)
+        return job
+
+    @override_settings(ANALYSIS_STALE_SECONDS=60)
+    def test_stalled_job_is_lost(self):
+        self.assertIsNone(lost_job_message(self.make_job(AnalysisJob.Status.RUNNING, idle_seconds=30).id))
+        self.assertIsNotNone(lost_job_message(self.make_job(AnalysisJob.Status.RUNNING, idle_seconds=120).id))
+        self.assertIsNotNone(lost_job_message(self.make_job(AnalysisJob.Status.PENDING, idle_seconds=120).id))
+
+    def test_failed_job_waits_for_its_terminal_event(self):
+        job = self.make_job(AnalysisJob.Status.FAILED)
+        self.assertIsNotNone(lost_job_message(job.id))
+        ProgressChannel(job).finish({'stage': 'error', 'message': 'provider down', 'percent': 0})
+        self.assertIsNone(lost_job_message(job.id))
+
+    @override_settings(ANALYSIS_STALE_SECONDS=60)
+    async def test_stream_of_stalled_job_ends_with_error(self):
+        job = await sync_to_async(self.make_job)(AnalysisJob.Status.RUNNING, idle_seconds=120)
+        events = await read_stream(await self.async_client.get(f'/analyze-stream/?job={job.id}'))
+        self.assertEqual([data['stage'] for _, data in events], ['analysis', 'error'])
+        self.assertIsNone(events[-1][0])
+
+    async def test_stream_of_job_failed_without_terminal_event_ends(self):
+        job = await sync_to_async(self.make_job)(AnalysisJob.Status.FAILED)
+        await AnalysisJob.objects.filter(id=job.id).aupdate(error_message='worker crashed')
+        events = await read_stream(await self.async_client.get(f'/analyze-stream/?job={job.id}'))
+        self.assertEqual(events[-1][1], {'stage': 'error', 'message': 'worker crashed', 'percent': 0})
+
+
+@override_settings(QUERY_BUDGET={**settings.QUERY_BUDGET, 'STRICT': True})
+class QueryBudgetTests(TransactionTestCase):
+    """
+    Queries per page, pinned exactly so that regressions show up here
+
+    Queries are counted the way QueryBudgetMiddleware counts them, and the
+    middleware runs in STRICT mode, so a page over its configured budget
+    also fails the request. Outside a TestCase transaction, atomic blocks
+    add no savepoints, as in production.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.debate = make_debate(total_score=1)
+
+    def assertQueries(self, expected, request):
+        with QueryCounter() as counter:
+            response = request()
+        self.assertEqual(counter.count, expected, '\n'.join(counter.queries))
+        return response
+
+    def test_home(self):
+        response = self.assertQueries(1, lambda: self.client.get(reverse('home')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_result(self):
+        url = reverse('result', args=[self.debate.id])
+        # Includes parsing and storing the debate's structured results, once
+        response = self.assertQueries(6, lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 200)
+        # The rendered fragments now come from the page cache
+        response = self.assertQueries(3, lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 200)
+
+    def test_hall_of_fame(self):
+        response = self.assertQueries(1, lambda: self.client.get(reverse('hall_of_fame')))
+        self.assertContains(response, 'Tabs vs Spaces')
+
+    def test_update_approval(self):
+        url = reverse('update_approval', args=[self.debate.id])
+        response = self.assertQueries(5, lambda: self.client.post(
+            url, json.dumps({'field': 'judgment', 'value': 'approved'}), content_type='application/json'
+        ))
+        self.assertEqual(response.json(), {'success': True, 'new_value': 'approved'})
+
+
+def run_in_threads(fn, args, threads=8):
+    """Call fn with each of args from a pool of threads, each closing its own connection"""
+    def run(arg):
+        try:
+            return fn(arg)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(run, args))
+
+
+class VoteConcurrencyTests(TransactionTestCase):
+    """Many threads voting on one debate at once"""
+
+    VOTES = 200
+    VOTERS = 20
+
+    def setUp(self):
+        reset_vote_buffer()
+        self.addCleanup(reset_vote_buffer)
+        self.debate = make_debate()
+
+    def vote(self, seed):
+        rng = random.Random(seed)
+        cast_vote(self.debate.id, f'10.0.0.{rng.randrange(self.VOTERS)}',
+                  rng.choice(list(VOTE_COLUMNS)), rng.choice(Debate.ApprovalStatus.values))
+
+    def assertCountersMatchRecords(self):
+        debate = Debate.objects.get(id=self.debate.id)
+        expected = ApprovalRecord.objects.filter(debate=debate).aggregate(**{
+            column: Count('id', filter=Q(field=field, value=value))
+            for field, (approvals, disapprovals, _) in VOTE_COLUMNS.items()
+            for column, value in ((approvals, Debate.ApprovalStatus.APPROVED),
+                                  (disapprovals, Debate.ApprovalStatus.DISAPPROVED))
+        })
+        self.assertEqual({column: getattr(debate, column) for column in expected}, expected)
+        self.assertEqual(
+            debate.total_score,
+            debate.evaluation_approval_score + debate.judgment_approval_score
+        )
+        # The random votes leave some standing, so the check is not vacuous
+        self.assertGreater(sum(expected.values()), 0)
+
+    @override_settings(VOTE_MODE='direct')
+    def test_direct_votes(self):
+        run_in_threads(self.vote, range(self.VOTES))
+        self.assertCountersMatchRecords()
+
+    @override_settings(VOTE_MODE='buffered', VOTE_BUFFER={'BACKEND': 'memory', 'FLUSH_INTERVAL': None})
+    def test_buffered_votes(self):
+        run_in_threads(self.vote, range(self.VOTES))
+        # Counters only move when the buffer is flushed
+        self.assertEqual(Debate.objects.get(id=self.debate.id).total_score, 0)
+        self.assertEqual(flush_votes(), 1)
+        self.assertCountersMatchRecords()
+        self.assertEqual(flush_votes(), 0)
+
+    @override_settings(VOTE_MODE='buffered', VOTE_BUFFER={'BACKEND': 'memory', 'FLUSH_INTERVAL': None})
+    def test_flushes_during_buffered_votes(self):
+        # Every eighth task flushes instead of voting, interleaving flushes with votes
+        run_in_threads(lambda i: flush_votes() if i % 8 == 0 else self.vote(i), range(self.VOTES))
+        flush_votes()
+        self.assertCountersMatchRecords()
+
+
+class CreditConcurrencyTests(TransactionTestCase):
+    """
+    Credit reservations and refunds racing from many threads
+
+    These run against the configured database, so with DATABASE_URL set
+    they exercise PostgreSQL's row locking as well as SQLite's.
+    """
+
+    IP = '192.0.2.1'
+
+    def reserve(self, _=None):
+        return IPCreditUsage.reserve_credits(self.IP, Decimal('1.00'))
+
+    def test_reservations_stay_within_limit(self):
+        granted = run_in_threads(self.reserve, range(60))
+        self.assertEqual(sum(granted), IPCreditUsage.CREDIT_LIMIT)
+        self.assertEqual(IPCreditUsage.get_usage(self.IP), IPCreditUsage.CREDIT_LIMIT)
+
+    def test_concurrent_first_reservations(self):
+        # Released together, so the threads race to insert the IP's row
+        threads = 8
+        barrier = threading.Barrier(threads)
+        granted = run_in_threads(lambda _: barrier.wait() is not None and self.reserve(), range(threads), threads)
+        self.assertEqual(sum(granted), threads)
+        self.assertEqual(IPCreditUsage.get_usage(self.IP), threads)
+
+    def lose_insert_race(self, credits_used):
+        """
+        Make the next reservation's INSERT find a row another request just committed
+
+        The competing first reservation lands after the reservation's UPDATE
+        found no row, and before its own INSERT.
+        """
+        atomic = transaction.atomic
+
+        @contextmanager
+        def racing_atomic(*args, **kwargs):
+            if not IPCreditUsage.objects.filter(ip_address=self.IP).exists():
+                IPCreditUsage.objects.create(ip_address=self.IP, credits_used=credits_used)
+            with atomic(*args, **kwargs):
+                yield
+
+        return mock.patch('debate.models.transaction.atomic', racing_atomic)
+
+    def test_first_reservation_that_loses_the_insert_race(self):
+        with self.lose_insert_race(Decimal('1.00')):
+            self.assertTrue(self.reserve())
+        self.assertEqual(IPCreditUsage.get_usage(self.IP), 2)
+
+    def test_insert_race_at_the_limit_is_refused(self):
+        with self.lose_insert_race(IPCreditUsage.CREDIT_LIMIT):
+            self.assertFalse(self.reserve())
+        self.assertEqual(IPCreditUsage.get_usage(self.IP), IPCreditUsage.CREDIT_LIMIT)
+
+    def test_refunds_never_go_below_zero(self):
+        for _ in range(5):
+            self.reserve()
+        run_in_threads(lambda _: IPCreditUsage.refund_credits(self.IP, Decimal('1.00')), range(20))
+        self.assertEqual(IPCreditUsage.get_usage(self.IP), 0)
+
+    def test_reservations_racing_refunds(self):
+        def reserve_or_refund(i):
+            if i % 3 == 0:
+                IPCreditUsage.refund_credits(self.IP, Decimal('1.00'))
+            else:
+                self.reserve()
+
+        run_in_threads(reserve_or_refund, range(90))
+        used = IPCreditUsage.get_usage(self.IP)
+        self.assertGreaterEqual(used, 0)
+        self.assertLessEqual(used, IPCreditUsage.CREDIT_LIMIT)
+
+    def test_balance_deductions_stay_within_balance(self):
+        start = Decimal(str(CreditBalance._meta.get_field('balance').get_default()))
+        granted = run_in_threads(lambda _: CreditBalance.deduct_credits(Decimal('1.00')), range(40))
+        self.assertEqual(sum(granted), start)
+        self.assertEqual(CreditBalance.get_credits(), 0)
+
+
+class LogHandlerTests(SimpleTestCase):
+    """The queued LLM call log handler, in the configuring process and in forked ones"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'llm_calls.log')
+        self.handler = QueuedTimedRotatingFileHandler(self.filename)
+        self.handler.setFormatter(JsonFormatter())
+        self.addCleanup(self.handler.close)
+
+    def log(self, message):
+        self.handler.handle(logging.makeLogRecord({'name': 'llm_calls', 'msg': message}))
+
+    def read(self, filename):
+        with open(filename, encoding='utf-8') as f:
+            return [json.loads(line)['message'] for line in f]
+
+    def test_records_reach_the_file(self):
+        self.log('first')
+        self.log('second')
+        self.handler.close()
+        self.assertEqual(self.read(self.filename), ['first', 'second'])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_forked_process_writes_its_own_file(self):
+        self.log('before fork')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.log('in child')
+                self.handler.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.log('after fork')
+        self.handler.close()
+        self.assertEqual(self.read(self.filename), ['before fork', 'after fork'])
+        root, ext = os.path.splitext(self.filename)
+        self.assertEqual(self.read(f'{root}.{pid}{ext}'), ['in child'])
+
+
+class ExportTests(TransactionTestCase):
+    """export_debates files and the incremental export cursor"""
+
+    def export(self, *args):
+        """Run an export into a directory of its own; returns (output, export files)"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        out = io.StringIO()
+        call_command('export_debates', '--output-dir', directory.name, *args, stdout=out)
+        paths = find_exports([os.path.join(directory.name, pattern) for pattern in EXPORT_PATTERNS])
+        return out.getvalue(), paths
+
+    def exported_ids(self, paths):
+        return sorted(record['id'] for path in paths for record in iter_records(path))
+
+    def test_cursor_skips_debates_inserted_during_the_export(self):
+        first, second = make_debate(), make_debate()
+        LLMInteraction.objects.create(debate=first, prompt_name='analyze', prompt_text='p', response='r')
+        inserted = []
+
+        def insert_then_record(row):
+            # Runs while interactions are written, after the debates file is done
+            if not inserted:
+                inserted.append(make_debate())
+            return interaction_record(row)
+
+        with mock.patch('debate.management.commands.export_debates.interaction_record',
+                        side_effect=insert_then_record):
+            output, paths = self.export()
+        self.assertIn(f'--after-id {second.id}\n', output)
+        self.assertEqual(self.exported_ids(paths), [first.id, second.id])
+
+        output, paths = self.export('--after-id', str(second.id))
+        self.assertEqual(self.exported_ids(paths), [inserted[0].id])
+
+    def test_sharded_cursor_is_the_last_exported_debate(self):
+        debates = [make_debate() for _ in range(5)]
+        output, paths = self.export('--shards', '2')
+        self.assertEqual(len(paths), 2)
+        self.assertIn(f'--after-id {debates[-1].id}\n', output)
+        self.assertEqual(self.exported_ids(paths), [debate.id for debate in debates])
+
+    def test_gzipped_json_exports_are_found(self):
+        debate = make_debate()
+        output, paths = self.export('--format', 'json', '--gzip')
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(paths[0].endswith('.json.gz'))
+        self.assertEqual(self.exported_ids(paths), [debate.id])
+
+
+class SlowStage(PipelineStage):
+    """Makes one LLM call, reporting progress as it goes"""
+    requires = ('text',)
+    provides = ('slow',)
+    timeout = 0.5
+
+    def begin(self, context):
+        self.update_progress(context, {'stage': 'slow', 'percent': 10, 'message': 'Starting...'})
+
+    def llm_request(self, context):
+        return dict(
+            prompt=context['text'],
+            prompt_name='slow',
+            use_cache=False,
+            user_update_callback=lambda data: self.update_progress(context, data)
+        )
+
+    def finish(self, context, response):
+        context['slow'] = response
+        return context
+
+
+class PipelineCancellationTests(SimpleTestCase):
+    """Stages still running when their pipeline gives up"""
+
+    def test_timed_out_stage_stops_calling_and_reporting(self):
+        release = threading.Event()
+        calls = []
+
+        def provider_call(system_prompt, prompt, **kwargs):
+            calls.append(threading.current_thread())
+            release.wait(5)
+            # Retryable at once, so only the cancellation stops a second call
+            raise ProviderError('overloaded', 'gemini', 503, retry_after=0)
+
+        events = []
+        with mock.patch('debate.services.llm.clients.gemini_chat', side_effect=provider_call):
+            with self.assertRaises(StageTimeoutError):
+                AnalysisPipeline([SlowStage()]).process({'text': 'Alice: tabs.', 'progress_callback': events.append})
+            reported = list(events)
+            release.set()
+            calls[0].join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(reported[-1]['stage'], 'error')
+        # Nothing the stage reported after the timeout got through
+        self.assertEqual(events, reported)
+
+
+def openrouter_response(content):
+    """A successful OpenRouter HTTP response carrying content"""
+    return mock.Mock(status_code=200, json=lambda: {'choices': [{'message': {'content': content}}]})
+
+
+class LLMRepairTests(SimpleTestCase):
+    """Repairing responses that lack some expected tags, and falling back to regenerating them"""
+
+    PROMPT = 'Judge the debate.'
+    TAGS = ['winner', 'reasoning']
+
+    def setUp(self):
+        get_response_cache().clear()
+        self.addCleanup(get_response_cache().clear)
+        self.prompts = []
+
+    def call(self, *replies):
+        """Run make_llm_call against OpenRouter replies (strings, or exceptions to raise)"""
+        replies = list(replies)
+
+        def openrouter_chat(system_prompt, prompt, **kwargs):
+            self.prompts.append(prompt)
+            reply = replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return openrouter_response(reply)
+
+        with mock.patch('debate.services.llm.clients.openrouter_chat', side_effect=openrouter_chat):
+            return make_llm_call(self.PROMPT, use_openrouter=True, prompt_name='judge', expected_tags=self.TAGS)
+
+    def repair_prompt(self, response, missing):
+        return load_prompt('repair.txt').format(missing_tags=missing, response=response)
+
+    def cached(self):
+        call = LLMCall(self.PROMPT, use_openrouter=True, prompt_name='judge', expected_tags=self.TAGS)
+        return call.cache.get('judge', call.cache_key)
+
+    def test_repair_appends_the_missing_sections(self):
+        content = self.call('<winner>Alice</winner>', 'Sure: <reasoning>Tabs win.</reasoning>')
+        self.assertEqual(content, '<winner>Alice</winner>\n\n<reasoning>Tabs win.</reasoning>')
+        self.assertEqual(self.prompts, [
+            self.PROMPT,
+            self.repair_prompt('<winner>Alice</winner>', '<reasoning>')
+        ])
+        # The stitched response answers, and is cached under, the original prompt
+        self.assertEqual(self.cached(), content)
+        self.assertEqual(self.call(), content)
+        self.assertEqual(len(self.prompts), 2)
+
+    def test_failed_repair_falls_back_to_regenerating(self):
+        full = '<winner>Alice</winner><reasoning>Tabs win.</reasoning>'
+        content = self.call('<winner>Alice</winner>', 'I cannot add that.', full)
+        self.assertEqual(content, full)
+        self.assertEqual(self.prompts, [
+            self.PROMPT,
+            self.repair_prompt('<winner>Alice</winner>', '<reasoning>'),
+            f'{LLMCall.RETRY_REMINDER}\n\n{self.PROMPT}'
+        ])
+        self.assertEqual(self.cached(), full)
+
+    def test_provider_error_during_repair_repairs_again(self):
+        content = self.call(
+            '<winner>Alice</winner>',
+            ProviderError('overloaded', 'openrouter', 503, retry_after=0),
+            '<reasoning>Tabs win.</reasoning>'
+        )
+        self.assertEqual(content, '<winner>Alice</winner>\n\n<reasoning>Tabs win.</reasoning>')
+        repair = self.repair_prompt('<winner>Alice</winner>', '<reasoning>')
+        self.assertEqual(self.prompts, [self.PROMPT, repair, repair])
+
+    def test_response_missing_every_tag_is_regenerated(self):
+        full = '<winner>Alice</winner><reasoning>Tabs win.</reasoning>'
+        content = self.call('No tags at all.', full)
+        self.assertEqual(content, full)
+        self.assertEqual(self.prompts, [self.PROMPT, f'{LLMCall.RETRY_REMINDER}\n\n{self.PROMPT}'])
+
+
+class TagTreeTests(SimpleTestCase):
+    """The single-pass tag tokenizer, fed whole or in chunks"""
+
+    RESPONSE = (
+        '<argument_map>\n<topic>Indentation</topic>\n'
+        '<p1_argument>Tabs FOR <p1> are configurable.</p1_argument>\n'
+        '<p2_argument>Spaces look the same.</p2_argument>\n</argument_map>\n'
+        '<winner>P1</winner>'
+    )
+
+    @staticmethod
+    def nodes(tree):
+        return sorted(
+            (node.name, node.tag_start, node.start, node.end, node.tag_end)
+            for nodes in tree.index.values() for node in nodes
+        )
+
+    def test_nested_tags(self):
+        tree = TagTree(self.RESPONSE)
+        self.assertEqual([node.name for node in tree.root.children], ['argument_map', 'winner'])
+        argument_map = tree.find('argument_map')
+        self.assertEqual([node.name for node in argument_map.children], ['topic', 'p1_argument', 'p2_argument'])
+        self.assertEqual(argument_map.find('topic').text, 'Indentation')
+        # Content keeps the nested markup exactly as written
+        self.assertTrue(argument_map.raw.startswith('\n<topic>Indentation</topic>'))
+        self.assertEqual(tree.get('p1_argument'), 'Tabs FOR <p1> are configurable.')
+        self.assertEqual(tree.replace({'argument_map': '[map]'}), '[map]\n<winner>P1</winner>')
+
+    def test_unclosed_and_stray_tags(self):
+        tree = TagTree('<winner>P1 <reasoning>Tabs win.</winner></strength><advice>More')
+        self.assertEqual(tree.get('winner'), 'P1 <reasoning>Tabs win.')
+        # Closing the outer tag leaves the one opened inside it unclosed
+        self.assertIsNone(tree.find('reasoning'))
+        self.assertFalse(tree.find_open('reasoning').closed)
+        self.assertEqual(tree.find_open('advice').raw, 'More')
+        self.assertEqual(tree.missing(['winner', 'reasoning', 'strength', 'advice']),
+                         ['reasoning', 'strength', 'advice'])
+
+    def test_placeholder_inside_a_tag_does_not_close_it(self):
+        tree = TagTree('<p1_argument>FOR <p1></p1_argument><p2>Bob</p2>')
+        self.assertEqual(tree.get('p1_argument'), 'FOR <p1>')
+        self.assertEqual(tree.get('p2'), 'Bob')
+
+    def test_chunk_boundaries_inside_tags(self):
+        expected = self.nodes(TagTree(self.RESPONSE))
+        for size in range(1, 12):
+            tree = TagTree()
+            for start in range(0, len(self.RESPONSE), size):
+                tree.feed(self.RESPONSE[start:start + size])
+            self.assertEqual(self.nodes(tree), expected, f'chunks of {size}')
+            self.assertEqual(tree.text, self.RESPONSE)
+
+    def test_feed_reports_tags_as_they_close(self):
+        tree = TagTree('<topic>Inden')
+        self.assertEqual(tree.find_open('topic').raw, 'Inden')
+        tree.feed('tation</to')
+        self.assertIsNone(tree.find('topic'))
+        tree.feed('pic> and <p1')
+        self.assertEqual(tree.get('topic'), 'Indentation')
+        self.assertIsNone(tree.find_open('p1'))
+        tree.feed('>Alice</p1>')
+        self.assertEqual(tree.get('p1'), 'Alice')
+
+    def test_strip_tags_drops_a_tag_cut_off_at_the_end(self):
+        self.assertEqual(strip_tags('<topic>Indentation</topic> and <p1_arg'), ' Indentation  and ')
+
+
+class RateLimitTests(SimpleTestCase):
+    """Token buckets in the in-memory store, on a fake clock"""
+
+    def setUp(self):
+        patcher = mock.patch('debate.services.ratelimit.time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.monotonic.return_value = 1000.0
+        self.clock.sleep.side_effect = self.advance
+
+    def advance(self, seconds):
+        self.clock.monotonic.return_value += seconds
+
+    def limiter(self, **limits):
+        return RateLimiter(MemoryBucketStore(), limits)
+
+    def test_burst_then_wait_for_refill(self):
+        limiter = self.limiter(ANALYSIS_PER_IP={'RATE': 2, 'BURST': 3})
+        self.assertEqual([limiter.take('ANALYSIS_PER_IP', 'a') for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.take('ANALYSIS_PER_IP', 'a'), 0.5)
+        # Other keys have buckets of their own
+        self.assertEqual(limiter.take('ANALYSIS_PER_IP', 'b'), 0)
+
+        self.advance(0.25)
+        self.assertAlmostEqual(limiter.take('ANALYSIS_PER_IP', 'a'), 0.25)
+        self.advance(0.25)
+        self.assertEqual(limiter.take('ANALYSIS_PER_IP', 'a'), 0)
+
+    def test_refill_stops_at_burst(self):
+        limiter = self.limiter(ANALYSIS_GLOBAL={'RATE': 1, 'BURST': 2})
+        limiter.take('ANALYSIS_GLOBAL')
+        self.advance(3600)
+        self.assertEqual([limiter.take('ANALYSIS_GLOBAL') for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(limiter.take('ANALYSIS_GLOBAL'), 1.0)
+
+    def test_refund_returns_tokens_up_to_burst(self):
+        limiter = self.limiter(ANALYSIS_PER_IP={'RATE': 0.001, 'BURST': 2})
+        limiter.refund('ANALYSIS_PER_IP', 'a')
+        self.assertEqual([limiter.take('ANALYSIS_PER_IP', 'a') for _ in range(2)], [0, 0])
+        self.assertTrue(limiter.take('ANALYSIS_PER_IP', 'a'))
+
+        limiter.refund('ANALYSIS_PER_IP', 'a')
+        self.assertEqual(limiter.take('ANALYSIS_PER_IP', 'a'), 0)
+        self.assertTrue(limiter.take('ANALYSIS_PER_IP', 'a'))
+
+    def test_global_rejection_refunds_the_per_ip_token(self):
+        limiter = self.limiter(
+            ANALYSIS_PER_IP={'RATE': 0.001, 'BURST': 1},
+            ANALYSIS_GLOBAL={'RATE': 1, 'BURST': 1}
+        )
+        self.assertEqual(limiter.check_analysis('192.0.2.1'), 0)
+        self.assertAlmostEqual(limiter.check_analysis('192.0.2.2'), 1.0)
+        self.advance(1)
+        # Its per-IP bucket would take over 15 minutes to refill had the token been kept
+        self.assertEqual(limiter.check_analysis('192.0.2.2'), 0)
+
+    def test_missing_or_zero_rate_is_unlimited(self):
+        limiter = self.limiter(ANALYSIS_GLOBAL={'RATE': 0, 'BURST': 1})
+        self.assertEqual([limiter.take('ANALYSIS_GLOBAL') for _ in range(5)], [0] * 5)
+        self.assertEqual(limiter.take('PROVIDER:gemini'), 0)
+
+    def test_least_recently_used_bucket_is_dropped_full(self):
+        limiter = RateLimiter(MemoryBucketStore(max_keys=2), {'ANALYSIS_PER_IP': {'RATE': 0.001, 'BURST': 1}})
+        for key in ('a', 'b', 'c'):
+            self.assertEqual(limiter.take('ANALYSIS_PER_IP', key), 0)
+        self.assertTrue(limiter.take('ANALYSIS_PER_IP', 'c'))
+        self.assertEqual(limiter.take('ANALYSIS_PER_IP', 'a'), 0)
+
+    def test_throttle_waits_for_provider_tokens(self):
+        limiter = self.limiter(**{'PROVIDER:openrouter': {'RATE': 4, 'BURST': 1}})
+        for _ in range(3):
+            limiter.throttle('openrouter')
+        self.assertAlmostEqual(self.clock.monotonic.return_value, 1000.5)
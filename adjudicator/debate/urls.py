@@ -1,7 +1,7 @@
 from django.urls import path
 from .views.pages import home, result, update_approval, hall_of_fame, modify_argument
 from .views.analysis import analyze_stream
-from .views.debug import debug_info
+from .views.debug import debug_info, metrics
 
 urlpatterns = [
     path('', home, name='home'),
@@ -10,5 +10,6 @@ urlpatterns = [
     path('debate/<int:debate_id>/approve/', update_approval, name='update_approval'),
     path('hall-of-fame/', hall_of_fame, name='hall_of_fame'),
     path('debug/', debug_info, name='debug'),
+    path('metrics', metrics, name='metrics'),
     path('modify-argument/', modify_argument, name='modify_argument'),
 ] 
\ No newline at end of file
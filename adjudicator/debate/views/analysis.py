@@ -1,185 +1,109 @@
 from django.http import JsonResponse, HttpResponseForbidden, StreamingHttpResponse, HttpResponse
+from asgiref.sync import sync_to_async
 from decimal import Decimal
+import asyncio
 import json
-import re
+import math
 import time
 import logging
-from ..models import Debate
-from ..services.analysis import perform_analysis
-import csv
+from django.core.exceptions import ValidationError
+from ..models import AnalysisJob
+from ..services.jobs import submit_analysis, events_after, lost_job_message, TERMINAL_STAGES
+from ..services.ratelimit import get_rate_limiter
 from ..models import IPCreditUsage
 
 
 logger = logging.getLogger('llm_calls')
 
-def analyze_stream(request):
+# Seconds between checks for new progress events
+STREAM_POLL_INTERVAL = 0.5
+# Seconds between checks that a job with no new events is still alive
+STREAM_STATUS_INTERVAL = 5
+
+async def analyze_stream(request):
+    """
+    Queue a debate for analysis via POST, then stream its progress to the follow-up GET
+    
+    The analysis itself runs as an AnalysisJob on the job queue. The GET
+    handler only replays the job's stored progress events, so a dropped
+    connection can reconnect (with Last-Event-ID) and pick up where it left
+    off, and a slow analysis holds no web worker.
+    """
     if request.method == 'POST':
-        request.session['debate_text'] = request.POST.get('debate_text')
+        text = request.POST.get('debate_text')
+        if not text:
+            return JsonResponse({'error': 'Please provide a debate to analyze.'}, status=400)
         
         # Get client IP and check credits here, before starting analysis
         ip_address = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR'))
         if ip_address:
             ip_address = ip_address.split(',')[0]
             
-        # Check if IP has remaining credits
+        # Turn away bursts before touching the database or any provider
+        retry_after = await sync_to_async(get_rate_limiter().check_analysis, thread_sensitive=False)(ip_address)
+        if retry_after:
+            response = JsonResponse({
+                'error': f'Too many analyses requested. Please try again in {math.ceil(retry_after)} seconds.'
+            }, status=429)
+            response['Retry-After'] = str(math.ceil(retry_after))
+            return response
+        
+        # Charge the IP up front; the credits are refunded if the analysis fails
         credit_cost = Decimal('1.00')
-        if not IPCreditUsage.can_use_credits(ip_address, credit_cost):
+        if not await sync_to_async(IPCreditUsage.reserve_credits)(ip_address, credit_cost):
             return JsonResponse({
-                'error': 'You have reached your credit limit of 15. Please try again later.'
+                'error': f'You have reached your credit limit of {IPCreditUsage.CREDIT_LIMIT}. Please try again later.'
             }, status=429)
-            
-        # Record IP usage
-        IPCreditUsage.add_usage(ip_address, credit_cost)
         
-        return JsonResponse({'status': 'ok'})
+        try:
+            job = await sync_to_async(submit_analysis)(text, ip_address, credit_cost)
+        except Exception:
+            await sync_to_async(IPCreditUsage.refund_credits)(ip_address, credit_cost)
+            raise
+        await request.session.aset('analysis_job', str(job.id))
+        
+        return JsonResponse({'status': 'ok', 'job_id': str(job.id)})
     
-    text = request.session.get('debate_text')
-    if not text:
+    job_id = request.GET.get('job') or await request.session.aget('analysis_job')
+    if not job_id:
         return HttpResponseForbidden()
+    try:
+        job = await AnalysisJob.objects.aget(id=job_id)
+    except (AnalysisJob.DoesNotExist, ValidationError):
+        return HttpResponse(status=404)
+    
+    # Resume after the last event the browser saw
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_seq = 0
         
-    def event_stream():
-        # Track last update percentage for smoother progress
-        last_percent = 0
-        analysis_snippets = {}
-        
-        def send_progress_update(data):
-            nonlocal last_percent, analysis_snippets
-            
-            # Save data in appropriate category if it has content
-            if 'content_snippet' in data and data.get('content_type'):
-                content_type = data.get('content_type')
-                analysis_snippets[content_type] = data.get('content_snippet')
-            
-            # Always update the percentage if it's bigger than last update
-            if data.get('percent', 0) > last_percent:
-                last_percent = data.get('percent', 0)
-            
-            # Include any snippets we've collected so far
-            response_data = {
-                'stage': data.get('stage', 'processing'),
-                'message': data.get('message', 'Processing...'),
-                'percent': last_percent,
-                'snippets': analysis_snippets
-            }
-            
-            # Return the formatted event
-            return "data: " + json.dumps(response_data) + "\n\n"
-        
-        try:
-            # Initial loading state
-            yield "data: " + json.dumps({
-                'stage': 'analyzing',
-                'message': 'Identifying participants and arguments...',
-                'percent': 5,
-                'snippets': {}
-            }) + "\n\n"
-            
-            # Create a queue for progress updates
-            from queue import Queue
-            import queue
-            update_queue = Queue()
-            
-            def queue_update(data):
-                update_queue.put(data)
-                
-            # Start analysis in a separate thread
-            import threading
-            result = {'data': None, 'error': None}
-            
-            def run_analysis():
-                try:
-                    result['data'] = perform_analysis(text, progress_callback=queue_update)
-                except Exception as e:
-                    result['error'] = str(e)
-                finally:
-                    # Mark completion
-                    update_queue.put({'stage': '_done'})
-            
-            # Start analysis thread
-            analysis_thread = threading.Thread(target=run_analysis)
-            analysis_thread.start()
-            
-            # Process updates as they come in
-            while True:
-                try:
-                    # Get next update, wait up to 0.5 seconds
-                    update = update_queue.get(timeout=0.5)
-                    
-                    # Check if analysis is complete
-                    if update.get('stage') == '_done':
-                        break
-                        
-                    # Send the update
-                    yield send_progress_update(update)
-                    
-                except queue.Empty:
-                    # Send heartbeat to keep connection open
-                    yield "data: {\"heartbeat\": true}\n\n"
-            
-            # Analysis is complete, check for error
-            if result['error']:
-                raise Exception(result['error'])
+    async def event_stream():
+        nonlocal last_seq
+        last_status_check = time.monotonic()
+        while True:
+            events = [event async for event in events_after(job.id, last_seq)]
+            if not events:
+                # A job that was lost will never send a terminal event
+                if time.monotonic() - last_status_check >= STREAM_STATUS_INTERVAL:
+                    last_status_check = time.monotonic()
+                    message = await sync_to_async(lost_job_message)(job.id)
+                    if message:
+                        yield "data: " + json.dumps({'stage': 'error', 'message': message, 'percent': 0}) + "\n\n"
+                        return
                 
-            # Get the analysis result
-            result = result['data']
-            
-            # Create debate record
-            debate = Debate.objects.create(
-                original_text=text,
-                belligerent_1=result['belligerent_1'],
-                belligerent_2=result['belligerent_2'],
-                summary_1=result['summary_1'],
-                summary_2=result['summary_2'],
-                winner=result['winner'],
-                credit_cost=Decimal('1.0'),
-                analysis=result['analysis'],
-                evaluation=result['evaluation'],
-                judgment=result['judgment'],
-                title=result['title'],
-                evaluation_formatted=result['evaluation_formatted'],
-                judgment_formatted=result['judgment_formatted']
-            )
-            
-            debate_id = debate.id
-            logger.info(f"Created debate with ID: {debate_id}")
-            redirect_url = f'/result/{debate_id}/'
-            
-            # Send the final completion data as a progress update
-            final_data = {
-                'stage': 'complete',
-                'message': 'Analysis complete!',
-                'percent': 100,
-                'redirect': redirect_url,
-                'debate_id': debate_id,
-                'winner': result['winner'],
-                'judgment': result['judgment']
-            }
-            
-            # Send the final update with all the necessary data
-            yield "data: " + json.dumps(final_data) + "\n\n"
-            
-            del request.session['debate_text']
-            
-        except Exception as e:
-            if 'Resource has been exhausted' in str(e) or '429' in str(e):
-                yield "data: " + json.dumps({
-                    'stage': 'error',
-                    'message': (
-                        "I'm currently using free-tier API access while testing. "
-                        "Please wait a minute and try again. "
-                        "Rate limits will be increased once cost controls are in place."
-                    ),
-                    'percent': 0
-                }) + "\n\n"
-            else:
-                # Handle other errors
-                yield "data: " + json.dumps({
-                    'stage': 'error',
-                    'message': str(e),
-                    'percent': 0
-                }) + "\n\n"
-
-            if 'debate_text' in request.session:
-                del request.session['debate_text']
+                # Send heartbeat to keep connection open
+                yield "data: {\"heartbeat\": true}\n\n"
+                await asyncio.sleep(STREAM_POLL_INTERVAL)
+                continue
+            
+            last_status_check = time.monotonic()
+            for event in events:
+                last_seq = event.seq
+                yield f"id: {event.seq}\ndata: " + json.dumps(event.data) + "\n\n"
+                if event.data.get('stage') in TERMINAL_STAGES:
+                    if await request.session.aget('analysis_job') == str(job.id):
+                        await request.session.apop('analysis_job', None)
+                    return
     
     return StreamingHttpResponse(event_stream(), content_type='text/event-stream')
\ No newline at end of file
@@ -1,10 +1,15 @@
-from django.http import JsonResponse
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from ..models import Debate
+from ..services.cache import get_response_cache
+from ..services.geo import get_ip_classifier
+from ..services.metrics import collect, get_metrics, render as render_metrics
 
 def debug_info(request):
     """A debugging view to show information about recent debates"""
-    recent_debates = Debate.objects.order_by('-created_at')[:5]
+    recent_debates = Debate.objects.summaries().order_by('-created_at')[:5]
     
     debates_info = []
     for debate in recent_debates:
@@ -15,9 +20,27 @@ def debug_info(request):
             'url': f'/result/{debate.id}/'
         })
     
+    response_cache = get_response_cache()
+    cache_stats = response_cache.stats() if response_cache else None
+    ip_classifier = get_ip_classifier()
+    geo_stats = ip_classifier.stats() if ip_classifier else None
+    
     if request.headers.get('Accept') == 'application/json':
-        return JsonResponse({'recent_debates': debates_info})
+        return JsonResponse({'recent_debates': debates_info, 'llm_cache': cache_stats, 'geoip': geo_stats})
     else:
         return render(request, 'debate/debug.html', {
-            'recent_debates': recent_debates
-        }) 
\ No newline at end of file
+            'recent_debates': recent_debates,
+            'cache_stats': cache_stats,
+            'geo_stats': geo_stats
+        })
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, adding up the metrics of every worker process"""
+    token = getattr(settings, 'METRICS', {}).get('TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(
+        render_metrics(collect(get_metrics())),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -1,25 +1,27 @@
 from django.shortcuts import render, redirect
-from django.contrib import messages
-from ..models import Debate, CreditBalance, ApprovalRecord
-from ..services.analysis import perform_analysis, parse_evaluation_table
-from decimal import Decimal
+from ..models import Debate
+from ..services.analysis import build_structured_results, STRUCTURED_RESULTS_VERSION
+from ..services import pagecache, votes
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import SimpleLazyObject
 import logging
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 import json
-from django.db import models
 from ..models import IPCreditUsage
 
 logger = logging.getLogger('llm_calls')
 
+HALL_OF_FAME_PAGE_SIZE = 10
+
 def home(request):
     ip_address = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR'))
     if ip_address:
         ip_address = ip_address.split(',')[0]
     
     # Get IP-specific credit usage
-    usage, created = IPCreditUsage.objects.get_or_create(ip_address=ip_address)
-    credits_remaining = max(15 - usage.credits_used, 0)
+    credits_used = IPCreditUsage.get_usage(ip_address)
+    credits_remaining = max(IPCreditUsage.CREDIT_LIMIT - credits_used, 0)
     
     # Check if there's original text in the session
     debate_text = ""
@@ -34,99 +36,47 @@ def home(request):
     return render(request, 'debate/home.html', {
         'credits': credits_remaining,
         'debate_text': debate_text,
-        'total_credits_used': usage.credits_used
+        'total_credits_used': credits_used
     })
 
+def get_structured_results(debate):
+    results = debate.structured_results
+    if not results or results.get('version') != STRUCTURED_RESULTS_VERSION:
+        # Not parsed yet (older debate, see backfill_structured_results); parse once and keep it
+        results = build_structured_results(debate.evaluation_formatted, debate.judgment_formatted, debate.judgment)
+        Debate.objects.filter(id=debate.id).update(structured_results=results)
+    return results
+
 def result(request, debate_id):
-    debate = Debate.objects.get(id=debate_id)
-    evaluation_tables = parse_evaluation_table(debate.evaluation_formatted, debate.judgment_formatted)
-    
     # Store the original text in the session for the "Modify Argument" feature
-    request.session['original_text'] = debate.original_text
+    # (raises DoesNotExist for unknown debates)
+    original_text = pagecache.original_text(
+        debate_id,
+        lambda: Debate.objects.values_list('original_text', flat=True).get(id=debate_id)
+    )
+    request.session['original_text'] = original_text
+    
+    # The page is assembled from cached fragments; the debate is only loaded
+    # if one of them has to be rendered. It is shared with the context
+    # processors through the request.
+    debate = SimpleLazyObject(lambda: Debate.objects.get(id=debate_id))
+    request.debate = debate
     
     return render(request, 'debate/result.html', {
+        'debate_id': debate_id,
         'debate': debate,
-        'evaluation_tables': evaluation_tables,
-        'parse_failed': evaluation_tables is None,
-        'original_text': debate.original_text
+        'results': SimpleLazyObject(lambda: get_structured_results(debate)),
+        'vote_state': SimpleLazyObject(lambda: votes.vote_state(debate)),
+        'page_cache_ttl': pagecache.result_ttl(),
+        'original_text': original_text
     })
 
 @require_POST
 def update_approval(request, debate_id):
     try:
         data = json.loads(request.body)
-        debate = Debate.objects.get(id=debate_id)
-        
-        field = data['field']
-        value = data['value']
         ip_address = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR'))
-        
-        # Check if this IP has already voted
-        existing_record = ApprovalRecord.objects.filter(
-            debate=debate,
-            ip_address=ip_address,
-            field=field
-        ).first()
-        
-        if existing_record:
-            if existing_record.value == value:
-                # Remove the vote if clicking the same button again
-                if field == 'evaluation':
-                    if value == 'approved':
-                        debate.evaluation_approvals = models.F('evaluation_approvals') - 1
-                    else:
-                        debate.evaluation_disapprovals = models.F('evaluation_disapprovals') - 1
-                else:  # judgment
-                    if value == 'approved':
-                        debate.judgment_approvals = models.F('judgment_approvals') - 1
-                    else:
-                        debate.judgment_disapprovals = models.F('judgment_disapprovals') - 1
-                existing_record.delete()
-                value = None
-            else:
-                # Change vote from approve to disapprove or vice versa
-                if field == 'evaluation':
-                    if value == 'approved':
-                        debate.evaluation_approvals = models.F('evaluation_approvals') + 1
-                        debate.evaluation_disapprovals = models.F('evaluation_disapprovals') - 1
-                    else:
-                        debate.evaluation_approvals = models.F('evaluation_approvals') - 1
-                        debate.evaluation_disapprovals = models.F('evaluation_disapprovals') + 1
-                else:  # judgment
-                    if value == 'approved':
-                        debate.judgment_approvals = models.F('judgment_approvals') + 1
-                        debate.judgment_disapprovals = models.F('judgment_disapprovals') - 1
-                    else:
-                        debate.judgment_approvals = models.F('judgment_approvals') - 1
-                        debate.judgment_disapprovals = models.F('judgment_disapprovals') + 1
-                existing_record.value = value
-                existing_record.save()
-        else:
-            # New vote
-            if field == 'evaluation':
-                if value == 'approved':
-                    debate.evaluation_approvals = models.F('evaluation_approvals') + 1
-                else:
-                    debate.evaluation_disapprovals = models.F('evaluation_disapprovals') + 1
-            else:  # judgment
-                if value == 'approved':
-                    debate.judgment_approvals = models.F('judgment_approvals') + 1
-                else:
-                    debate.judgment_disapprovals = models.F('judgment_disapprovals') + 1
-            
-            ApprovalRecord.objects.create(
-                debate=debate,
-                ip_address=ip_address,
-                field=field,
-                value=value
-            )
-        
-        if field == 'evaluation':
-            debate.evaluation_approval = value
-        else:
-            debate.judgment_approval = value
-            
-        debate.save()
+        value = votes.cast_vote(debate_id, ip_address, data['field'], data['value'])
         
         return JsonResponse({
             'success': True,
@@ -138,17 +88,41 @@ def update_approval(request, debate_id):
             'error': str(e)
         }, status=400)
 
+def parse_page_cursor(cursor):
+    """
+    Parse a hall of fame cursor into (created_at, id)
+    
+    Returns:
+        tuple: The key of the last debate on the previous page, or None if
+            the cursor is missing or malformed
+    """
+    created_at, _, debate_id = (cursor or '').rpartition('_')
+    created_at = parse_datetime(created_at)
+    if created_at is None or not debate_id.isdigit():
+        return None
+    return created_at, int(debate_id)
+
+def page_cursor(debate):
+    return f'{debate.created_at.isoformat()}_{debate.id}'
+
 def hall_of_fame(request):
-    # Get debates with positive approval scores
-    top_debates = Debate.objects.annotate(
-        total_score=models.F('evaluation_approvals') - models.F('evaluation_disapprovals') + 
-                   models.F('judgment_approvals') - models.F('judgment_disapprovals')
-    ).filter(
-        total_score__gt=0
-    ).order_by('-created_at')[:10]
+    # Debates with positive approval scores, newest first, a page at a time
+    after = parse_page_cursor(request.GET.get('after'))
+    fetch = lambda: Debate.objects.summaries().top_recent(after)[:HALL_OF_FAME_PAGE_SIZE + 1]
+    if after is None:
+        # Only the first page is cached; older pages are cheap index range scans
+        top_debates = pagecache.hall_of_fame(fetch)
+    else:
+        top_debates = list(fetch())
+    
+    next_cursor = None
+    if len(top_debates) > HALL_OF_FAME_PAGE_SIZE:
+        top_debates = top_debates[:HALL_OF_FAME_PAGE_SIZE]
+        next_cursor = page_cursor(top_debates[-1])
     
     return render(request, 'debate/hall_of_fame.html', {
-        'top_debates': top_debates
+        'top_debates': top_debates,
+        'next_cursor': next_cursor
     })
 
 def modify_argument(request):
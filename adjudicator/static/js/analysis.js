@@ -171,9 +171,13 @@ class AnalysisManager {
           throw new Error(data.error || 'Network response was not ok');
         });
       }
-      
-      // Now create the EventSource to listen for updates
-      this.eventSource = new EventSource('/analyze-stream/');
+      return response.json();
+    })
+    .then(data => {
+      // Now create the EventSource to listen for updates on the queued job.
+      // The browser reconnects with Last-Event-ID, so the stream resumes
+      // where it left off after a dropped connection.
+      this.eventSource = new EventSource('/analyze-stream/?job=' + encodeURIComponent(data.job_id));
       
       // Set up event handlers
       this.eventSource.onopen = this.handleEventSourceOpen.bind(this);
@@ -208,6 +212,11 @@ class AnalysisManager {
   handleEventSourceError(e) {
     console.error('Error with EventSource connection:', e);
     
+    // The browser is already retrying; the job keeps running server-side
+    if (this.eventSource && this.eventSource.readyState === EventSource.CONNECTING) {
+      return;
+    }
+    
     // Only update state if we're still loading (avoid overwriting completion)
     if (this.state.isLoading) {
       this.updateState({